@@ -0,0 +1,140 @@
+"""Benchmark the OpenTable iCal sync pipeline against a synthetic feed.
+
+    python bench/bench_ical_sync.py [--events 1000] [--rtt-ms 25]
+
+Generates an N-event VCALENDAR, then runs three syncs through
+main._sync_ical_content against an in-memory reservations table:
+
+    cold      — empty table, every event is an insert
+    warm      — same feed again, every event unchanged (no writes)
+    churn     — 10% of events edited, 5% cancelled
+
+Each DB call sleeps --rtt-ms to model the Railway → Supabase round trip, so the
+wall time reflects what a host waits for. The legacy row shows what the old
+SELECT + UPDATE/INSERT-per-event loop would have cost for the same feed.
+"""
+import argparse
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+os.environ.setdefault("SUPABASE_URL", "http://127.0.0.1:9")
+os.environ.setdefault("SUPABASE_KEY", "bench")
+os.environ.setdefault("ICAL_POLL_ENABLED", "0")
+
+import main  # noqa: E402
+
+RID = "bench0000-0000-4000-8000-000000000001"
+
+
+class _Result:
+    def __init__(self, data):
+        self.data = data
+
+
+class _Query:
+    def __init__(self, client, table):
+        self.client  = client
+        self.table   = table
+        self.filters = []
+        self.op      = "select"
+        self.payload = None
+
+    def select(self, *_cols, **_kw):
+        return self
+
+    def eq(self, col, val):
+        self.filters.append(lambda r: r.get(col) == val)
+        return self
+
+    def in_(self, col, vals):
+        vals = set(vals)
+        self.filters.append(lambda r: r.get(col) in vals)
+        return self
+
+    def upsert(self, rows, on_conflict="", **_kw):
+        self.op, self.payload = "upsert", rows
+        return self
+
+    def execute(self):
+        self.client.calls += 1
+        time.sleep(self.client.rtt)
+        rows = self.client.tables.setdefault(self.table, {})
+        if self.op == "upsert":
+            for r in self.payload:
+                key = (r["restaurant_id"], r["external_uid"])
+                rows.setdefault(key, {"id": f"res-{len(rows)}"}).update(r)
+            return _Result(self.payload)
+        return _Result([dict(r) for r in rows.values() if all(f(r) for f in self.filters)])
+
+
+class _FakeSupabase:
+    def __init__(self, rtt: float):
+        self.rtt    = rtt
+        self.calls  = 0
+        self.tables = {}
+
+    def table(self, name):
+        return _Query(self, name)
+
+
+def _feed(n: int, edited: float = 0.0, cancelled: float = 0.0) -> bytes:
+    base  = datetime(2026, 11, 6, 17, 0)
+    n_edit, n_cancel = int(n * edited), int(n * cancelled)
+    lines = ["BEGIN:VCALENDAR", "VERSION:2.0", "PRODID:-//OpenTable//bench//EN"]
+    for i in range(n):
+        start = base + timedelta(days=i // 40, minutes=15 * (i % 40))
+        size  = 2 + i % 5
+        if i < n_edit:
+            size += 1
+        lines += [
+            "BEGIN:VEVENT",
+            f"UID:ot-{i:06d}@opentable.com",
+            f"SUMMARY:Guest {i}, Bench ({size})",
+            f"DTSTART:{start:%Y%m%dT%H%M%S}",
+            f"DTEND:{start + timedelta(minutes=90):%Y%m%dT%H%M%S}",
+            f"DESCRIPTION:Party of {size}. Confirmation #{100000 + i}",
+        ]
+        if n_edit <= i < n_edit + n_cancel:
+            lines.append("STATUS:CANCELLED")
+        lines.append("END:VEVENT")
+    lines.append("END:VCALENDAR")
+    return ("\r\n".join(lines) + "\r\n").encode()
+
+
+def _run(fake: _FakeSupabase, label: str, content: bytes) -> None:
+    fake.calls = 0
+    t0 = time.perf_counter()
+    out = main._sync_ical_content(RID, content)
+    wall = time.perf_counter() - t0
+    print(f"{label:<8} {wall * 1000:9.1f} ms  {fake.calls:4d} DB calls  "
+          f"ins={out['inserted']} upd={out['updated']} same={out['unchanged']} cancel={out['cancelled']}")
+
+
+def main_() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--events", type=int, default=1000)
+    ap.add_argument("--rtt-ms", type=float, default=25.0)
+    args = ap.parse_args()
+
+    fake = _FakeSupabase(args.rtt_ms / 1000)
+    main.supabase = fake
+
+    feed = _feed(args.events)
+    t0 = time.perf_counter()
+    parsed = main._parse_ical_events(feed)
+    parse_ms = (time.perf_counter() - t0) * 1000
+    print(f"feed     {len(feed) / 1024:9.1f} KB  {len(parsed)} events, parse {parse_ms:.1f} ms")
+
+    _run(fake, "cold",  feed)
+    _run(fake, "warm",  feed)
+    _run(fake, "churn", _feed(args.events, edited=0.10, cancelled=0.05))
+
+    legacy_calls = 2 * args.events
+    print(f"legacy   {parse_ms + legacy_calls * args.rtt_ms:9.1f} ms  {legacy_calls:4d} DB calls  (SELECT + write per event)")
+
+
+if __name__ == "__main__":
+    main_()
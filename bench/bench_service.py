@@ -0,0 +1,558 @@
+"""Load-test the API against a simulated Friday dinner service.
+
+    python bench/bench_service.py [--duration 60] [--parties 150] [--rtt-ms 25]
+                                  [--json out.json] [--baseline before.json]
+
+Runs the FastAPI app in-process through httpx's ASGI transport, so sync routes go
+through the same anyio threadpool they use under uvicorn. main.supabase is swapped
+for an in-memory PostgREST fake. Every DB call sleeps --rtt-ms to model the
+Railway → Supabase round trip. Over --duration seconds of wall time:
+
+    guests    — --parties NFC joins, peaking early in the rush. Each guest polls
+                GET /queue/{id} every --poll-sec until seated.
+    stations  — --stations host iPads poll GET /state every --poll-sec and
+                GET /queue/history every --history-sec.
+    host      — notifies the head of the list when tables open, seats ready
+                parties, and clears tables after --dine-sec.
+
+Reported per route: requests, throughput, p50/p90/p99 latency, and DB calls per
+request. Set WRITE_BEHIND=1 to measure the host stand with the write-behind journal
+on. --json writes the report. --baseline compares against an earlier --json
+report and exits 1 when a route's p99 or DB calls per request grew by more than
+--tolerance.
+"""
+import argparse
+import asyncio
+import contextvars
+import json
+import operator
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+os.environ.setdefault("SUPABASE_URL", "http://127.0.0.1:9")
+os.environ.setdefault("SUPABASE_KEY", "bench")
+os.environ.setdefault("ICAL_POLL_ENABLED", "0")
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+os.environ.setdefault("RESTAURANT_ID", "bench0000-0000-4000-8000-000000000001")
+
+import anyio.to_thread  # noqa: E402
+import httpx  # noqa: E402
+
+import main  # noqa: E402
+
+RID         = os.environ["RESTAURANT_ID"]
+PARTY_SIZES = [2, 2, 2, 2, 3, 4, 4, 4, 5, 6, 8]
+CAPACITIES  = [2, 2, 2, 4, 4, 4, 4, 6, 6, 8]
+
+_request_calls = contextvars.ContextVar("_request_calls", default=None)   # [calls] for the current request
+
+
+# ── Fake PostgREST ────────────────────────────────────────────────────────────
+
+class _Result:
+    def __init__(self, data, count=None):
+        self.data  = data
+        self.count = count
+
+
+def _pair(a, b):
+    """Compare numerically when both sides are numbers, as Postgres would on a numeric column."""
+    try:
+        return float(a), float(b)
+    except (TypeError, ValueError):
+        return str(a), str(b)
+
+
+def _sort_key(v):
+    if v is None:
+        return (1, 0, "")
+    if isinstance(v, (int, float)):
+        return (0, v, "")
+    return (0, 0, str(v))
+
+
+class _Query:
+    def __init__(self, db, table):
+        self.db       = db
+        self.table    = table
+        self.filters  = []
+        self.orders   = []
+        self.op       = "select"
+        self.payload  = None
+        self.conflict = ""
+        self.offset   = 0
+        self.limit_n  = None
+        self.count    = None
+        self.head     = False
+        self._negate  = False
+
+    @property
+    def not_(self):
+        self._negate = True
+        return self
+
+    def _filter(self, fn):
+        if self._negate:
+            self._negate = False
+            self.filters.append(lambda r: not fn(r))
+        else:
+            self.filters.append(fn)
+        return self
+
+    def _compare(self, col, val, op):
+        return self._filter(lambda r: r.get(col) is not None and op(*_pair(r.get(col), val)))
+
+    def select(self, *_cols, count=None, head=False, **_kw):
+        self.count, self.head = count, bool(head)
+        return self
+
+    def eq(self, col, val):
+        return self._filter(lambda r: str(r.get(col)) == str(val))
+
+    def neq(self, col, val):
+        return self._filter(lambda r: str(r.get(col)) != str(val))
+
+    def gt(self, col, val):
+        return self._compare(col, val, operator.gt)
+
+    def gte(self, col, val):
+        return self._compare(col, val, operator.ge)
+
+    def lt(self, col, val):
+        return self._compare(col, val, operator.lt)
+
+    def lte(self, col, val):
+        return self._compare(col, val, operator.le)
+
+    def in_(self, col, vals):
+        vals = {str(v) for v in vals}
+        return self._filter(lambda r: str(r.get(col)) in vals)
+
+    def is_(self, col, val):
+        want = {"null": None, "true": True, "false": False}.get(str(val).lower(), val)
+        return self._filter(lambda r: r.get(col) is want)
+
+    def match(self, query):
+        for col, val in query.items():
+            self.eq(col, val)
+        return self
+
+    def order(self, col, desc=False, **_kw):
+        self.orders.append((col, desc))
+        return self
+
+    def limit(self, n):
+        self.limit_n = n
+        return self
+
+    def range(self, start, end):
+        self.offset, self.limit_n = start, end - start + 1
+        return self
+
+    def insert(self, rows, **_kw):
+        self.op, self.payload = "insert", rows
+        return self
+
+    def upsert(self, rows, on_conflict="", **_kw):
+        self.op, self.payload, self.conflict = "upsert", rows, on_conflict
+        return self
+
+    def update(self, values, **_kw):
+        self.op, self.payload = "update", values
+        return self
+
+    def delete(self, **_kw):
+        self.op = "delete"
+        return self
+
+    def execute(self):
+        self.db.round_trip()
+        with self.db.lock:
+            rows = self.db.tables.setdefault(self.table, [])
+            return getattr(self, "_" + self.op)(rows)
+
+    def _matching(self, rows):
+        return [r for r in rows if all(f(r) for f in self.filters)]
+
+    def _select(self, rows):
+        out = self._matching(rows)
+        for col, desc in reversed(self.orders):
+            out.sort(key=lambda r: _sort_key(r.get(col)), reverse=desc)
+        total = len(out)
+        out   = out[self.offset:]
+        if self.limit_n is not None:
+            out = out[:self.limit_n]
+        if self.head:
+            return _Result([], count=total)
+        return _Result([dict(r) for r in out], count=total if self.count else None)
+
+    def _insert(self, rows):
+        out = []
+        for r in self.payload if isinstance(self.payload, list) else [self.payload]:
+            row = {"id": str(uuid.uuid4()), "created_at": datetime.now(timezone.utc).isoformat()}
+            row.update(r)
+            rows.append(row)
+            out.append(dict(row))
+        return _Result(out)
+
+    def _upsert(self, rows):
+        keys = [k.strip() for k in self.conflict.split(",") if k.strip()] or ["id"]
+        out  = []
+        for r in self.payload if isinstance(self.payload, list) else [self.payload]:
+            hit = next((x for x in rows if all(str(x.get(k)) == str(r.get(k)) for k in keys)), None)
+            if hit is None:
+                hit = {"id": str(uuid.uuid4()), "created_at": datetime.now(timezone.utc).isoformat()}
+                rows.append(hit)
+            hit.update(r)
+            out.append(dict(hit))
+        return _Result(out)
+
+    def _update(self, rows):
+        out = self._matching(rows)
+        for r in out:
+            r.update(self.payload)
+        return _Result([dict(r) for r in out])
+
+    def _delete(self, rows):
+        out = self._matching(rows)
+        gone = {id(r) for r in out}
+        rows[:] = [r for r in rows if id(r) not in gone]
+        return _Result([dict(r) for r in out])
+
+
+class _Rpc:
+    def __init__(self, db, fn, params):
+        self.db     = db
+        self.fn     = fn
+        self.params = params
+
+    def execute(self):
+        self.db.round_trip()
+        impl = getattr(self.db, "_rpc_" + self.fn, None)
+        if impl is None or (self.db.legacy_tables and self.fn in _CLAIM_RPCS):
+            raise RuntimeError(f"function {self.fn} does not exist")
+        with self.db.lock:
+            return _Result(impl(self.db.tables.setdefault("tables", []), **self.params))
+
+
+_CLAIM_RPCS = ("tables_claim_ready", "claim_table", "claim_next_table")
+
+
+class _FakeSupabase:
+    """In-memory tables behind the subset of the supabase-py query builder main.py uses.
+    The claim RPCs from migration 007 are served unless legacy_tables is set, which
+    exercises the duplicate-safe fallback paths instead."""
+
+    def __init__(self, rtt: float, legacy_tables: bool = False):
+        self.rtt           = rtt
+        self.legacy_tables = legacy_tables
+        self.calls         = 0
+        self.tables        = {}
+        self.lock          = threading.Lock()
+
+    def round_trip(self) -> None:
+        acc = _request_calls.get()
+        if acc is not None:
+            acc[0] += 1
+        with self.lock:
+            self.calls += 1
+        time.sleep(self.rtt)
+
+    def table(self, name):
+        return _Query(self, name)
+
+    def rpc(self, fn, params=None, **_kw):
+        return _Rpc(self, fn, params or {})
+
+    def _rpc_tables_claim_ready(self, _rows):
+        return True
+
+    def _rpc_merge_event_rollups(self, _rows, p_rows):
+        stored = self.tables.setdefault("event_rollups", [])
+        keys   = ("restaurant_id", "metric", "resolution", "bucket_start")
+        for r in p_rows:
+            hit = next((x for x in stored if all(x[k] == r[k] for k in keys)), None)
+            if hit is None:
+                stored.append(dict(r))
+                continue
+            hit.update(count=hit["count"] + r["count"], sum=hit["sum"] + r["sum"],
+                       min=min(hit["min"], r["min"]), max=max(hit["max"], r["max"]), last=r["last"])
+        return None
+
+    def _rpc_claim_table(self, rows, p_table_id):
+        for r in rows:
+            if r["id"] == p_table_id and r["status"] == "available":
+                r.update(status="occupied", updated_at=main._now())
+                return [dict(r)]
+        return []
+
+    def _rpc_claim_next_table(self, rows, p_restaurant_id, p_party_size, p_exclude=()):
+        skip = set(p_exclude)
+        free = [r for r in rows if r["restaurant_id"] == p_restaurant_id and r["status"] == "available"
+                and r["capacity"] >= p_party_size and int(r["table_number"]) not in skip]
+        if not free:
+            return []
+        pick = min(free, key=lambda r: (r["capacity"], int(r["table_number"])))
+        pick.update(status="occupied", updated_at=main._now())
+        return [dict(pick)]
+
+
+def _seed(fake: _FakeSupabase, n_tables: int, n_reservations: int, rng: random.Random) -> None:
+    now = main._now()
+    fake.tables["restaurants"] = [{"id": RID, "name": "Bench Bistro", "created_at": now}]
+    fake.tables["tables"] = [{
+        "id": str(uuid.uuid4()), "restaurant_id": RID, "table_number": n,
+        "capacity": CAPACITIES[(n - 1) % len(CAPACITIES)], "status": "available",
+        "section": "Patio" if n > n_tables * 3 // 4 else "Main", "updated_at": now, "created_at": now,
+    } for n in range(1, n_tables + 1)]
+    # Tonight's book, from half an hour out, so the planner holds tables as it would on a Friday
+    start = main._local_now() + timedelta(minutes=30)
+    fake.tables["reservations"] = [{
+        "id": str(uuid.uuid4()), "restaurant_id": RID, "guest_name": f"Booked {i}",
+        "party_size": rng.choice(PARTY_SIZES), "date": start.date().isoformat(),
+        "time": (start + timedelta(minutes=15 * i)).strftime("%H:%M"),
+        "status": "confirmed", "source": "opentable", "created_at": now,
+    } for i in range(n_reservations) if (start + timedelta(minutes=15 * i)).date() == start.date()]
+
+
+# ── Service simulation ────────────────────────────────────────────────────────
+
+class _Stats:
+    def __init__(self):
+        self.latency = defaultdict(list)   # route → [seconds]
+        self.db      = defaultdict(int)    # route → DB calls
+        self.errors  = defaultdict(int)
+
+
+class _Service:
+    def __init__(self, client: httpx.AsyncClient, args, rng: random.Random):
+        self.client   = client
+        self.args     = args
+        self.rng      = rng
+        self.stats    = _Stats()
+        self.deadline = 0.0
+        self.state    = {"queue": [], "tables": []}   # last /state the host saw
+        self.seated   = {}                            # table id → monotonic time sat
+
+    def running(self) -> bool:
+        return time.monotonic() < self.deadline
+
+    async def call(self, method: str, url: str, route: str, **kw):
+        acc = [0]
+        _request_calls.set(acc)
+        t0 = time.perf_counter()
+        try:
+            resp = await self.client.request(method, url, **kw)
+        except Exception:
+            self.stats.errors[route] += 1
+            return None
+        self.stats.latency[route].append(time.perf_counter() - t0)
+        self.stats.db[route] += acc[0]
+        if resp.status_code >= 400:
+            self.stats.errors[route] += 1
+            return None
+        return resp
+
+    async def guest(self, i: int, at: float) -> None:
+        await asyncio.sleep(at)
+        if not self.running():
+            return
+        body = {"name": f"Guest {i}", "party_size": self.rng.choice(PARTY_SIZES),
+                "source": "nfc", "restaurant_id": RID}
+        if self.rng.random() < 0.7:
+            body["phone"] = f"+1303555{i % 10000:04d}"
+        resp = await self.call("POST", "/queue/join", "POST /queue/join", json=body)
+        if resp is None:
+            return
+        entry_id = resp.json()["entry"]["id"]
+        await asyncio.sleep(self.rng.uniform(0, self.args.poll_sec))
+        while self.running():
+            resp = await self.call("GET", f"/queue/{entry_id}", "GET /queue/{id}")
+            if resp is not None and resp.json().get("status") in ("seated", "removed"):
+                return
+            await asyncio.sleep(self.args.poll_sec)
+
+    async def station(self) -> None:
+        await asyncio.sleep(self.rng.uniform(0, self.args.poll_sec))
+        next_history = 0.0
+        while self.running():
+            await self.call("GET", f"/state?restaurant_id={RID}", "GET /state")
+            if time.monotonic() >= next_history:
+                next_history = time.monotonic() + self.args.history_sec
+                await self.call("GET", f"/queue/history?restaurant_id={RID}", "GET /queue/history")
+            await asyncio.sleep(self.args.poll_sec)
+
+    async def host(self) -> None:
+        """One host working the stand: read the board, turn finished tables, seat who
+        was called, then call as many parties as there are open tables."""
+        while self.running():
+            resp = await self.call("GET", f"/state?restaurant_id={RID}", "GET /state")
+            if resp is not None:
+                self.state = resp.json()
+            now = time.monotonic()
+            for table_id, sat in list(self.seated.items()):
+                if now - sat >= self.args.dine_sec and self.running():
+                    if await self.call("POST", f"/tables/{table_id}/clear", "POST /tables/{id}/clear"):
+                        del self.seated[table_id]
+            queue = self.state.get("queue") or []
+            for e in [e for e in queue if e.get("status") == "ready"]:
+                if not self.running():
+                    break
+                resp = await self.call("POST", f"/queue/{e['id']}/seat", "POST /queue/{id}/seat")
+                table = resp.json().get("table") if resp is not None else None
+                if table:
+                    self.seated[table["id"]] = time.monotonic()
+            open_tables = self.state.get("tables_available") or 0
+            for e in [e for e in queue if e.get("status") == "waiting"][:open_tables]:
+                if not self.running():
+                    break
+                await self.call("POST", f"/queue/{e['id']}/notify", "POST /queue/{id}/notify")
+            await asyncio.sleep(self.args.host_sec)
+
+    async def run(self) -> float:
+        anyio.to_thread.current_default_thread_limiter().total_tokens = self.args.threads
+        d = self.args.duration
+        # Arrivals ramp up to the 7:30 rush about a third of the way in, then tail off
+        arrivals = [self.rng.triangular(0, d * 0.85, d * 0.3) for _ in range(self.args.parties)]
+        self.deadline = time.monotonic() + d
+        t0 = time.perf_counter()
+        await asyncio.gather(
+            *(self.guest(i, at) for i, at in enumerate(arrivals)),
+            *(self.station() for _ in range(self.args.stations)),
+            self.host(),
+        )
+        return time.perf_counter() - t0
+
+
+# ── Report ────────────────────────────────────────────────────────────────────
+
+def _pct(sorted_vals: list, q: float) -> float:
+    if not sorted_vals:
+        return 0.0
+    return sorted_vals[min(len(sorted_vals) - 1, max(0, int(round(q * len(sorted_vals))) - 1))]
+
+
+def _report(stats: _Stats, wall: float, fake: _FakeSupabase) -> dict:
+    routes = {}
+    for route in sorted(stats.latency, key=lambda r: -len(stats.latency[r])):
+        lat = sorted(stats.latency[route])
+        routes[route] = {
+            "reqs":       len(lat),
+            "rps":        round(len(lat) / wall, 2),
+            "p50_ms":     round(_pct(lat, 0.50) * 1000, 1),
+            "p90_ms":     round(_pct(lat, 0.90) * 1000, 1),
+            "p99_ms":     round(_pct(lat, 0.99) * 1000, 1),
+            "max_ms":     round(lat[-1] * 1000, 1),
+            "db_per_req": round(stats.db[route] / len(lat), 2),
+            "errors":     stats.errors[route],
+        }
+    reqs = sum(r["reqs"] for r in routes.values())
+    return {
+        "routes": routes,
+        "total": {
+            "reqs":       reqs,
+            "rps":        round(reqs / wall, 2),
+            "db_calls":   fake.calls,
+            "db_per_req": round(fake.calls / reqs, 2) if reqs else 0.0,
+            "errors":     sum(stats.errors.values()),
+            "wall_sec":   round(wall, 1),
+        },
+    }
+
+
+def _print(report: dict) -> None:
+    print(f"{'route':<28} {'reqs':>6} {'rps':>7} {'p50':>8} {'p90':>8} {'p99':>8} {'max':>8} {'db/req':>7} {'err':>4}")
+    for route, r in report["routes"].items():
+        print(f"{route:<28} {r['reqs']:6d} {r['rps']:7.1f} {r['p50_ms']:6.1f}ms {r['p90_ms']:6.1f}ms "
+              f"{r['p99_ms']:6.1f}ms {r['max_ms']:6.1f}ms {r['db_per_req']:7.2f} {r['errors']:4d}")
+    t = report["total"]
+    print(f"{'total':<28} {t['reqs']:6d} {t['rps']:7.1f}  {t['db_calls']} DB calls "
+          f"({t['db_per_req']:.2f}/req), {t['errors']} errors in {t['wall_sec']} s")
+
+
+def _compare(report: dict, baseline: dict, tolerance: float) -> list:
+    """Routes whose p99 or DB calls per request grew by more than tolerance (a fraction)."""
+    worse = []
+    for route, r in report["routes"].items():
+        b = baseline.get("routes", {}).get(route)
+        if not b:
+            continue
+        for key in ("p99_ms", "db_per_req"):
+            if b[key] and r[key] > b[key] * (1 + tolerance):
+                worse.append(f"{route}: {key} {b[key]} → {r[key]}")
+    return worse
+
+
+def main_() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--duration",      type=float, default=60.0, help="wall seconds of service to simulate")
+    ap.add_argument("--parties",       type=int,   default=150)
+    ap.add_argument("--stations",      type=int,   default=3)
+    ap.add_argument("--tables",        type=int,   default=24)
+    ap.add_argument("--reservations",  type=int,   default=12)
+    ap.add_argument("--poll-sec",      type=float, default=2.0)
+    ap.add_argument("--history-sec",   type=float, default=10.0)
+    ap.add_argument("--host-sec",      type=float, default=3.0)
+    ap.add_argument("--dine-sec",      type=float, default=20.0, help="how long a party holds a table")
+    ap.add_argument("--rtt-ms",        type=float, default=25.0)
+    ap.add_argument("--sms-ms",        type=float, default=300.0, help="simulated SMS provider latency")
+    ap.add_argument("--threads",       type=int,   default=40, help="anyio threadpool size (uvicorn default 40)")
+    ap.add_argument("--legacy-tables", action="store_true", help="no claim RPCs (pre-migration 007 paths)")
+    ap.add_argument("--seed",          type=int,   default=7)
+    ap.add_argument("--json",          help="write the report here")
+    ap.add_argument("--baseline",      help="earlier --json report to compare against")
+    ap.add_argument("--tolerance",     type=float, default=0.15)
+    args = ap.parse_args()
+
+    rng  = random.Random(args.seed)
+    fake = _FakeSupabase(args.rtt_ms / 1000, legacy_tables=args.legacy_tables)
+    _seed(fake, args.tables, args.reservations, rng)
+    main.supabase = fake
+
+    def _fake_sms(to_phone, body):
+        time.sleep(args.sms_ms / 1000)
+        return True, ""
+    main._send_sms = _fake_sms
+
+    if main.WRITE_BEHIND:
+        # Startup hooks don't run in-process, so drive the journal replay here
+        def _replay():
+            while True:
+                main._wb_wake.wait(main.WRITE_BEHIND_RETRY_SEC)
+                main._wb_wake.clear()
+                main._wb_replay_once()
+        threading.Thread(target=_replay, daemon=True).start()
+
+    async def _go():
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            svc  = _Service(client, args, rng)
+            wall = await svc.run()
+            return svc.stats, wall
+
+    stats, wall = asyncio.run(_go())
+    report = _report(stats, wall, fake)
+    report["args"] = vars(args)
+    _print(report)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            worse = _compare(report, json.load(f), args.tolerance)
+        for line in worse:
+            print(f"REGRESSION {line}")
+        if worse:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main_()
@@ -2,7 +2,8 @@ import { NextResponse } from "next/server"
 
 const BACKEND = "https://restaurant-brain-production.up.railway.app"
 
-// Allow up to 60 s for Claude to process large menus
+// The backend parses in the background (POST /menu/parse/jobs) and the page
+// polls GET ?job=<id>, so neither request has to outlive a large menu.
 export const maxDuration = 60
 
 // Thin proxy — buffer the full multipart body and forward it verbatim.
@@ -18,7 +19,7 @@ export async function POST(req: Request) {
 
     const body = await req.arrayBuffer()
 
-    const upstream = await fetch(`${BACKEND}/menu/parse`, {
+    const upstream = await fetch(`${BACKEND}/menu/parse/jobs`, {
       method: "POST",
       headers: { "content-type": contentType },
       body: body,
@@ -60,3 +61,24 @@ export async function POST(req: Request) {
     return NextResponse.json({ error: "Internal server error" }, { status: 500 })
   }
 }
+
+// Poll a parse job started by POST — returns status, pages_done/pages_total and,
+// once done, sections.
+export async function GET(req: Request) {
+  const job = new URL(req.url).searchParams.get("job")
+  if (!job) {
+    return NextResponse.json({ error: "Missing job id" }, { status: 400 })
+  }
+  try {
+    const upstream = await fetch(`${BACKEND}/menu/parse/jobs/${encodeURIComponent(job)}`, { cache: "no-store" })
+    const data = await upstream.json().catch(() => ({ detail: `Backend error (${upstream.status})` }))
+    if (!upstream.ok) {
+      const detail = (data as { detail?: unknown }).detail
+      return NextResponse.json({ error: typeof detail === "string" ? detail : "Import failed" }, { status: upstream.status })
+    }
+    return NextResponse.json(data)
+  } catch (err) {
+    console.error("menu-parse poll error:", err)
+    return NextResponse.json({ error: "Internal server error" }, { status: 500 })
+  }
+}
@@ -1098,6 +1098,7 @@ function MenuBuilder({ sections, onChange }: { sections: MenuSection[]; onChange
   // Import wizard state
   const [wizardOpen,   setWizardOpen]   = useState(false)
   const [importing,    setImporting]    = useState(false)
+  const [importProgress, setImportProgress] = useState<{ done: number; total: number } | null>(null)
   const [importError,  setImportError]  = useState<string | null>(null)
   const [preview,      setPreview]      = useState<MenuSection[] | null>(null)
   const [undoSnapshot, setUndoSnapshot] = useState<MenuSection[] | null>(null)
@@ -1147,7 +1148,19 @@ function MenuBuilder({ sections, onChange }: { sections: MenuSection[]; onChange
       let data: Record<string, unknown>
       try { data = await res.json() }
       catch { throw new Error("Server returned an unexpected response — try again") }
-      if (!res.ok) {
+      // The backend parses page by page in the background — poll until the job settles
+      let poll = res
+      while (poll.ok && typeof data.job_id === "string" && data.status !== "done" && data.status !== "failed") {
+        await new Promise(r => setTimeout(r, 1500))
+        poll = await fetch(`/api/owner/menu-parse?job=${encodeURIComponent(data.job_id)}`, { cache: "no-store" })
+        try { data = await poll.json() }
+        catch { throw new Error("Server returned an unexpected response — try again") }
+        if (typeof data.pages_total === "number" && data.pages_total > 0) {
+          setImportProgress({ done: Number(data.pages_done) || 0, total: data.pages_total })
+        }
+      }
+      if (data.status === "failed") data = { error: data.error ?? "Import failed" }
+      if (!poll.ok || data.error) {
         const raw = data.error ?? data.detail ?? "Import failed"
         setImportError(typeof raw === "string" ? raw : JSON.stringify(raw))
       } else {
@@ -1174,6 +1187,7 @@ function MenuBuilder({ sections, onChange }: { sections: MenuSection[]; onChange
       setImportError(err instanceof Error ? err.message : "Network error — could not reach server")
     } finally {
       setImporting(false)
+      setImportProgress(null)
       e.target.value = ""
     }
   }
@@ -1280,7 +1294,9 @@ function MenuBuilder({ sections, onChange }: { sections: MenuSection[]; onChange
             {importing && (
               <div style={{ fontSize: 13, color: D.blue, display: "flex", alignItems: "center", gap: 8 }}>
                 <span style={{ display: "inline-block", animation: "spin 1s linear infinite" }}>⟳</span>
-                Parsing menu with AI… (this may take a few seconds)
+                {importProgress
+                  ? `Parsing menu with AI… page ${importProgress.done} of ${importProgress.total}`
+                  : "Parsing menu with AI… (this may take a few seconds)"}
               </div>
             )}
 
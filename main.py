@@ -1,8 +1,15 @@
 import os
 import re
+import atexit
+import contextlib
+import time
+import random
+import hashlib
 import json as _json
 import uuid as _uuid
+import sys
 import threading
+import contextvars
 from fastapi import BackgroundTasks, FastAPI, File, HTTPException, Request, UploadFile
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import Response
@@ -11,6 +18,8 @@ from pydantic import BaseModel, Field, field_validator
 from typing import List, Optional, Any
 from datetime import datetime, timezone
 
+import menu_workers
+
 # ── Environment ─────────────────────────────────────────────────────────────
 SUPABASE_URL  = os.environ.get("SUPABASE_URL")
 SUPABASE_KEY  = os.environ.get("SUPABASE_KEY")
@@ -22,17 +31,833 @@ TWILIO_TOKEN  = os.environ.get("TWILIO_AUTH_TOKEN", "")
 TWILIO_FROM   = os.environ.get("TWILIO_FROM_NUMBER", "")
 TEXTBELT_KEY  = os.environ.get("TEXTBELT_KEY", "textbelt")  # fallback SMS (textbelt.com; "textbelt" = 1 free/day)
 
-supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
+# ── Storage backend ──────────────────────────────────────────────────────────
+# Every read and write goes through the module-level `supabase` client. STORAGE_BACKEND
+# picks which client that is:
+#
+#   supabase  (default) the hosted project at SUPABASE_URL / SUPABASE_KEY
+#   sqlite    an embedded SQLite file at SQLITE_PATH — offline dev, CI, and host
+#             stands whose internet can't be trusted
+#   memory    the same engine on a private in-memory database, gone on restart
+#
+# The embedded engine (_LocalClient) answers the query-builder calls this file makes:
+# select with column lists and counts, eq/neq/gt/gte/lt/lte/in_/is_/not_/match,
+# order/limit/range, insert/upsert/update/delete, the claim RPCs from migration 007
+# and the rollup merge from 009. Each table is a set of JSON documents, so nothing has to be created up front.
+# The keys the migrations add (_LOCAL_KEYS) are unique indexes, and errors come back
+# as postgrest APIErrors with the Postgres code, just like the real client's.
+# Storage buckets (ARCHIVE_BUCKET) are Supabase-only.
+import sqlite3
+from postgrest.exceptions import APIError
+
+STORAGE_BACKEND = os.environ.get("STORAGE_BACKEND", "supabase").lower()
+SQLITE_PATH     = os.environ.get("SQLITE_PATH", os.path.join("/tmp", "restaurant-brain.sqlite3"))
+
+# Primary key first (None = a generated uuid "id"), then any other unique keys
+_LOCAL_KEYS: dict = {
+    "tables":           [None, ("restaurant_id", "table_number")],
+    "reservations":     [None, ("restaurant_id", "external_uid")],
+    "event_rollups":    [("restaurant_id", "metric", "resolution", "bucket_start")],
+    "capacity_samples": [("taken_at", "table_name", "restaurant_id")],
+}
+_LOCAL_HTTP   = {"select": "GET", "insert": "POST", "upsert": "POST", "update": "PATCH", "delete": "DELETE"}
+_LOCAL_COL_RE = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*$")
+_LOCAL_NUM_RE = re.compile(r"^-?\d+(\.\d+)?$")
+
+
+def _local_col(col: str) -> str:
+    if not _LOCAL_COL_RE.match(col):
+        raise APIError({"message": f"column {col!r} is not supported by the local engine", "code": "42703"})
+    return f"json_extract(doc, '$.{col}')"
+
+
+def _local_param(val):
+    if isinstance(val, bool):
+        return int(val)
+    if isinstance(val, (dict, list)):
+        return _json.dumps(val, default=str)
+    if isinstance(val, datetime):
+        return val.isoformat()
+    return val
+
+
+class _LocalResponse:
+    def __init__(self, data: list, count: Optional[int] = None):
+        self.data  = data
+        self.count = count
+
+
+class _LocalQuery:
+    def __init__(self, client: "_LocalClient", table: str):
+        self.client    = client
+        self.table     = table
+        self.where     = []      # (sql, params)
+        self.orders    = []
+        self.op        = "select"
+        self.columns   = None    # None = every column
+        self.payload   = None
+        self.conflict  = None
+        self.ignore    = False
+        self.minimal   = False
+        self.count     = None
+        self.head      = False
+        self.limit_n   = None
+        self.offset_n  = 0
+        self._negate   = False
+
+    # ── filters ──
+    @property
+    def not_(self):
+        self._negate = True
+        return self
+
+    def _filter(self, sql: str, params: tuple = ()):
+        if self._negate:
+            self._negate = False
+            sql = f"NOT ({sql})"
+        self.where.append((sql, params))
+        return self
+
+    def eq(self, col, val):
+        # PostgREST casts the value to the column type; "5" must still match 5
+        if isinstance(val, str) and _LOCAL_NUM_RE.match(val):
+            return self._filter(f"{_local_col(col)} IN (?, ?)", (val, float(val)))
+        return self._filter(f"{_local_col(col)} = ?", (_local_param(val),))
+
+    def neq(self, col, val):
+        return self._filter(f"{_local_col(col)} != ?", (_local_param(val),))
+
+    def gt(self, col, val):
+        return self._filter(f"{_local_col(col)} > ?", (_local_param(val),))
+
+    def gte(self, col, val):
+        return self._filter(f"{_local_col(col)} >= ?", (_local_param(val),))
+
+    def lt(self, col, val):
+        return self._filter(f"{_local_col(col)} < ?", (_local_param(val),))
+
+    def lte(self, col, val):
+        return self._filter(f"{_local_col(col)} <= ?", (_local_param(val),))
+
+    def in_(self, col, vals):
+        vals = [_local_param(v) for v in vals]
+        if not vals:
+            return self._filter("0")
+        return self._filter(f"{_local_col(col)} IN ({','.join('?' * len(vals))})", tuple(vals))
+
+    def is_(self, col, val):
+        val = str(val).lower()
+        if val == "null":
+            return self._filter(f"{_local_col(col)} IS NULL")
+        return self._filter(f"{_local_col(col)} = ?", (1 if val == "true" else 0,))
+
+    def match(self, query: dict):
+        for col, val in query.items():
+            self.eq(col, val)
+        return self
+
+    def order(self, col, desc: bool = False, nullsfirst: Optional[bool] = None, **_kw):
+        if nullsfirst is None:
+            nullsfirst = desc   # Postgres: NULLS LAST ascending, NULLS FIRST descending
+        self.orders.append(f"{_local_col(col)} {'DESC' if desc else 'ASC'} NULLS {'FIRST' if nullsfirst else 'LAST'}")
+        return self
+
+    def limit(self, n: int, **_kw):
+        self.limit_n = int(n)
+        return self
+
+    def range(self, start: int, end: int, **_kw):
+        self.offset_n, self.limit_n = int(start), int(end) - int(start) + 1
+        return self
+
+    # ── operations ──
+    def select(self, *cols, count=None, head=False, **_kw):
+        names = [c.strip() for c in ",".join(cols).split(",") if c.strip()]
+        self.columns = None if not names or "*" in names else names
+        self.count, self.head = count, bool(head)
+        return self
+
+    def insert(self, rows, returning="representation", **_kw):
+        self.op, self.payload, self.minimal = "insert", rows, str(returning).endswith("minimal")
+        return self
+
+    def upsert(self, rows, on_conflict: str = "", ignore_duplicates: bool = False,
+               returning="representation", **_kw):
+        self.op, self.payload, self.minimal = "upsert", rows, str(returning).endswith("minimal")
+        self.conflict = tuple(c.strip() for c in on_conflict.split(",") if c.strip()) or None
+        self.ignore   = ignore_duplicates
+        return self
+
+    def update(self, values: dict, returning="representation", **_kw):
+        self.op, self.payload, self.minimal = "update", values, str(returning).endswith("minimal")
+        return self
+
+    def delete(self, returning="representation", **_kw):
+        self.op, self.minimal = "delete", str(returning).endswith("minimal")
+        return self
+
+    def execute(self) -> _LocalResponse:
+        t0, status = time.perf_counter(), "error"
+        try:
+            out = self.client._run(self)
+            status = "ok"
+            return out
+        finally:
+            _db_observe(time.perf_counter() - t0, self.table, _LOCAL_HTTP[self.op], status)
+
+    # ── execution, called with the table created and a transaction open for writes ──
+    def _where_sql(self) -> tuple:
+        if not self.where:
+            return "", ()
+        return " WHERE " + " AND ".join(s for s, _ in self.where), tuple(p for _, ps in self.where for p in ps)
+
+    def _project(self, doc: dict) -> dict:
+        if self.columns is None:
+            return doc
+        return {c: doc.get(c) for c in self.columns}
+
+    def _rows(self, db) -> list:
+        where, params = self._where_sql()
+        return [(rowid, _json.loads(doc)) for rowid, doc in
+                db.execute(f'SELECT rowid, doc FROM "{self.table}"{where}', params)]
+
+    def _select(self, db) -> _LocalResponse:
+        where, params = self._where_sql()
+        total = None
+        if self.count or self.head:
+            total = db.execute(f'SELECT COUNT(*) FROM "{self.table}"{where}', params).fetchone()[0]
+        if self.head:
+            return _LocalResponse([], total)
+        sql = f'SELECT doc FROM "{self.table}"{where}'
+        if self.orders:
+            sql += " ORDER BY " + ", ".join(self.orders)
+        if self.limit_n is not None or self.offset_n:
+            sql += " LIMIT ? OFFSET ?"
+            params += (self.limit_n if self.limit_n is not None else -1, self.offset_n)
+        return _LocalResponse([self._project(_json.loads(d)) for (d,) in db.execute(sql, params)], total)
+
+    def _insert(self, db) -> _LocalResponse:
+        out = [self.client._insert_doc(db, self.table, r) for r in _local_rows(self.payload)]
+        return _LocalResponse([] if self.minimal else [self._project(d) for d in out])
+
+    def _upsert(self, db) -> _LocalResponse:
+        keys = self.conflict or self.client._pkey(self.table)
+        out  = []
+        for r in _local_rows(self.payload):
+            hit = db.execute(
+                f'SELECT rowid, doc FROM "{self.table}" WHERE '
+                + " AND ".join(f"{_local_col(k)} IS ?" for k in keys),
+                tuple(_local_param(r.get(k)) for k in keys),
+            ).fetchone()
+            if hit is None:
+                out.append(self.client._insert_doc(db, self.table, r))
+            elif not self.ignore:
+                out.append(self.client._write_doc(db, self.table, hit[0], {**_json.loads(hit[1]), **r}))
+        return _LocalResponse([] if self.minimal else [self._project(d) for d in out])
+
+    def _update(self, db) -> _LocalResponse:
+        out = [self.client._write_doc(db, self.table, rowid, {**doc, **self.payload})
+               for rowid, doc in self._rows(db)]
+        return _LocalResponse([] if self.minimal else [self._project(d) for d in out])
+
+    def _delete(self, db) -> _LocalResponse:
+        rows = self._rows(db)
+        for i in range(0, len(rows), 500):
+            chunk = [rowid for rowid, _ in rows[i:i + 500]]
+            db.execute(f'DELETE FROM "{self.table}" WHERE rowid IN ({",".join("?" * len(chunk))})', chunk)
+        return _LocalResponse([] if self.minimal else [self._project(d) for _, d in rows])
+
+
+def _local_rows(payload) -> list:
+    return payload if isinstance(payload, list) else [payload]
+
+
+class _LocalRpc:
+    def __init__(self, client: "_LocalClient", fn: str, params: dict):
+        self.client = client
+        self.fn     = fn
+        self.params = params
+
+    def execute(self) -> _LocalResponse:
+        impl = getattr(self.client, f"_rpc_{self.fn}", None)
+        if impl is None:
+            raise APIError({"message": f"Could not find the function public.{self.fn}", "code": "PGRST202"})
+        t0, status = time.perf_counter(), "error"
+        try:
+            with self.client._tx() as db:
+                out = _LocalResponse(impl(db, **self.params))
+            status = "ok"
+            return out
+        finally:
+            _db_observe(time.perf_counter() - t0, f"rpc:{self.fn}", "POST", status)
+
+
+class _LocalClient:
+    """Embedded stand-in for the Supabase client; see the section comment above."""
+
+    def __init__(self, path: str):
+        self.path    = path
+        self._lock   = threading.RLock()   # one connection, shared by every request thread
+        self._tables: set = set()
+        self._db     = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA busy_timeout = 5000")
+        if path != ":memory:":
+            self._db.execute("PRAGMA journal_mode = WAL")
+        self._tables.update(r[0] for r in self._db.execute("SELECT name FROM sqlite_master WHERE type = 'table'"))
+
+    def table(self, name: str) -> _LocalQuery:
+        return _LocalQuery(self, name)
+
+    from_ = table
+
+    def rpc(self, fn: str, params: Optional[dict] = None, **_kw) -> _LocalRpc:
+        return _LocalRpc(self, fn, params or {})
+
+    def _pkey(self, table: str) -> tuple:
+        return (_LOCAL_KEYS.get(table) or [None])[0] or ("id",)
+
+    def _ensure(self, db, table: str):
+        if table in self._tables:
+            return
+        if not _LOCAL_COL_RE.match(table):
+            raise APIError({"message": f"relation {table!r} is not supported by the local engine", "code": "42P01"})
+        db.execute(f'CREATE TABLE IF NOT EXISTS "{table}" (doc TEXT NOT NULL)')
+        keys = [k or ("id",) for k in (_LOCAL_KEYS.get(table) or [None])]
+        for i, cols in enumerate(keys):
+            db.execute(f'CREATE UNIQUE INDEX IF NOT EXISTS "uq_{table}_{i}" ON "{table}" '
+                       f'({", ".join(_local_col(c) for c in cols)})')
+        if "restaurant_id" not in keys[0]:
+            db.execute(f'CREATE INDEX IF NOT EXISTS "ix_{table}_rid" ON "{table}" ({_local_col("restaurant_id")})')
+        self._tables.add(table)
+
+    @contextlib.contextmanager
+    def _tx(self):
+        """Writes take SQLite's write lock up front (BEGIN IMMEDIATE), so a read-modify-write
+        like a table claim is atomic across threads and across worker processes."""
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                yield self._db
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+            self._db.execute("COMMIT")
+
+    def _run(self, q: _LocalQuery) -> _LocalResponse:
+        try:
+            with self._lock:
+                if q.table not in self._tables:
+                    with self._tx() as db:
+                        self._ensure(db, q.table)
+                if q.op == "select":
+                    return q._select(self._db)
+                with self._tx() as db:
+                    return getattr(q, f"_{q.op}")(db)
+        except sqlite3.IntegrityError as e:
+            raise APIError({"message": f"duplicate key value violates unique constraint ({e})", "code": "23505"})
+        except sqlite3.Error as e:
+            raise APIError({"message": str(e), "code": "XX000"})
+
+    def _insert_doc(self, db, table: str, row: dict) -> dict:
+        doc = {k: v for k, v in row.items()}
+        if self._pkey(table) == ("id",):
+            doc.setdefault("id", str(_uuid.uuid4()))
+            doc.setdefault("created_at", datetime.now(timezone.utc).isoformat())
+        db.execute(f'INSERT INTO "{table}" (doc) VALUES (?)', (_json.dumps(doc, default=str),))
+        return _json.loads(_json.dumps(doc, default=str))
+
+    def _write_doc(self, db, table: str, rowid: int, doc: dict) -> dict:
+        text = _json.dumps(doc, default=str)
+        db.execute(f'UPDATE "{table}" SET doc = ? WHERE rowid = ?', (text, rowid))
+        return _json.loads(text)
+
+    # ── RPCs from the migrations ──
+    def _rpc_merge_event_rollups(self, db, p_rows: list) -> None:
+        self._ensure(db, "event_rollups")
+        for r in p_rows:
+            q   = _LocalQuery(self, "event_rollups").match(
+                {k: r[k] for k in ("restaurant_id", "metric", "resolution", "bucket_start")})
+            hit = q._rows(db)
+            if not hit:
+                self._insert_doc(db, "event_rollups", r)
+                continue
+            rowid, doc = hit[0]
+            self._write_doc(db, "event_rollups", rowid, {
+                **doc, "count": doc["count"] + r["count"], "sum": doc["sum"] + r["sum"],
+                "min": min(doc["min"], r["min"]), "max": max(doc["max"], r["max"]), "last": r["last"]})
+
+    def _rpc_tables_claim_ready(self, db) -> bool:
+        return True   # the unique (restaurant_id, table_number) index always exists here
+
+    def _rpc_claim_table(self, db, p_table_id: str) -> list:
+        self._ensure(db, "tables")
+        q = _LocalQuery(self, "tables").eq("id", p_table_id).eq("status", "available")
+        return [self._write_doc(db, "tables", rowid, {**doc, "status": "occupied",
+                                                       "updated_at": datetime.now(timezone.utc).isoformat()})
+                for rowid, doc in q._rows(db)]
+
+    def _rpc_claim_next_table(self, db, p_restaurant_id: str, p_party_size: int, p_exclude=()) -> list:
+        self._ensure(db, "tables")
+        skip = {int(n) for n in p_exclude or ()}
+        q    = (_LocalQuery(self, "tables").eq("restaurant_id", p_restaurant_id)
+                .eq("status", "available").gte("capacity", p_party_size))
+        free = [(rowid, doc) for rowid, doc in q._rows(db) if int(doc.get("table_number") or 0) not in skip]
+        if not free:
+            return []
+        rowid, doc = min(free, key=lambda r: (r[1].get("capacity") or 0, int(r[1].get("table_number") or 0)))
+        return [self._write_doc(db, "tables", rowid, {**doc, "status": "occupied",
+                                                       "updated_at": datetime.now(timezone.utc).isoformat()})]
+
+
+def _storage_client():
+    if STORAGE_BACKEND == "sqlite":
+        return _LocalClient(SQLITE_PATH)
+    if STORAGE_BACKEND == "memory":
+        return _LocalClient(":memory:")
+    return create_client(SUPABASE_URL, SUPABASE_KEY)
+
+
+supabase = _storage_client()
+
+# ── Logging ──────────────────────────────────────────────────────────────────
+# One JSON object per line on stdout: ts, level, logger, msg, plus request_id when
+# the line was written while serving a request and any fields passed as
+# extra={"fields": {...}}. Handlers sit behind a QueueHandler, so a request thread
+# only enqueues; formatting and the stdout write happen on the listener thread.
+#
+#   LOG_LEVEL   default level for every subsystem (INFO)
+#   LOG_LEVELS  per-subsystem overrides, e.g. "sms=DEBUG,ical-poll=WARNING,owner=WARNING".
+#               Subsystems are dotted (sms.textbelt, demo.request); a level on "sms"
+#               covers every sms.* logger that has none of its own.
+#   LOG_FORMAT  json (default) or text for local runs
+#
+# The per-request access line (see _MetricsMiddleware) is sampled at LOG_POLL_SAMPLE
+# for the routes the station polls, but errors and requests slower than LOG_SLOW_MS
+# are always kept. Run uvicorn with --no-access-log to avoid a second, unsampled one.
+import logging
+import logging.handlers
+import queue as _queue
+
+LOG_LEVEL       = os.environ.get("LOG_LEVEL", "INFO").upper()
+LOG_LEVELS      = os.environ.get("LOG_LEVELS", "")
+LOG_FORMAT      = os.environ.get("LOG_FORMAT", "json").lower()
+LOG_POLL_SAMPLE = float(os.environ.get("LOG_POLL_SAMPLE", "0.01"))
+LOG_SLOW_MS     = float(os.environ.get("LOG_SLOW_MS", "1000"))
+
+_request_id = contextvars.ContextVar("_request_id", default=None)
+
+
+class _JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        out = {
+            "ts":     datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level":  record.levelname.lower(),
+            "logger": record.name[3:] if record.name.startswith("rb.") else record.name,
+            "msg":    record.getMessage(),
+        }
+        rid = getattr(record, "request_id", None)
+        if rid:
+            out["request_id"] = rid
+        out.update(getattr(record, "fields", None) or {})
+        if record.exc_info:
+            out["exc"] = self.formatException(record.exc_info)
+        return _json.dumps(out, default=str)
+
+
+class _RequestIdFilter(logging.Filter):
+    """Stamp the request id on the calling thread, before the record crosses the queue."""
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.request_id = _request_id.get()
+        return True
+
+
+_log_queue: Optional[_queue.SimpleQueue] = None
+_log_listener: Optional[logging.handlers.QueueListener] = None
+
+
+def _log_setup():
+    """Start the listener thread. Called again in a forked worker, whose copy of the
+    parent's listener is a dead thread: the child gets a fresh queue and never calls
+    stop() on the old listener — that would enqueue the sentinel the new one reads first."""
+    global _log_queue, _log_listener
+    out = logging.StreamHandler(sys.stdout)
+    out.setFormatter(_JsonFormatter() if LOG_FORMAT == "json"
+                     else logging.Formatter("%(asctime)s %(levelname)s [%(name)s] %(message)s"))
+    _log_queue    = _queue.SimpleQueue()
+    _log_listener = logging.handlers.QueueListener(_log_queue, out, respect_handler_level=False)
+    _log_listener.start()
+
+    root = logging.getLogger("rb")
+    if root.handlers:
+        for h in root.handlers:
+            if isinstance(h, logging.handlers.QueueHandler):
+                h.queue = _log_queue
+        return
+    qh = logging.handlers.QueueHandler(_log_queue)
+    qh.addFilter(_RequestIdFilter())
+    root.addHandler(qh)
+    root.propagate = False
+    root.setLevel(getattr(logging, LOG_LEVEL, logging.INFO))
+    for part in filter(None, (p.strip() for p in LOG_LEVELS.split(","))):
+        name, _, level = part.partition("=")
+        logging.getLogger(f"rb.{name.strip()}").setLevel(level.strip().upper() or "INFO")
+
+
+def _log(name: str) -> logging.Logger:
+    """Logger for one subsystem, e.g. _log("sms.twilio")."""
+    return logging.getLogger(f"rb.{name}")
+
+
+def _mask_phone(phone: Optional[str]) -> str:
+    digits = re.sub(r"\D", "", phone or "")
+    return f"***{digits[-4:]}" if digits else ""
+
+
+_log_setup()
+atexit.register(lambda: _log_listener and _log_listener.stop())   # drain the queue on shutdown
+
+# ── Live state backend ───────────────────────────────────────────────────────
+# Live floor state (who is at which table, when each quote timer started) lives in one
+# state object per restaurant, reached through _rstate(rid). Each object guards itself,
+# so a busy tenant never blocks another and a snapshot only touches that restaurant.
+#
+#   STATE_BACKEND=memory  (default) plain dicts in this process — one replica only.
+#   STATE_BACKEND=redis   hashes in a Redis-compatible store at REDIS_URL, shared by
+#                         every replica behind the load balancer.
+#
+# In redis mode, replicas also tell each other when a process-local cache went stale
+# (reservation index, demo submissions) over a pub/sub channel: _state_publish(kind, rid)
+# on the writer, a handler registered with @_on_invalidate(kind) on every other replica.
+STATE_BACKEND = os.environ.get("STATE_BACKEND", "memory").lower()
+REDIS_URL     = os.environ.get("REDIS_URL", "redis://localhost:6379/0")
+_STATE_CHANNEL = "rb:invalidate"
+_REPLICA_ID    = _uuid.uuid4().hex[:12]
+
+
+class _RestaurantState:
+    """In-process live state for one restaurant.
+
+    occupants   — which guest is at which table, keyed by str(table_number):
+                  { "name": str, "party_size": int, "entry_id": str, "seated_at": str }.
+                  Populated by seat-to-table / occupy, cleared by table clear.
+    wait_set_at — ISO timestamp when a host last set quoted_wait, keyed by entry_id.
+                  Used by the guest page to detect a timer reset even when the new value
+                  equals the old one. Re-seeded from quoted_wait_set_at on restart.
+    """
+    __slots__ = ("lock", "occupants", "wait_set_at")
+
+    def __init__(self, rid: Optional[str] = None):
+        self.lock        = threading.Lock()
+        self.occupants   = {}
+        self.wait_set_at = {}
+
+    def occupants_snapshot(self) -> dict:
+        with self.lock:
+            return dict(self.occupants)
+
+    def occupant(self, tnum) -> Optional[dict]:
+        return self.occupants.get(str(tnum))
+
+    def set_occupant(self, tnum, occ: dict):
+        with self.lock:
+            self.occupants[str(tnum)] = occ
+
+    def pop_occupant(self, tnum) -> Optional[dict]:
+        with self.lock:
+            return self.occupants.pop(str(tnum), None)
+
+    def claim_occupant(self, tnum, occ: dict) -> bool:
+        """Set the occupant only if the table has none; False when someone got there first."""
+        with self.lock:
+            if str(tnum) in self.occupants:
+                return False
+            self.occupants[str(tnum)] = occ
+        return True
+
+    def seed_occupants(self, occs: dict) -> int:
+        """Fill in tables that have no occupant yet; returns how many were added."""
+        with self.lock:
+            added = [k for k in occs if str(k) not in self.occupants]
+            for k in added:
+                self.occupants[str(k)] = occs[k]
+        return len(added)
+
+    def clear_occupants(self) -> int:
+        with self.lock:
+            n = len(self.occupants)
+            self.occupants.clear()
+        return n
+
+    def wait_get(self, entry_id: Optional[str]) -> Optional[str]:
+        return self.wait_set_at.get(entry_id)
+
+    def wait_snapshot(self) -> dict:
+        with self.lock:
+            return dict(self.wait_set_at)
+
+    def wait_set(self, entry_id: str, ts: str):
+        with self.lock:
+            self.wait_set_at[entry_id] = ts
+
+    def wait_pop(self, entry_id: str):
+        with self.lock:
+            self.wait_set_at.pop(entry_id, None)
+
+    def clear_waits(self):
+        with self.lock:
+            self.wait_set_at.clear()
+
+
+_state_redis = None   # redis.Redis (or a compatible stand-in), created on first use
+
+
+def _state_redis_client():
+    global _state_redis
+    if _state_redis is None:
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError("STATE_BACKEND=redis needs the redis package (pip install redis)")
+        _state_redis = redis.Redis.from_url(REDIS_URL, decode_responses=True,
+                                            socket_timeout=2, health_check_interval=30)
+    return _state_redis
+
+
+class _SharedRestaurantState:
+    """Same interface as _RestaurantState, stored in two Redis hashes per restaurant
+    (rb:<rid>:occupants, rb:<rid>:waits) so every replica reads the same floor.
+    Multi-key updates go through MULTI pipelines; no local copy is kept."""
+    __slots__ = ("occ_key", "wait_key")
+
+    def __init__(self, rid: Optional[str] = None):
+        self.occ_key  = f"rb:{rid}:occupants"
+        self.wait_key = f"rb:{rid}:waits"
+
+    def occupants_snapshot(self) -> dict:
+        return {k: _json.loads(v) for k, v in _state_redis_client().hgetall(self.occ_key).items()}
+
+    def occupant(self, tnum) -> Optional[dict]:
+        raw = _state_redis_client().hget(self.occ_key, str(tnum))
+        return _json.loads(raw) if raw else None
+
+    def set_occupant(self, tnum, occ: dict):
+        _state_redis_client().hset(self.occ_key, str(tnum), _json.dumps(occ))
+
+    def pop_occupant(self, tnum) -> Optional[dict]:
+        pipe = _state_redis_client().pipeline()
+        pipe.hget(self.occ_key, str(tnum))
+        pipe.hdel(self.occ_key, str(tnum))
+        raw, _ = pipe.execute()
+        return _json.loads(raw) if raw else None
+
+    def claim_occupant(self, tnum, occ: dict) -> bool:
+        return bool(_state_redis_client().hsetnx(self.occ_key, str(tnum), _json.dumps(occ)))
+
+    def seed_occupants(self, occs: dict) -> int:
+        if not occs:
+            return 0
+        pipe = _state_redis_client().pipeline()
+        for k, occ in occs.items():
+            pipe.hsetnx(self.occ_key, str(k), _json.dumps(occ))
+        return sum(1 for added in pipe.execute() if added)
+
+    def clear_occupants(self) -> int:
+        pipe = _state_redis_client().pipeline()
+        pipe.hlen(self.occ_key)
+        pipe.delete(self.occ_key)
+        n, _ = pipe.execute()
+        return int(n or 0)
+
+    def wait_get(self, entry_id: Optional[str]) -> Optional[str]:
+        return _state_redis_client().hget(self.wait_key, entry_id) if entry_id else None
+
+    def wait_snapshot(self) -> dict:
+        return _state_redis_client().hgetall(self.wait_key)
+
+    def wait_set(self, entry_id: str, ts: str):
+        _state_redis_client().hset(self.wait_key, entry_id, ts)
+
+    def wait_pop(self, entry_id: str):
+        _state_redis_client().hdel(self.wait_key, entry_id)
+
+    def clear_waits(self):
+        _state_redis_client().delete(self.wait_key)
+
+
+_STATE_CLASSES = {"memory": _RestaurantState, "redis": _SharedRestaurantState}
+if STATE_BACKEND not in _STATE_CLASSES:
+    raise RuntimeError(f"Unknown STATE_BACKEND={STATE_BACKEND!r} (expected memory or redis)")
+
+_rstates: dict = {}                   # rid → state object
+_rstates_lock  = threading.Lock()     # only taken the first time a restaurant is seen
+
+
+def _rstate(rid: Optional[str]):
+    st = _rstates.get(rid)
+    if st is None:
+        with _rstates_lock:
+            st = _rstates.get(rid)
+            if st is None:
+                st = _rstates[rid] = _STATE_CLASSES[STATE_BACKEND](rid)
+    return st
+
+
+_invalidation_handlers: dict = {}   # kind → fn(rid, data)
+
+
+def _on_invalidate(kind: str):
+    """Register the handler another replica's _state_publish(kind, ...) lands on."""
+    def register(fn):
+        _invalidation_handlers[kind] = fn
+        return fn
+    return register
+
+
+def _state_publish(kind: str, rid: Optional[str] = None, data: Any = None):
+    """Tell the other replicas that their copy of `kind` for rid is stale. No-op with
+    the memory backend. Best effort: a lost message only means a cache lives out its TTL."""
+    if STATE_BACKEND != "redis":
+        return
+    try:
+        _state_redis_client().publish(_STATE_CHANNEL, _json.dumps(
+            {"origin": _REPLICA_ID, "kind": kind, "rid": rid, "data": data}, default=str))
+    except Exception as e:
+        _log("state").warning(f"publish {kind} failed: {e}")
+
+
+def _state_listen_loop():
+    while True:
+        try:
+            ps = _state_redis_client().pubsub(ignore_subscribe_messages=True)
+            ps.subscribe(_STATE_CHANNEL)
+            for msg in ps.listen():
+                try:
+                    m = _json.loads(msg["data"])
+                    handler = _invalidation_handlers.get(m.get("kind"))
+                    if handler and m.get("origin") != _REPLICA_ID:
+                        handler(m.get("rid"), m.get("data"))
+                except Exception as e:
+                    _log("state").warning(f"invalidation handler failed: {e}")
+        except Exception as e:
+            _log("state").warning(f"subscriber disconnected, retrying: {e}")
+        time.sleep(5)
+
+# ── Workers & leader election ────────────────────────────────────────────────
+# Background jobs are registered with _background(fn) instead of being started at
+# import, and start from the app's startup hook — i.e. once per worker process, after
+# uvicorn --workers N has spawned it or gunicorn --preload has forked it. A worker that
+# finds itself in a different pid than the one that imported the module rebuilds the
+# clients it inherited (supabase, redis) before anything runs.
+#
+# Jobs that write shared data (seeding, duplicate cleanup, pollers, samplers) are
+# registered with leader=True and run only in the elected leader: the worker holding an
+# flock on WORKER_LEADER_LOCK (one box), or with STATE_BACKEND=redis the holder of the
+# rb:leader lease (any number of boxes). Leader loops re-check _is_leader() every cycle,
+# so a worker that loses the lease stops doing leader work. More than one worker also
+# needs STATE_BACKEND=redis, or every process keeps its own copy of the floor.
+WORKER_LEADER_LOCK = os.environ.get("WORKER_LEADER_LOCK", "/tmp/restaurant-brain-leader.lock")
+LEADER_LEASE_SEC   = int(os.environ.get("LEADER_LEASE_SEC", "30"))
+
+_background_tasks: list = []   # [(fn, leader_only)] in registration order
+_worker: dict = {"pid": os.getpid(), "started": False, "leader": False,
+                 "leader_started": False, "lock_fh": None}
+
+
+def _background(fn, leader: bool = False):
+    """Run fn in a daemon thread once the worker starts (leader=True: only in the leader)."""
+    _background_tasks.append((fn, leader))
+
+
+def _is_leader() -> bool:
+    return _worker["leader"]
+
+
+# Renew only if we still hold the lease; a GET then EXPIRE could extend a lease
+# another replica took over in between.
+_LEADER_RENEW_LUA = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('pexpire', KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+
+def _leader_try() -> bool:
+    if STATE_BACKEND == "redis":
+        r = _state_redis_client()
+        if r.set("rb:leader", _REPLICA_ID, nx=True, ex=LEADER_LEASE_SEC):
+            return True
+        return bool(r.eval(_LEADER_RENEW_LUA, 1, "rb:leader", _REPLICA_ID, LEADER_LEASE_SEC * 1000))
+    if _worker["lock_fh"] is not None:
+        return True
+    try:
+        import fcntl
+    except ImportError:
+        return True   # no flock on this platform — single-process dev box
+    fh = open(WORKER_LEADER_LOCK, "a+")
+    try:
+        fcntl.flock(fh, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        fh.close()
+        return False
+    _worker["lock_fh"] = fh   # held until this process exits; the OS releases it on death
+    return True
 
-# In-memory: tracks the ISO timestamp when a host last set quoted_wait for each entry.
-# Used by the guest page to detect a timer reset even when the new value equals the old one.
-# Cleared on server restart (acceptable — guests resume with best-effort timing).
-_wait_set_at: dict = {}
 
-# In-memory: tracks which guest is at which table (keyed by "rid:table_number").
-# Populated by seat-to-table, cleared by table clear.
-_table_occupants: dict = {}   # { "rid:table_number": { "name": str, "party_size": int, "entry_id": str } }
-_occupants_lock   = threading.Lock()   # Protects concurrent read/write of _table_occupants
+def _leader_loop():
+    while True:
+        try:
+            leading = _leader_try()
+        except Exception as e:
+            _log("workers").warning(f"leader check failed: {e}")
+            leading = False
+        if leading != _worker["leader"]:
+            _worker["leader"] = leading
+            _log("workers").info(f"pid={os.getpid()} {'is now' if leading else 'is no longer'} the leader")
+            if leading and not _worker["leader_started"]:
+                _worker["leader_started"] = True
+                for fn, leader_only in _background_tasks:
+                    if leader_only:
+                        threading.Thread(target=fn, daemon=True).start()
+        time.sleep(max(1, LEADER_LEASE_SEC // 3))
+
+
+def _worker_after_fork():
+    """Drop everything the parent process created; none of it is safe to share."""
+    global supabase, _state_redis, _REPLICA_ID, _menu_pool, _menu_share_pool, _wb_journal
+    supabase     = _storage_client()
+    _wb_journal  = None
+    _state_redis = None
+    _REPLICA_ID  = _uuid.uuid4().hex[:12]
+    _menu_pool   = None
+    _menu_share_pool = None
+    _log_setup()   # the queue listener thread didn't survive the fork
+    _worker.update(pid=os.getpid(), started=False, leader=False, leader_started=False, lock_fh=None)
+
+
+def _worker_start():
+    if os.getpid() != _worker["pid"]:
+        _worker_after_fork()
+    if _worker["started"]:
+        return
+    _worker["started"] = True
+    workers = int(os.environ.get("WEB_CONCURRENCY", "1") or 1)
+    if workers > 1 and STATE_BACKEND == "memory":
+        _log("workers").warning(f"WEB_CONCURRENCY={workers} with STATE_BACKEND=memory — "
+                                f"each worker keeps its own occupants, quote timers and menu parse jobs; "
+                                f"set STATE_BACKEND=redis")
+    if workers > 1 and STORAGE_BACKEND == "memory":
+        _log("workers").warning(f"WEB_CONCURRENCY={workers} with STORAGE_BACKEND=memory — "
+                                f"each worker has its own empty database; use STORAGE_BACKEND=sqlite")
+    for fn, leader_only in _background_tasks:
+        if not leader_only:
+            threading.Thread(target=fn, daemon=True).start()
+    threading.Thread(target=_leader_loop, daemon=True).start()
+    _log("workers").info(f"pid={os.getpid()} started ({STATE_BACKEND} state)")
+
+
+if STATE_BACKEND == "redis":
+    _background(_state_listen_loop)
 
 # ── Demo submissions (persisted in memory + Supabase) ────────────────────────
 _demo_submissions: list = []
@@ -46,34 +871,41 @@ def _load_demo_subs():
             _demo_submissions = res.data
             return
     except Exception as e:
-        print(f"[DEMO SUBS] Failed to load from Supabase: {e}")
+        _log("demo.subs").warning(f"Failed to load from Supabase: {e}")
 
 def _save_demo_sub_to_db(sub: dict):
     try:
         supabase.table("demo_submissions").insert(sub).execute()
     except Exception as e:
-        print(f"[DEMO SUBS] Failed to save to Supabase: {e}")
+        _log("demo.subs").warning(f"Failed to save to Supabase: {e}")
+
+@_on_invalidate("demo_submission")
+def _demo_sub_received(rid: Optional[str], sub: dict):
+    """A submission that landed on another replica — keep the fallback list complete."""
+    with _submissions_lock:
+        if not any(s.get("id") == sub.get("id") for s in _demo_submissions):
+            _demo_submissions.insert(0, sub)
 
 # Load existing submissions in the background so startup is never blocked
-threading.Thread(target=_load_demo_subs, daemon=True).start()
+_background(_load_demo_subs)
 
 def _seed_wait_set_at():
-    """Repopulate _wait_set_at from DB on startup so remaining_wait stays accurate after restarts."""
+    """Repopulate wait timers from DB on startup so remaining_wait stays accurate after restarts."""
     try:
         res = supabase.table("queue_entries") \
-            .select("id, quoted_wait_set_at") \
+            .select("id, restaurant_id, quoted_wait_set_at") \
             .in_("status", ["waiting", "ready"]) \
             .not_.is_("quoted_wait_set_at", "null") \
             .execute()
         for row in (res.data or []):
             if row.get("quoted_wait_set_at"):
-                _wait_set_at[row["id"]] = row["quoted_wait_set_at"]
+                _rstate(row.get("restaurant_id")).wait_set(row["id"], row["quoted_wait_set_at"])
         if res.data:
-            print(f"[startup] Seeded _wait_set_at for {len(res.data)} active queue entries")
+            _log("startup").info(f"Seeded wait timers for {len(res.data)} active queue entries")
     except Exception as e:
-        print(f"[startup] _seed_wait_set_at failed (column may not exist yet): {e}")
+        _log("startup").warning(f"_seed_wait_set_at failed (column may not exist yet): {e}")
 
-threading.Thread(target=_seed_wait_set_at, daemon=True).start()
+_background(_seed_wait_set_at)
 
 def _ensure_demo_tables():
     """Guarantee the demo restaurant + its 16 tables exist in the DB.
@@ -97,18 +929,15 @@ def _ensure_demo_tables():
         ]
         if missing:
             supabase.table("tables").insert(missing).execute()
-            print(f"[startup] Inserted {len(missing)} missing demo tables: {[m['table_number'] for m in missing]}")
+            _log("startup").info(f"Inserted {len(missing)} missing demo tables: {[m['table_number'] for m in missing]}")
         # Clear stale in-memory occupants for demo restaurant on every startup
-        prefix = f"{rid}:"
-        stale_keys = [k for k in list(_table_occupants.keys()) if k.startswith(prefix)]
-        for k in stale_keys:
-            del _table_occupants[k]
-        if stale_keys:
-            print(f"[startup] Cleared {len(stale_keys)} stale demo occupant(s): {stale_keys}")
+        stale = _rstate(rid).clear_occupants()
+        if stale:
+            _log("startup").info(f"Cleared {stale} stale demo occupant(s)")
     except Exception as e:
-        print(f"[startup] _ensure_demo_tables failed: {e}")
+        _log("startup").warning(f"_ensure_demo_tables failed: {e}")
 
-threading.Thread(target=_ensure_demo_tables, daemon=True).start()
+_background(_ensure_demo_tables, leader=True)
 
 WALNUT_RESTAURANTS = [
     {
@@ -216,7 +1045,7 @@ def _ensure_walnut_restaurants():
                 supabase.table("restaurants").insert({
                     "id": rid, "name": rest["name"], "slug": rest["slug"]
                 }).execute()
-                print(f"[startup] Created restaurant: {rest['name']}")
+                _log("startup").info(f"Created restaurant: {rest['name']}")
             existing = supabase.table("tables").select("table_number").eq("restaurant_id", rid).execute().data or []
             # Cast to int — Supabase may return table_number as string depending on column type
             existing_nums = {int(row["table_number"]) for row in existing}
@@ -228,13 +1057,13 @@ def _ensure_walnut_restaurants():
             ]
             if missing:
                 supabase.table("tables").insert(missing).execute()
-                print(f"[startup] Inserted {len(missing)} tables for {rest['name']}: {[m['table_number'] for m in missing]}")
+                _log("startup").info(f"Inserted {len(missing)} tables for {rest['name']}: {[m['table_number'] for m in missing]}")
             else:
-                print(f"[startup] All tables already exist for {rest['name']} ({len(existing_nums)} rows)")
+                _log("startup").info(f"All tables already exist for {rest['name']} ({len(existing_nums)} rows)")
         except Exception as e:
-            print(f"[startup] _ensure_walnut_restaurants failed for {rest['name']}: {e}")
+            _log("startup").warning(f"_ensure_walnut_restaurants failed for {rest['name']}: {e}")
 
-threading.Thread(target=_ensure_walnut_restaurants, daemon=True).start()
+_background(_ensure_walnut_restaurants, leader=True)
 
 _WALNUT_ORIGINAL_ID  = "0001cafe-0001-4000-8000-000000000001"
 _WALNUT_SOUTHSIDE_ID = "0002cafe-0001-4000-8000-000000000002"
@@ -297,9 +1126,9 @@ def _seed_walnut_guest_configs():
                     patch["nfc_url"] = _WALNUT_NFC_URLS[rid]
                 if patch:
                     supabase.table("restaurant_configs").update(patch).eq("restaurant_id", rid).execute()
-                    print(f"[walnut-seed] Patched guest_config/nfc_url for rid={rid}")
+                    _log("walnut-seed").info(f"Patched guest_config/nfc_url for rid={rid}")
                 else:
-                    print(f"[walnut-seed] guest_config already complete for rid={rid}")
+                    _log("walnut-seed").info(f"guest_config already complete for rid={rid}")
             else:
                 # No config row yet — insert with defaults
                 supabase.table("restaurant_configs").insert({
@@ -307,11 +1136,11 @@ def _seed_walnut_guest_configs():
                     "guest_config":  _json.dumps(defaults),
                     "nfc_url":       _WALNUT_NFC_URLS.get(rid),
                 }).execute()
-                print(f"[walnut-seed] Inserted guest_config for rid={rid}")
+                _log("walnut-seed").info(f"Inserted guest_config for rid={rid}")
         except Exception as e:
-            print(f"[walnut-seed] WARNING: could not seed rid={rid}: {e}")
+            _log("walnut-seed").warning(f"could not seed rid={rid}: {e}")
 
-threading.Thread(target=_seed_walnut_guest_configs, daemon=True).start()
+_background(_seed_walnut_guest_configs, leader=True)
 
 
 def _sync_walnut_southside_menu():
@@ -328,30 +1157,30 @@ def _sync_walnut_southside_menu():
                 except: mc = None
             # Only copy if Southside has no menu items at all
             if mc and isinstance(mc.get("sections"), list) and any(s.get("items") for s in mc["sections"]):
-                print("[sync_walnut_menus] Southside already has menu items — skipping copy")
+                _log("sync_walnut_menus").info("Southside already has menu items — skipping copy")
                 return
         # Fetch Original's menu
         orig = supabase.table("restaurant_configs").select("menu_config").eq("restaurant_id", ORIGINAL_ID).limit(1).execute()
         if not orig.data:
-            print("[sync_walnut_menus] Original has no config — skipping")
+            _log("sync_walnut_menus").info("Original has no config — skipping")
             return
         mc = orig.data[0].get("menu_config")
         if isinstance(mc, str):
             try: mc = _json.loads(mc)
             except: mc = None
         if not mc or not isinstance(mc.get("sections"), list) or not any(s.get("items") for s in mc["sections"]):
-            print("[sync_walnut_menus] Original has no menu items — skipping")
+            _log("sync_walnut_menus").info("Original has no menu items — skipping")
             return
         # Copy to Southside
         menu_json = _json.dumps(mc) if isinstance(mc, dict) else mc
         supabase.table("restaurant_configs").update({"menu_config": menu_json}).eq("restaurant_id", SOUTHSIDE_ID).execute()
         nsec = len(mc["sections"])
         nitem = sum(len(s.get("items", [])) for s in mc["sections"])
-        print(f"[sync_walnut_menus] Copied {nsec} sections / {nitem} items from Original → Southside")
+        _log("sync_walnut_menus").info(f"Copied {nsec} sections / {nitem} items from Original → Southside")
     except Exception as e:
-        print(f"[sync_walnut_menus] Error: {e}")
+        _log("sync_walnut_menus").error(f"Error: {e}")
 
-threading.Thread(target=_sync_walnut_southside_menu, daemon=True).start()
+_background(_sync_walnut_southside_menu, leader=True)
 
 
 def _rebuild_occupants_for_restaurant(rid: str) -> int:
@@ -388,7 +1217,7 @@ def _rebuild_occupants_for_restaurant(rid: str) -> int:
 
         events = (
             supabase.table("seating_events")
-            .select("table_id, queue_entry_id")
+            .select("table_id, queue_entry_id, created_at")
             .eq("restaurant_id", rid)
             .in_("table_id", occ_table_ids)
             .eq("action", "seated")
@@ -399,11 +1228,13 @@ def _rebuild_occupants_for_restaurant(rid: str) -> int:
 
         seen: set = set()
         entry_id_to_table_id: dict = {}
+        seated_at_by_entry: dict = {}
         for ev in events:
             tid = ev.get("table_id")
             if tid and tid not in seen:
                 seen.add(tid)
                 entry_id_to_table_id[ev["queue_entry_id"]] = tid
+                seated_at_by_entry[ev["queue_entry_id"]] = ev.get("created_at")
 
         # Fallback: if a table is flagged "occupied" but has NO seating_event today
         # (shouldn't happen in normal flow, but can happen if a row was manually set
@@ -420,52 +1251,47 @@ def _rebuild_occupants_for_restaurant(rid: str) -> int:
                 .execute().data or []
             )
 
-        seeded = 0
-        with _occupants_lock:
-            for e in entries:
-                tid  = entry_id_to_table_id[e["id"]]
-                tnum = table_id_to_num.get(tid)
-                if tnum is None:
-                    continue
-                key = f"{rid}:{tnum}"
-                if key not in _table_occupants:
-                    _table_occupants[key] = {
-                        "name":       e.get("name") or "Guest",
-                        "party_size": e.get("party_size", 2),
-                        "entry_id":   e["id"],
-                    }
-                    seeded += 1
-            # Placeholder for any orphaned "occupied" tables
-            for tid in remaining_tids:
-                tnum = table_id_to_num.get(tid)
-                if tnum is None:
-                    continue
-                key = f"{rid}:{tnum}"
-                if key not in _table_occupants:
-                    _table_occupants[key] = {
-                        "name":       "Guest",
-                        "party_size": 2,
-                        "entry_id":   None,
-                    }
-                    seeded += 1
+        found: dict = {}
+        for e in entries:
+            tid  = entry_id_to_table_id[e["id"]]
+            tnum = table_id_to_num.get(tid)
+            if tnum is None:
+                continue
+            found.setdefault(str(tnum), {
+                "name":       e.get("name") or "Guest",
+                "party_size": e.get("party_size", 2),
+                "entry_id":   e["id"],
+                "seated_at":  seated_at_by_entry.get(e["id"]),
+            })
+        # Placeholder for any orphaned "occupied" tables
+        for tid in remaining_tids:
+            tnum = table_id_to_num.get(tid)
+            if tnum is None:
+                continue
+            found.setdefault(str(tnum), {
+                "name":       "Guest",
+                "party_size": 2,
+                "entry_id":   None,
+            })
+        seeded = _rstate(rid).seed_occupants(found)
         return seeded
     except Exception as e:
-        print(f"[rebuild_occupants] rid={rid} error: {e}")
+        _log("rebuild_occupants").error(f"rid={rid} error: {e}")
         return 0
 
 def _seed_table_occupants():
-    """Restore real guest names in _table_occupants from seating_events after a server restart.
+    """Restore real guest names in the in-memory occupants from seating_events after a server restart.
     Without this, tables show 'Guest' after every Railway deployment (any git push auto-deploys)."""
     try:
         all_rids = [r for r in [RESTAURANT_ID] + [r["id"] for r in WALNUT_RESTAURANTS] + [DEMO_RESTAURANT_ID] if r]
         for rid in all_rids:
             seeded = _rebuild_occupants_for_restaurant(rid)
             if seeded:
-                print(f"[startup] Seeded {seeded} occupant name(s) for restaurant {rid}")
+                _log("startup").info(f"Seeded {seeded} occupant name(s) for restaurant {rid}")
     except Exception as e:
-        print(f"[startup] _seed_table_occupants outer error: {e}")
+        _log("startup").error(f"_seed_table_occupants outer error: {e}")
 
-threading.Thread(target=_seed_table_occupants, daemon=True).start()
+_background(_seed_table_occupants)
 
 app = FastAPI(title="Restaurant Brain API")
 
@@ -477,6 +1303,295 @@ app.add_middleware(
     allow_headers=["Content-Type", "Authorization", "X-Owner-Secret"],
 )
 
+@app.on_event("startup")
+def _on_startup():
+    _worker_start()
+
+# ── Metrics ───────────────────────────────────────────────────────────────────
+# Request latency, Supabase round trips and outbound SMS / AI calls, exposed in
+# Prometheus text format on GET /metrics (p50/p95/p99 via histogram_quantile) and
+# summarised per route on GET /owner/metrics. Supabase calls are timed by wrapping
+# postgrest's send_with_retry, which every execute() goes through; the calls made
+# while serving a request are also totalled per request through a contextvar, so
+# "how many DB trips does /state make" is one histogram. Threadpool saturation is
+# sampled at each request start (sync endpoints run on anyio's default limiter).
+# Set METRICS_TOKEN to require "Authorization: Bearer <token>" on /metrics.
+METRICS_TOKEN = os.environ.get("METRICS_TOKEN", "")
+
+_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+_COUNT_BUCKETS   = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55)
+
+_metrics_lock = threading.Lock()
+
+
+class _Histogram:
+    """Cumulative-bucket histogram keyed by a label tuple."""
+
+    def __init__(self, name: str, doc: str, labels: tuple, buckets: tuple = _LATENCY_BUCKETS):
+        self.name, self.doc, self.labels, self.buckets = name, doc, labels, buckets
+        self.series: dict = {}   # label values → [bucket counts..., +Inf count, sum]
+
+    def observe(self, value: float, *label_values):
+        with _metrics_lock:
+            s = self.series.get(label_values)
+            if s is None:
+                s = self.series[label_values] = [0] * (len(self.buckets) + 1) + [0.0]
+            for i, b in enumerate(self.buckets):
+                if value <= b:
+                    s[i] += 1
+            s[-2] += 1
+            s[-1] += value
+
+    def quantile(self, q: float, *label_values) -> Optional[float]:
+        """Linear interpolation inside the bucket holding the q-th observation."""
+        with _metrics_lock:
+            s = list(self.series.get(label_values) or [])
+        if not s or not s[-2]:
+            return None
+        rank, prev_b, prev_c = q * s[-2], 0.0, 0
+        for b, c in zip(self.buckets, s):
+            if c >= rank:
+                return prev_b + (b - prev_b) * ((rank - prev_c) / max(c - prev_c, 1))
+            prev_b, prev_c = b, c
+        return self.buckets[-1]
+
+    def render(self) -> list:
+        out = [f"# HELP {self.name} {self.doc}", f"# TYPE {self.name} histogram"]
+        with _metrics_lock:
+            items = [(k, list(v)) for k, v in self.series.items()]
+        for values, s in sorted(items):
+            lbl = ",".join(f'{k}="{v}"' for k, v in zip(self.labels, values))
+            sep = "," if lbl else ""
+            for b, c in zip(self.buckets, s):
+                out.append(f'{self.name}_bucket{{{lbl}{sep}le="{b}"}} {c}')
+            out.append(f'{self.name}_bucket{{{lbl}{sep}le="+Inf"}} {s[-2]}')
+            out.append(f"{self.name}_sum{{{lbl}}} {s[-1]:.6f}")
+            out.append(f"{self.name}_count{{{lbl}}} {s[-2]}")
+        return out
+
+
+class _Counter:
+    def __init__(self, name: str, doc: str, labels: tuple):
+        self.name, self.doc, self.labels = name, doc, labels
+        self.series: dict = {}
+
+    def inc(self, *label_values, n: float = 1):
+        with _metrics_lock:
+            self.series[label_values] = self.series.get(label_values, 0) + n
+
+    def render(self) -> list:
+        out = [f"# HELP {self.name} {self.doc}", f"# TYPE {self.name} counter"]
+        with _metrics_lock:
+            items = sorted(self.series.items())
+        for values, v in items:
+            lbl = ",".join(f'{k}="{v}"' for k, v in zip(self.labels, values))
+            out.append(f"{self.name}{{{lbl}}} {v}")
+        return out
+
+
+_m_http_seconds   = _Histogram("http_request_duration_seconds", "Request latency by route.", ("method", "route"))
+_m_http_total     = _Counter("http_requests_total", "Requests by route and status.", ("method", "route", "status"))
+_m_req_db_calls   = _Histogram("http_request_db_calls", "Supabase calls made while serving one request.",
+                               ("method", "route"), _COUNT_BUCKETS)
+_m_req_db_seconds = _Histogram("http_request_db_seconds", "Time spent in Supabase calls per request.", ("method", "route"))
+_m_db_seconds     = _Histogram("db_call_duration_seconds", "Supabase (PostgREST) call latency.", ("table", "op", "status"))
+_m_external       = _Histogram("external_call_duration_seconds", "Outbound SMS / AI call latency.",
+                               ("service", "provider", "status"))
+_METRICS = (_m_http_seconds, _m_http_total, _m_req_db_calls, _m_req_db_seconds, _m_db_seconds, _m_external)
+
+_metrics_gauges: dict = {"in_flight": 0, "pool_peak": 0}
+
+_request_db = contextvars.ContextVar("_request_db", default=None)   # [calls, seconds] for the current request
+
+
+def _db_observe(dt: float, table: str, op: str, status: str):
+    """Record one storage call, from either the PostgREST client or the local engine."""
+    _m_db_seconds.observe(dt, table, op, status)
+    acc = _request_db.get()
+    if acc is not None:
+        acc[0] += 1
+        acc[1] += dt
+
+
+def _instrument_postgrest():
+    try:
+        from postgrest._sync import request_builder as rb
+        orig = rb.send_with_retry
+    except (ImportError, AttributeError) as e:
+        _log("metrics").warning(f"postgrest not instrumented: {e}")
+        return
+    if getattr(orig, "_metered", False):
+        return
+
+    def send_with_retry(req, *a, **kw):
+        t0, status = time.perf_counter(), "error"
+        try:
+            resp = orig(req, *a, **kw)
+            status = "ok" if resp.is_success else str(resp.status_code)
+            return resp
+        finally:
+            path = str(getattr(req, "path", "")).split("/rest/v1/", 1)[-1]
+            _db_observe(time.perf_counter() - t0, path.replace("/", ":") or "?", getattr(req, "http_method", "?"), status)
+
+    send_with_retry._metered = True
+    rb.send_with_retry = send_with_retry
+
+_instrument_postgrest()
+
+
+class _ExternalCall:
+    """with _ExternalCall("sms", "twilio") as call: ... — set call.status to record a soft failure."""
+    __slots__ = ("service", "provider", "status", "t0")
+
+    def __init__(self, service: str, provider: str):
+        self.service, self.provider, self.status = service, provider, "ok"
+
+    def __enter__(self):
+        self.t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.status = "error"
+        _m_external.observe(time.perf_counter() - self.t0, self.service, self.provider, self.status)
+        return False
+
+
+def _threadpool_usage() -> tuple:
+    try:
+        import anyio.to_thread
+        lim = anyio.to_thread.current_default_thread_limiter()
+        return int(lim.borrowed_tokens), int(lim.total_tokens)
+    except Exception:
+        return 0, 0
+
+
+# Routes the station, guest page and camera boxes hit every few seconds — their access
+# lines are sampled at LOG_POLL_SAMPLE (errors and slow requests are always logged).
+_POLL_ROUTES = {
+    "/state", "/queue", "/queue/{entry_id}", "/tables", "/tables/occupants", "/insights",
+    "/reservations/upcoming", "/reservations/arriving", "/reservations/late",
+    "/events/camera", "/events/delivery", "/events/throughput", "/events/batch",
+    "/menu/parse/jobs/{job_id}", "/purge/jobs/{job_id}",
+}
+_REQUEST_ID_RE = re.compile(r"^[A-Za-z0-9._-]{1,64}$")
+
+
+class _MetricsMiddleware:
+    """Pure ASGI so streaming responses and background tasks pass straight through.
+    Also owns the request id (X-Request-ID in, or a fresh one; echoed on the response)
+    and the per-request access log line."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        status = {"code": 500}
+        req_id = next((v.decode("latin-1") for k, v in scope.get("headers") or [] if k == b"x-request-id"), "")
+        if not _REQUEST_ID_RE.match(req_id):
+            req_id = _uuid.uuid4().hex[:16]
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+                message.setdefault("headers", [])
+                message["headers"] = list(message["headers"]) + [(b"x-request-id", req_id.encode())]
+            await send(message)
+
+        used, _ = _threadpool_usage()
+        _metrics_gauges["pool_peak"] = max(_metrics_gauges["pool_peak"], used)
+        _metrics_gauges["in_flight"] += 1
+        acc    = [0, 0.0]
+        token  = _request_db.set(acc)
+        rtoken = _request_id.set(req_id)
+        t0     = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            dt = time.perf_counter() - t0
+            _metrics_gauges["in_flight"] -= 1
+            route  = getattr(scope.get("route"), "path", None) or "unmatched"
+            method = scope.get("method", "?")
+            if route != "/metrics":
+                _m_http_seconds.observe(dt, method, route)
+                _m_http_total.inc(method, route, str(status["code"]))
+                _m_req_db_calls.observe(acc[0], method, route)
+                _m_req_db_seconds.observe(acc[1], method, route)
+                self._access_log(method, route, status["code"], dt, acc)
+            _request_db.reset(token)
+            _request_id.reset(rtoken)
+
+    @staticmethod
+    def _access_log(method: str, route: str, code: int, dt: float, acc: list):
+        ms   = dt * 1000
+        poll = route in _POLL_ROUTES
+        if code < 500 and ms < LOG_SLOW_MS and poll and random.random() >= LOG_POLL_SAMPLE:
+            return
+        level = logging.ERROR if code >= 500 else logging.WARNING if ms >= LOG_SLOW_MS else logging.INFO
+        _log("http").log(level, f"{method} {route} {code}", extra={"fields": {
+            "method": method, "route": route, "status": code, "ms": round(ms, 1),
+            "db_calls": acc[0], "db_ms": round(acc[1] * 1000, 1),
+            **({"sample_rate": LOG_POLL_SAMPLE} if poll and code < 500 and ms < LOG_SLOW_MS else {}),
+        }})
+
+app.add_middleware(_MetricsMiddleware)
+
+
+@app.get("/metrics")
+async def metrics(request: Request):
+    """Prometheus scrape endpoint."""
+    if METRICS_TOKEN and request.headers.get("authorization", "") != f"Bearer {METRICS_TOKEN}":
+        raise HTTPException(status_code=401, detail="Unauthorized")
+    used, total = _threadpool_usage()
+    peak = max(_metrics_gauges["pool_peak"], used)
+    _metrics_gauges["pool_peak"] = used   # peak is "since the last scrape"
+    lines: list = []
+    for m in _METRICS:
+        lines += m.render()
+    lines += [
+        "# HELP http_requests_in_flight Requests currently being served.",
+        "# TYPE http_requests_in_flight gauge",
+        f"http_requests_in_flight {_metrics_gauges['in_flight']}",
+        "# HELP threadpool_threads_in_use Worker threads busy with sync endpoints.",
+        "# TYPE threadpool_threads_in_use gauge",
+        f"threadpool_threads_in_use {used}",
+        "# HELP threadpool_threads_peak Most worker threads busy at a request start since the last scrape.",
+        "# TYPE threadpool_threads_peak gauge",
+        f"threadpool_threads_peak {peak}",
+        "# HELP threadpool_threads_total Size of the sync-endpoint threadpool.",
+        "# TYPE threadpool_threads_total gauge",
+        f"threadpool_threads_total {total}",
+    ]
+    return Response("\n".join(lines) + "\n", media_type="text/plain; version=0.0.4")
+
+
+@app.get("/owner/metrics")
+def owner_metrics(secret: Optional[str] = None):
+    """Per-route latency percentiles and Supabase round trips since this worker started."""
+    _check_owner_secret(secret)
+    routes = []
+    with _metrics_lock:
+        keys = list(_m_http_seconds.series)
+    for method, route in keys:
+        s = _m_http_seconds.series[(method, route)]
+        db = _m_req_db_calls.series.get((method, route)) or [0] * (len(_COUNT_BUCKETS) + 1) + [0.0]
+        routes.append({
+            "method":       method,
+            "route":        route,
+            "count":        s[-2],
+            "p50_ms":       round((_m_http_seconds.quantile(0.50, method, route) or 0) * 1000, 1),
+            "p95_ms":       round((_m_http_seconds.quantile(0.95, method, route) or 0) * 1000, 1),
+            "p99_ms":       round((_m_http_seconds.quantile(0.99, method, route) or 0) * 1000, 1),
+            "avg_db_calls": round(db[-1] / db[-2], 2) if db[-2] else 0,
+        })
+    routes.sort(key=lambda r: r["p95_ms"] * r["count"], reverse=True)
+    used, total = _threadpool_usage()
+    return {"routes": routes, "threadpool": {"in_use": used, "total": total},
+            "in_flight": _metrics_gauges["in_flight"], "pid": os.getpid()}
+
+
 @app.post("/admin/reseed-walnut")
 def reseed_walnut():
     """Re-run the Walnut table seeding on demand. Idempotent — safe to call anytime."""
@@ -484,215 +1599,552 @@ def reseed_walnut():
     return {"status": "ok", "message": "Walnut table seeding complete"}
 
 
-# ── Client agreement signing ──────────────────────────────────────────────────
+# ── Menu parse pipeline ───────────────────────────────────────────────────────
+# Uploads are split into page-sized chunks (one per image, one per PDF page, one
+# per text file). Image normalisation and PDF splitting (menu_workers.py) run in a
+# process pool so Pillow never blocks the event loop; each chunk then goes to Claude as its own
+# concurrent async request and the per-page sections are merged here.
+MENU_PARSE_WORKERS     = int(os.environ.get("MENU_PARSE_WORKERS", str(min(4, os.cpu_count() or 1))))
+MENU_PARSE_CONCURRENCY = int(os.environ.get("MENU_PARSE_CONCURRENCY", "4"))
+MENU_PARSE_TIMEOUT_SEC = float(os.environ.get("MENU_PARSE_TIMEOUT_SEC", "60"))
+MENU_JOB_TTL_SEC       = int(os.environ.get("MENU_JOB_TTL_SEC", "3600"))
+MENU_CACHE_DIR         = os.environ.get("MENU_CACHE_DIR", os.path.join("/tmp", "restaurant-brain-menu-cache"))
+MENU_CACHE_MAX_MB      = float(os.environ.get("MENU_CACHE_MAX_MB", "256"))   # 0 disables the cache
+_MENU_MODEL            = "claude-haiku-4-5-20251001"
+
+_MENU_IMAGE_TYPES = {
+    "image/jpeg", "image/jpg", "image/png", "image/webp", "image/gif",
+    "image/heic", "image/heif",  # Apple HEIC (iPhone photos)
+}
+_MENU_IMAGE_EXTS = {"jpg", "jpeg", "png", "webp", "gif", "heic", "heif"}
+
+_MENU_PAGE_PROMPT = (
+    "This is one page of a restaurant menu. Return a JSON array of the menu sections on this page. "
+    "Each section must have: title (string), items (array of objects with name, description, price, tags). "
+    "tags is an array of strings like 'vegetarian', 'spicy', 'gluten-free'. "
+    "If the page continues a section from a previous page without a visible heading, use the most likely section title. "
+    "Return ONLY valid JSON, no markdown code blocks, no explanation."
+)
+_PLACEHOLDER_DESCS = {"none", "n/a", "na", "-", "—", "null", "undefined", "no description", "not available", ""}
+
+_menu_jobs: dict = {}   # { job_id: { status, pages_total, pages_done, pages_failed, sections, error, ... } }
+_menu_jobs_lock = threading.Lock()
+_menu_share_pool = None   # one thread, so job snapshots reach Redis in the order they were taken
+_menu_pool      = None
+_menu_pool_lock = threading.Lock()
+_menu_cache_lock  = threading.Lock()
+_menu_cache_bytes = None   # running total of MENU_CACHE_DIR, measured on first write
+
+
+def _menu_executor():
+    """Lazily start the pool. Workers come from a forkserver that preloads only menu_workers:
+    forking this process would copy its threads' held locks (log queue, httpx pools) into
+    the child, and spawn would re-import main."""
+    global _menu_pool
+    with _menu_pool_lock:
+        if _menu_pool is None:
+            import concurrent.futures, multiprocessing
+            try:
+                ctx = multiprocessing.get_context("forkserver")
+                ctx.set_forkserver_preload(["menu_workers"])
+                _menu_pool = concurrent.futures.ProcessPoolExecutor(max_workers=MENU_PARSE_WORKERS, mp_context=ctx)
+            except (ValueError, OSError) as e:
+                _log("menu_parse").warning(f"process pool unavailable ({e}) — using threads")
+                _menu_pool = concurrent.futures.ThreadPoolExecutor(max_workers=MENU_PARSE_WORKERS)
+        return _menu_pool
 
-class AgreementAcceptRequest(BaseModel):
-    business_name:      str
-    signer_name:        str
-    signer_email:       str
-    signer_title:       Optional[str] = None
-    phone:              Optional[str] = None
-    address:            Optional[str] = None
-    location_count:     int = Field(ge=1, le=50, default=1)
-    plan_type:          str                       # "single" | "multi"
-    monthly_fee:        float                     # dollars
-    agreement_version:  str
-    ip_address:         Optional[str] = None
-    user_agent:         Optional[str] = None
 
-@app.post("/menu/parse")
-async def menu_parse(file: List[UploadFile] = File(...)):
-    """Parse one or more menu images/documents with Claude and return structured sections."""
-    import base64, urllib.request, urllib.error, urllib.parse, json as _json2
+# Parsed sections are cached on disk, content-addressed by the SHA-256 of each
+# normalised page (JPEG bytes, single-page PDF bytes or text) salted with the
+# model and prompt, so a re-uploaded page never reaches Claude twice. A second
+# map from the raw upload's hash to its page keys lets repeat uploads skip the
+# Pillow / pypdf pass as well. Least-recently-read entries are evicted once the
+# directory passes MENU_CACHE_MAX_MB.
+_MENU_CACHE_SALT = hashlib.sha256(f"{_MENU_MODEL}\n{_MENU_PAGE_PROMPT}".encode()).hexdigest()[:16]
 
-    if not ANTHROPIC_KEY:
-        raise HTTPException(status_code=500, detail="Missing Anthropic API key")
 
-    # Register HEIC support if pillow-heif is installed
+def _menu_page_key(payload: bytes) -> str:
+    return hashlib.sha256(_MENU_CACHE_SALT.encode() + payload).hexdigest()
+
+
+def _menu_cache_path(kind: str, key: str) -> str:
+    return os.path.join(MENU_CACHE_DIR, kind, key[:2], f"{key}.json")
+
+
+def _menu_cache_get(kind: str, key: str):
+    if MENU_CACHE_MAX_MB <= 0:
+        return None
+    path = _menu_cache_path(kind, key)
     try:
-        from pillow_heif import register_heif_opener as _reg_heif
-        _reg_heif()
-    except ImportError:
-        pass
+        with open(path, "r", encoding="utf-8") as fh:
+            value = _json.load(fh)
+        os.utime(path)   # mtime doubles as last-used for eviction
+        return value
+    except (OSError, ValueError):
+        return None
 
-    IMAGE_TYPES = {
-        "image/jpeg", "image/jpg", "image/png", "image/webp", "image/gif",
-        "image/heic", "image/heif",  # Apple HEIC (iPhone photos)
-    }
-    IMAGE_EXTS = {"jpg", "jpeg", "png", "webp", "gif", "heic", "heif"}
-    content: list = []
-    has_pdf = False
 
-    for f in file:
-        data = await f.read()
-        mime = (f.content_type or "application/octet-stream").split(";")[0].strip()
-        fname_ext = (f.filename or "").rsplit(".", 1)[-1].lower() if "." in (f.filename or "") else ""
-        is_image = mime in IMAGE_TYPES or fname_ext in IMAGE_EXTS
-        if is_image:
-            # Normalize to JPEG via Pillow (handles HEIC, HEIF, etc.)
+def _menu_cache_evict_locked():
+    global _menu_cache_bytes
+    limit = MENU_CACHE_MAX_MB * 1024 * 1024
+    if _menu_cache_bytes <= limit:
+        return
+    entries = []
+    for root, _dirs, names in os.walk(MENU_CACHE_DIR):
+        for n in names:
+            path = os.path.join(root, n)
             try:
-                from PIL import Image as _PIL
-                import io as _io
-                img = _PIL.open(_io.BytesIO(data))
-                if max(img.size) > 1024:
-                    img.thumbnail((1024, 1024), _PIL.LANCZOS)
-                img = img.convert("RGB")
-                buf = _io.BytesIO()
-                img.save(buf, format="JPEG", quality=85)
-                b64 = base64.b64encode(buf.getvalue()).decode()
-                content.append({
-                    "type": "image",
-                    "source": {"type": "base64", "media_type": "image/jpeg", "data": b64},
-                })
-            except Exception:
-                # Pillow couldn't open this file — skip rather than sending binary garbage
+                st = os.stat(path)
+            except OSError:
                 continue
-        elif mime == "application/pdf":
-            # Send PDFs as documents — Claude reads them natively
-            has_pdf = True
-            b64 = base64.b64encode(data).decode()
-            content.append({
-                "type": "document",
-                "source": {"type": "base64", "media_type": "application/pdf", "data": b64},
-            })
-        else:
-            text = data.decode("utf-8", errors="replace").strip()
-            if text:
-                content.append({"type": "text", "text": f"Menu file content:\n{text}"})
-
-    if not content:
-        raise HTTPException(status_code=400, detail="No readable content in uploaded files")
-
-    content.append({
-        "type": "text",
-        "text": (
-            "Parse all pages of this restaurant menu and return a JSON array of menu sections. "
-            "Each section must have: title (string), items (array of objects with name, description, price, tags). "
-            "tags is an array of strings like 'vegetarian', 'spicy', 'gluten-free'. "
-            "Combine all pages into one unified menu — merge duplicate section names. "
-            "Return ONLY valid JSON, no markdown code blocks, no explanation."
-        ),
-    })
+            entries.append((st.st_mtime, st.st_size, path))
+    entries.sort()
+    _menu_cache_bytes = sum(e[1] for e in entries)
+    # Trim to 90% so a burst of writes doesn't rescan the directory every time
+    for _mtime, size, path in entries:
+        if _menu_cache_bytes <= limit * 0.9:
+            break
+        try:
+            os.remove(path)
+            _menu_cache_bytes -= size
+        except OSError:
+            pass
 
-    headers: dict = {
-        "x-api-key":         ANTHROPIC_KEY,
-        "anthropic-version": "2023-06-01",
-        "content-type":      "application/json",
-    }
-    if has_pdf:
-        headers["anthropic-beta"] = "pdfs-2024-09-25"
-
-    payload = _json2.dumps({
-        "model": "claude-haiku-4-5-20251001",
-        "max_tokens": 8192,
-        "messages": [{"role": "user", "content": content}],
-    }).encode()
-
-    req = urllib.request.Request(
-        "https://api.anthropic.com/v1/messages",
-        data=payload,
-        method="POST",
-        headers=headers,
-    )
+
+def _menu_cache_put(kind: str, key: str, value):
+    global _menu_cache_bytes
+    if MENU_CACHE_MAX_MB <= 0:
+        return
+    path = _menu_cache_path(kind, key)
+    body = _json.dumps(value, separators=(",", ":")).encode()
     try:
-        with urllib.request.urlopen(req, timeout=60) as resp:
-            result = _json2.loads(resp.read())
-    except urllib.error.HTTPError as e:
-        if e.code == 429:
-            raise HTTPException(status_code=429, detail="Rate limit hit — wait 30 seconds and try again")
-        raise HTTPException(status_code=502, detail=f"AI request failed: HTTP {e.code}")
-    except Exception as e:
-        raise HTTPException(status_code=502, detail=f"AI request failed: {e}")
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as fh:
+            fh.write(body)
+        os.replace(tmp, path)
+    except OSError as e:
+        _log("menu_cache").warning(f"write failed: {e}")
+        return
+    with _menu_cache_lock:
+        if _menu_cache_bytes is None:
+            _menu_cache_bytes = 0
+            for root, _dirs, names in os.walk(MENU_CACHE_DIR):
+                for n in names:
+                    try:
+                        _menu_cache_bytes += os.path.getsize(os.path.join(root, n))
+                    except OSError:
+                        pass
+        else:
+            _menu_cache_bytes += len(body)
+        _menu_cache_evict_locked()
 
-    import re as _re, sys as _sys
 
-    raw = result.get("content", [{}])[0].get("text", "").strip()
+async def _menu_chunks(uploads: list) -> list:
+    """Turn (filename, mime, bytes) uploads into pages, one list entry per page.
 
-    def _extract_list(text: str):
-        """Return the first valid JSON list found in text, or None."""
-        # Try direct parse first
-        try:
-            v = _json2.loads(text)
-            if isinstance(v, list):
-                return v
-            # {"sections": [...]} or similar wrapper
-            if isinstance(v, dict):
-                for val in v.values():
-                    if isinstance(val, list):
-                        return val
-        except Exception:
-            pass
-        # Scan for the outermost [...] block
-        for m in _re.finditer(r'\[', text):
-            start = m.start()
-            depth = 0
-            for i, ch in enumerate(text[start:], start):
-                if ch == '[':
-                    depth += 1
-                elif ch == ']':
-                    depth -= 1
-                    if depth == 0:
-                        try:
-                            return _json2.loads(text[start:i + 1])
-                        except Exception:
-                            break
-        # Scan for the outermost {...} block
-        for m in _re.finditer(r'\{', text):
-            start = m.start()
-            depth = 0
-            for i, ch in enumerate(text[start:], start):
-                if ch == '{':
-                    depth += 1
-                elif ch == '}':
-                    depth -= 1
-                    if depth == 0:
-                        try:
-                            v = _json2.loads(text[start:i + 1])
-                            if isinstance(v, dict):
-                                for val in v.values():
-                                    if isinstance(val, list):
-                                        return val
-                        except Exception:
-                            break
-        return None
+    Each page is a dict with its cache "key" plus either the cached "sections"
+    or the Claude content "block" to send. Cache reads and writes touch the disk
+    (and may walk the whole cache to evict), so they run in a thread, never on
+    the event loop.
+    """
+    import asyncio, base64
+    loop = asyncio.get_running_loop()
+
+    def _page(payload: bytes, block: dict) -> dict:
+        key    = _menu_page_key(payload)
+        cached = _menu_cache_get("pages", key)
+        if cached is not None:
+            return {"key": key, "sections": cached}
+        return {"key": key, "block": block}
+
+    async def _one(fname: str, mime: str, data: bytes) -> list:
+        file_key = hashlib.sha256(data).hexdigest()
+        known    = await asyncio.to_thread(_menu_cache_get, "files", file_key)
+        if known is not None:
+            hits = await asyncio.to_thread(lambda: [_menu_cache_get("pages", k) for k in known])
+            if all(h is not None for h in hits):
+                return [{"key": k, "sections": h} for k, h in zip(known, hits)]
+
+        ext = fname.rsplit(".", 1)[-1].lower() if "." in fname else ""
+        if mime in _MENU_IMAGE_TYPES or ext in _MENU_IMAGE_EXTS:
+            jpeg = await loop.run_in_executor(_menu_executor(), menu_workers.normalize_image, data)
+            pages = await asyncio.to_thread(lambda: [_page(jpeg, {
+                "type": "image",
+                "source": {"type": "base64", "media_type": "image/jpeg", "data": base64.b64encode(jpeg).decode()},
+            })] if jpeg else [])
+        elif mime == "application/pdf" or ext == "pdf":
+            split, err = await loop.run_in_executor(_menu_executor(), menu_workers.split_pdf, data)
+            if err:
+                _log("menu_parse").warning(f"PDF split failed, sending whole document: {err}")
+            pages = await asyncio.to_thread(lambda: [_page(p, {
+                "type": "document",
+                "source": {"type": "base64", "media_type": "application/pdf", "data": base64.b64encode(p).decode()},
+            }) for p in split])
+        else:
+            text  = data.decode("utf-8", errors="replace").strip()
+            pages = await asyncio.to_thread(
+                lambda: [_page(text.encode(), {"type": "text", "text": f"Menu file content:\n{text}"})] if text else [])
+        if pages:
+            await asyncio.to_thread(_menu_cache_put, "files", file_key, [p["key"] for p in pages])
+        return pages
+
+    per_file = await asyncio.gather(*(_one(*u) for u in uploads))
+    return [page for pages in per_file for page in pages]
 
-    # Strip markdown fences (handles ```json, ```JSON, plain ```, etc.)
-    cleaned = _re.sub(r'^```[a-zA-Z]*\s*\n?', '', raw)
-    cleaned = _re.sub(r'\n?```\s*$', '', cleaned).strip()
 
-    parsed = _extract_list(cleaned)
-    if parsed is None:
-        # Last resort: try the raw (un-stripped) text
-        parsed = _extract_list(raw)
+class _MenuSectionStream:
+    """Single-pass incremental extractor for the section array in a model reply.
 
-    if not isinstance(parsed, list):
-        print(f"[menu_parse] extraction failed. Raw (first 600): {raw[:600]}", file=_sys.stderr)
-        raise HTTPException(status_code=502, detail="AI returned invalid JSON")
+    feed() takes text as it streams in and returns each section object the
+    moment its closing brace arrives; nothing is re-scanned or re-parsed. The
+    section array may be top-level or wrapped ({"sections": [...]}), and any
+    prose or markdown fences around it are skipped. close() salvages a section
+    cut off by max_tokens, keeping the items that had already closed.
+    """
+
+    def __init__(self):
+        self._stack: list = []    # open containers, "[" or "{"
+        self._in_str   = False
+        self._esc      = False
+        self._level    = None     # stack depth at which section objects open
+        self._cur      = None     # chars of the section being read
+        self._item_end = 0        # len(self._cur) just after its last complete item
+        self.saw_array = False    # a candidate section array opened (an empty page is "[]")
+        self.truncated = False
+
+    def feed(self, text: str) -> list:
+        out = []
+        stack, cur = self._stack, self._cur
+        for ch in text:
+            if cur is not None:
+                cur.append(ch)
+            if self._in_str:
+                if self._esc:
+                    self._esc = False
+                elif ch == "\\":
+                    self._esc = True
+                elif ch == '"':
+                    self._in_str = False
+                continue
+            if ch == '"':
+                self._in_str = bool(stack)   # quotes in surrounding prose don't count
+            elif ch == "[" or ch == "{":
+                depth = len(stack)
+                if ch == "{" and cur is None and stack and stack[-1] == "[" and (
+                    depth == self._level
+                    or (self._level is None and (depth == 1 or (depth == 2 and stack[0] == "{")))
+                ):
+                    self._level    = depth
+                    cur            = self._cur = ["{"]
+                    self._item_end = 0
+                if ch == "[" and (depth == 0 or (depth == 1 and stack[0] == "{")):
+                    self.saw_array = True
+                stack.append(ch)
+            elif ch == "]" or ch == "}":
+                if not stack:
+                    continue
+                stack.pop()
+                if cur is None or ch != "}":
+                    continue
+                if len(stack) == self._level:
+                    section = self._load("".join(cur))
+                    if section is not None:
+                        out.append(section)
+                    cur = self._cur = None
+                elif len(stack) == self._level + 2:
+                    self._item_end = len(cur)
+        return out
+
+    def close(self) -> list:
+        """End of stream: return the unterminated section trimmed to its complete items, if any."""
+        if self._cur is None:
+            return []
+        self.truncated = True
+        partial, self._cur = self._cur, None
+        if not self._item_end:
+            return []
+        section = self._load("".join(partial[:self._item_end]) + "]}")
+        return [section] if section is not None and section.get("items") else []
+
+    @staticmethod
+    def _load(text: str):
+        try:
+            v = _json.loads(text)
+        except ValueError:
+            return None
+        return v if isinstance(v, dict) else None
 
-    _PLACEHOLDER_DESCS = {"none", "n/a", "na", "-", "—", "null", "undefined", "no description", "not available", ""}
 
-    def _clean_desc(v) -> str:
-        s = str(v).strip() if v is not None else ""
-        return "" if s.lower() in _PLACEHOLDER_DESCS else s
+async def _menu_parse_chunk(client, block: dict, on_section=None) -> tuple:
+    """One streamed model call for one page. Sections are handed to on_section as they close.
 
-    sections = [
-        {
-            "id": str(_uuid.uuid4()),
-            "title": str(s.get("title", "Section")),
-            "items": [
-                {
+    Returns (sections, complete). complete is False when the reply was cut off or came
+    back empty — a stray "[" in prose looks the same as a blank page — and such a result
+    is used for this job but not cached. Raises on transport errors, or when the reply
+    holds no section array at all.
+    """
+    parser   = _MenuSectionStream()
+    sections: list = []
+    head     = ""
+    with _ExternalCall("ai", "menu_parse"):
+        async with client.messages.stream(
+            model=_MENU_MODEL,
+            max_tokens=8192,
+            messages=[{"role": "user", "content": [block, {"type": "text", "text": _MENU_PAGE_PROMPT}]}],
+        ) as stream:
+            async for text in stream.text_stream:
+                if len(head) < 600:
+                    head += text
+                for s in parser.feed(text):
+                    sections.append(s)
+                    if on_section:
+                        on_section(s)
+    sections.extend(parser.close())
+    if parser.truncated:
+        _log("menu_parse").warning(f"reply cut off — kept {len(sections)} complete sections")
+    if not sections and not parser.saw_array:
+        _log("menu_parse").warning(f"extraction failed. Raw (first 600): {head[:600]}")
+        raise ValueError("AI returned invalid JSON")
+    return sections, bool(sections) and not parser.truncated
+
+
+def _clean_desc(v) -> str:
+    s = str(v).strip() if v is not None else ""
+    return "" if s.lower() in _PLACEHOLDER_DESCS else s
+
+
+def _menu_merge_sections(pages: list) -> list:
+    """Merge per-page section lists in page order.
+
+    Sections with the same title (case/whitespace-insensitive) are combined —
+    a section that runs across a page break comes back from two calls — and
+    an item repeated with the same name and price is kept once.
+    """
+    merged: dict = {}
+    for page in pages:
+        for s in page or []:
+            title = str(s.get("title") or "Section").strip() or "Section"
+            key   = " ".join(title.lower().split())
+            sec   = merged.get(key)
+            if sec is None:
+                sec = merged[key] = {"id": str(_uuid.uuid4()), "title": title, "items": [], "_seen": set()}
+            for i in (s.get("items") or []):
+                if not isinstance(i, dict):
+                    continue
+                name  = str(i.get("name", "Item"))
+                price = str(i.get("price", ""))
+                ikey  = (" ".join(name.lower().split()), price.strip())
+                if ikey in sec["_seen"]:
+                    continue
+                sec["_seen"].add(ikey)
+                sec["items"].append({
                     "id": str(_uuid.uuid4()),
-                    "name": str(i.get("name", "Item")),
+                    "name": name,
                     "description": _clean_desc(i.get("description")),
-                    "price": str(i.get("price", "")),
+                    "price": price,
                     "tags": [str(t) for t in i.get("tags", [])] if isinstance(i.get("tags"), list) else [],
-                }
-                for i in (s.get("items") or [])
-            ],
+                })
+    for sec in merged.values():
+        del sec["_seen"]
+    return list(merged.values())
+
+
+def _menu_job_share(job: dict):
+    """With STATE_BACKEND=redis, copy the job's view to rb:menu_job:<id> so a poll that
+    lands on another worker or replica still finds it. Call with _menu_jobs_lock held;
+    the write itself happens off the event loop."""
+    global _menu_share_pool
+    if STATE_BACKEND != "redis":
+        return
+    if _menu_share_pool is None:
+        from concurrent.futures import ThreadPoolExecutor
+        _menu_share_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="menu-share")
+    view = _json.dumps(_menu_job_view(job), default=str)
+
+    def _write():
+        try:
+            _state_redis_client().set(f"rb:menu_job:{job['job_id']}", view, ex=MENU_JOB_TTL_SEC)
+        except Exception as e:
+            _log("menu_parse").warning(f"job {job['job_id']} not shared: {e}")
+    _menu_share_pool.submit(_write)
+
+
+def _menu_job_update(job_id: str, **fields):
+    with _menu_jobs_lock:
+        job = _menu_jobs.get(job_id)
+        if job is not None:
+            job.update(fields)
+            job["updated_at"] = _now()
+            _menu_job_share(job)
+
+
+def _menu_prune_jobs():
+    cutoff = time.time() - MENU_JOB_TTL_SEC
+    with _menu_jobs_lock:
+        for jid in [j for j, job in _menu_jobs.items() if job["_created"] < cutoff and job["status"] in ("done", "failed")]:
+            del _menu_jobs[jid]
+
+
+async def _menu_run_job(job_id: str, uploads: list):
+    """Split → parse pages concurrently → merge. Progress is written to _menu_jobs as pages finish."""
+    import asyncio, anthropic
+    try:
+        _menu_job_update(job_id, status="splitting")
+        chunks = await _menu_chunks(uploads)
+        if not chunks:
+            _menu_job_update(job_id, status="failed", error="No readable content in uploaded files", error_code=400)
+            return
+        pages: list = [c.get("sections") for c in chunks]
+        todo   = [i for i, c in enumerate(chunks) if pages[i] is None]
+        cached = len(chunks) - len(todo)
+        _menu_job_update(job_id, status="parsing", pages_total=len(chunks), pages_done=cached, pages_cached=cached)
+
+        client = anthropic.AsyncAnthropic(api_key=ANTHROPIC_KEY, timeout=MENU_PARSE_TIMEOUT_SEC) if todo else None
+        sem    = asyncio.Semaphore(MENU_PARSE_CONCURRENCY)
+        failed: list = []
+        rate_limited = False
+
+        def _found(_section: dict):
+            with _menu_jobs_lock:
+                job = _menu_jobs.get(job_id)
+                if job is not None:
+                    job["sections_found"] += 1
+
+        async def _page(idx: int):
+            nonlocal rate_limited
+            async with sem:
+                try:
+                    pages[idx], complete = await _menu_parse_chunk(client, chunks[idx]["block"], on_section=_found)
+                    if complete:
+                        await asyncio.to_thread(_menu_cache_put, "pages", chunks[idx]["key"], pages[idx])
+                except anthropic.RateLimitError:
+                    rate_limited = True
+                    failed.append(idx + 1)
+                except Exception as e:
+                    _log("menu_parse").warning(f"page {idx + 1}/{len(chunks)} failed: {e}")
+                    failed.append(idx + 1)
+            with _menu_jobs_lock:
+                job = _menu_jobs.get(job_id)
+                if job is not None:
+                    job["pages_done"] += 1
+                    job["pages_failed"] = sorted(failed)
+                    job["updated_at"] = _now()
+                    _menu_job_share(job)
+
+        if todo:
+            try:
+                await asyncio.gather(*(_page(i) for i in todo))
+            finally:
+                await client.close()
+
+        if len(failed) == len(chunks):
+            if rate_limited:
+                _menu_job_update(job_id, status="failed", error="Rate limit hit — wait 30 seconds and try again", error_code=429)
+            else:
+                _menu_job_update(job_id, status="failed", error="AI request failed", error_code=502)
+            return
+        _menu_job_update(job_id, status="done", sections=_menu_merge_sections(pages))
+    except Exception as e:
+        _log("menu_parse").error(f"job {job_id} crashed: {e}")
+        _menu_job_update(job_id, status="failed", error=f"AI request failed: {e}", error_code=502)
+
+
+async def _menu_start_job(file: List[UploadFile]) -> str:
+    """Read the uploads (they close with the request) and schedule the pipeline on the event loop."""
+    import asyncio
+    if not ANTHROPIC_KEY:
+        raise HTTPException(status_code=500, detail="Missing Anthropic API key")
+    uploads = []
+    for f in file:
+        mime = (f.content_type or "application/octet-stream").split(";")[0].strip()
+        uploads.append((f.filename or "", mime, await f.read()))
+
+    _menu_prune_jobs()
+    job_id = str(_uuid.uuid4())
+    with _menu_jobs_lock:
+        _menu_jobs[job_id] = {
+            "job_id":         job_id,
+            "status":         "queued",   # queued | splitting | parsing | done | failed
+            "files":          len(uploads),
+            "pages_total":    0,
+            "pages_done":     0,
+            "pages_cached":   0,
+            "pages_failed":   [],
+            "sections_found": 0,
+            "sections":       None,
+            "error":          None,
+            "error_code":     None,
+            "created_at":     _now(),
+            "updated_at":     _now(),
+            "_created":       time.time(),
         }
-        for s in parsed
-    ]
-    return {"sections": sections}
+        _menu_jobs[job_id]["_task"] = asyncio.create_task(_menu_run_job(job_id, uploads))
+        _menu_job_share(_menu_jobs[job_id])
+    return job_id
+
+
+def _menu_job_view(job: dict) -> dict:
+    return {k: v for k, v in job.items() if not k.startswith("_")}
+
+
+# ── Client agreement signing ──────────────────────────────────────────────────
+
+class AgreementAcceptRequest(BaseModel):
+    business_name:      str
+    signer_name:        str
+    signer_email:       str
+    signer_title:       Optional[str] = None
+    phone:              Optional[str] = None
+    address:            Optional[str] = None
+    location_count:     int = Field(ge=1, le=50, default=1)
+    plan_type:          str                       # "single" | "multi"
+    monthly_fee:        float                     # dollars
+    agreement_version:  str
+    ip_address:         Optional[str] = None
+    user_agent:         Optional[str] = None
+
+@app.post("/menu/parse")
+async def menu_parse(file: List[UploadFile] = File(...)):
+    """Parse one or more menu images/documents with Claude and return structured sections.
+
+    Waits for the whole pipeline. Large menus should use POST /menu/parse/jobs and poll.
+    """
+    job_id = await _menu_start_job(file)
+    with _menu_jobs_lock:
+        task = _menu_jobs[job_id]["_task"]
+    await task
+    with _menu_jobs_lock:
+        job = _menu_jobs.pop(job_id)
+    if job["status"] != "done":
+        raise HTTPException(status_code=job["error_code"] or 502, detail=job["error"] or "AI request failed")
+    return {"sections": job["sections"], "pages_failed": job["pages_failed"]}
+
+
+@app.post("/menu/parse/jobs")
+async def menu_parse_job(file: List[UploadFile] = File(...)):
+    """Start a menu parse in the background. Poll GET /menu/parse/jobs/{job_id} for progress."""
+    job_id = await _menu_start_job(file)
+    with _menu_jobs_lock:
+        return _menu_job_view(_menu_jobs[job_id])
+
+
+@app.get("/menu/parse/jobs/{job_id}")
+def menu_parse_job_status(job_id: str):
+    """Progress for a menu parse job: pages_done / pages_total while running, sections once done."""
+    with _menu_jobs_lock:
+        job = _menu_jobs.get(job_id)
+        if job is not None:
+            return _menu_job_view(job)
+    if STATE_BACKEND == "redis":
+        # Started by another worker or replica
+        try:
+            shared = _state_redis_client().get(f"rb:menu_job:{job_id}")
+        except Exception as e:
+            raise HTTPException(status_code=503, detail=f"Job store unavailable: {e}")
+        if shared:
+            return _json.loads(shared)
+    raise HTTPException(status_code=404, detail="Job not found or expired")
 
 
 @app.post("/agreements/accept")
@@ -753,17 +2205,14 @@ def accept_agreement(req: AgreementAcceptRequest):
             "status":            "trial",
         }).execute()
     except Exception as e:
-        print(f"[agreements/accept] DB insert failed: {e}")
+        _log("agreements.accept").warning(f"DB insert failed: {e}")
         raise HTTPException(status_code=500, detail="Failed to record agreement. Please contact support.")
 
     record_id = result.data[0]["id"] if result.data else None
-    print(
-        f"[agreements/accept] NEW CLIENT SIGNED — "
-        f"business={req.business_name!r} signer={req.signer_name!r} "
-        f"email={req.signer_email!r} plan={req.plan_type} "
-        f"locations={req.location_count} fee=${req.monthly_fee}/mo "
-        f"trial_ends={trial_end_date} id={record_id}"
-    )
+    _log("agreements.accept").info("NEW CLIENT SIGNED", extra={"fields": {
+        "business": req.business_name, "plan": req.plan_type, "locations": req.location_count,
+        "monthly_fee": req.monthly_fee, "trial_ends": trial_end_date, "agreement_id": record_id,
+    }})
 
     return {
         "ok":             True,
@@ -802,7 +2251,7 @@ def agreements_status(business_name: Optional[str] = None):
             }
         return {"signed": False}
     except Exception as e:
-        print(f"[agreements/status] DB query failed: {e}")
+        _log("agreements.status").warning(f"DB query failed: {e}")
         raise HTTPException(status_code=500, detail="Failed to check agreement status.")
 
 
@@ -819,7 +2268,7 @@ def agreements_all(secret: Optional[str] = None):
         )
         return {"agreements": result.data or []}
     except Exception as e:
-        print(f"[agreements/all] DB query failed: {e}")
+        _log("agreements.all").warning(f"DB query failed: {e}")
         raise HTTPException(status_code=500, detail="Failed to retrieve agreements.")
 
 
@@ -848,17 +2297,23 @@ class JoinQueueRequest(BaseModel):
     section_preference: Optional[str] = None   # e.g. "Outside", "Bar"; null = anywhere
 
 class CameraEventRequest(BaseModel):
-    zone:         str
-    people_count: int
+    zone:          str
+    people_count:  int
+    ts:            Optional[str] = None  # ISO time the reading was taken (defaults to receipt time)
+    restaurant_id: Optional[str] = None  # override env RESTAURANT_ID
 
 class DeliveryEventRequest(BaseModel):
-    provider:     str
+    provider:      str
     active_orders: int
+    ts:            Optional[str] = None
+    restaurant_id: Optional[str] = None  # override env RESTAURANT_ID
 
 class ThroughputEventRequest(BaseModel):
-    metric:   str
-    value:    float
-    metadata: Optional[dict] = None
+    metric:        str
+    value:         float
+    metadata:      Optional[dict] = None
+    ts:            Optional[str] = None
+    restaurant_id: Optional[str] = None  # override env RESTAURANT_ID
 
 class ReservationRequest(BaseModel):
     guest_name:    str
@@ -901,7 +2356,8 @@ class SettingsRequest(BaseModel):
     opentable_ical_url: Optional[str] = None
 
 class SyncIcalRequest(BaseModel):
-    url: str
+    url:           str
+    restaurant_id: Optional[str] = None   # override env RESTAURANT_ID
 
 # ── Helpers ──────────────────────────────────────────────────────────────────
 
@@ -941,33 +2397,39 @@ def _send_sms(to_phone: str, body: str) -> tuple[bool, str]:
                 "key": TEXTBELT_KEY,
             }).encode()
             req = urllib.request.Request("https://textbelt.com/text", data=payload, method="POST")
-            with urllib.request.urlopen(req, timeout=10) as resp:
-                result = _json.loads(resp.read())
-            print(f"[Textbelt] result={result}")
+            with _ExternalCall("sms", "textbelt") as call:
+                with urllib.request.urlopen(req, timeout=10) as resp:
+                    result = _json.loads(resp.read())
+                if not result.get("success"):
+                    call.status = "failed"
+            _log("sms.textbelt").debug("result=%s", result)
             if result.get("success"):
                 return True, ""
             tb_err = result.get("error", "unknown")
             errors.append(f"Textbelt: {tb_err}")
-            print(f"[Textbelt] failed: {tb_err}")
+            _log("sms.textbelt").warning(f"failed: {tb_err}")
         except Exception as e:
             errors.append(f"Textbelt: {e}")
-            print(f"[Textbelt] exception: {e}")
+            _log("sms.textbelt").error(f"exception: {e}")
 
     # ── Twilio (fallback — requires A2P 10DLC or toll-free registration) ──────
     if TWILIO_SID and TWILIO_TOKEN and TWILIO_FROM:
         try:
             from twilio.rest import Client
             client = Client(TWILIO_SID, TWILIO_TOKEN)
-            msg = client.messages.create(body=body, from_=TWILIO_FROM, to=normalized)
-            print(f"[Twilio] queued sid={msg.sid} status={msg.status} error={msg.error_code!r}")
+            with _ExternalCall("sms", "twilio") as call:
+                msg = client.messages.create(body=body, from_=TWILIO_FROM, to=normalized)
+                if msg.status in ("failed", "undelivered"):
+                    call.status = "failed"
+            _log("sms.twilio").debug("queued sid=%s status=%s error=%r", msg.sid, msg.status, msg.error_code)
             if msg.status not in ("failed", "undelivered"):
                 return True, ""
             tw_err = msg.error_message or f"status={msg.status} code={msg.error_code}"
             errors.append(f"Twilio: {tw_err}")
-            print(f"[Twilio] delivery failed: {tw_err}")
+            _log("sms.twilio").warning(f"delivery failed: {tw_err}")
         except Exception as e:
             errors.append(f"Twilio: {e}")
-            print(f"[Twilio] exception: {e}")
+            _log("sms.twilio").error(f"exception: {e}")
     else:
         errors.append("Twilio: not configured")
 
@@ -978,31 +2440,57 @@ def _rid(req_id: Optional[str] = None) -> str:
     return req_id or RESTAURANT_ID
 
 def _active_queue(rid: Optional[str] = None) -> list:
-    return (
-        supabase.table("queue_entries")
-        .select("*")
-        .eq("restaurant_id", _rid(rid))
-        .in_("status", ["waiting", "ready"])
-        .order("created_at")
-        .execute()
-        .data
-    )
-
-def _wait_estimate_with(parties_ahead: int, party_size: int, tables: list) -> int:
+    rid = _rid(rid)
+    def fetch():
+        return (
+            supabase.table("queue_entries")
+            .select("*")
+            .eq("restaurant_id", rid)
+            .in_("status", ["waiting", "ready"])
+            .order("created_at")
+            .execute()
+            .data
+        )
+    return _wb_read(rid, "queue", fetch) if WRITE_BEHIND else fetch()
+
+def _wait_estimate_with(parties_ahead: int, party_size: int, tables: list,
+                        held: Optional[set] = None, signals: Optional[dict] = None) -> int:
+    """held: table numbers the reservation planner is keeping free — not counted as open.
+    signals: _live_signals() readings. People at the door beyond what the list accounts for
+    count as (up to 3) extra parties ahead, the dining camera corrects stale table statuses
+    (see _dining_adjust), and a heavy delivery load adds 5 min."""
     try:
-        available   = [t for t in tables if t["status"] == "available"]
+        held        = held or set()
+        signals     = signals or {}
+        lobby       = signals.get("lobby_people")
+        if lobby is not None:
+            unlisted = lobby - parties_ahead * _PEOPLE_PER_PARTY
+            if unlisted >= _PEOPLE_PER_PARTY:
+                parties_ahead += min(3, round(unlisted / _PEOPLE_PER_PARTY))
+        available   = [t for t in tables if t["status"] == "available"
+                       and not (held and int(t.get("table_number") or 0) in held)]
+        hidden, pace = _dining_adjust(tables, available, signals.get("dining_people"))
+        if hidden:   # camera sees those "available" tables sat — drop the largest first
+            available = sorted(available, key=lambda t: t["capacity"])[:len(available) - hidden]
         if parties_ahead == 0 and available:
             return 0
         seats_avail = sum(t["capacity"] for t in available)
         if seats_avail >= party_size * max(1, parties_ahead):
-            return max(5, parties_ahead * 10)
-        return max(15, parties_ahead * 20)
+            est = max(5, parties_ahead * 10)
+        else:
+            est = max(15, parties_ahead * 20)
+        est = max(5, round(est * pace))
+        if (signals.get("delivery_orders") or 0) >= DELIVERY_BUSY_ORDERS:
+            est += 5
+        return est
     except Exception:
         return max(5, parties_ahead * 20)
 
 def _wait_estimate(parties_ahead: int, party_size: int = 2, rid: Optional[str] = None) -> int:
-    tables = supabase.table("tables").select("status,capacity").eq("restaurant_id", _rid(rid)).execute().data
-    return _wait_estimate_with(parties_ahead, party_size, tables)
+    tables = supabase.table("tables").select("table_number,status,capacity").eq("restaurant_id", _rid(rid)).execute().data
+    return _wait_estimate_with(parties_ahead, party_size, tables,
+                               _planner_held(_planner_plan_safe(_rid(rid), tables), party_size),
+                               _live_signals(_rid(rid)))
 
 def _set_quoted_wait(entry_id: str, minutes: int, now: str) -> None:
     """
@@ -1021,22 +2509,27 @@ def _set_quoted_wait(entry_id: str, minutes: int, now: str) -> None:
             "quoted_wait": minutes,
         }).eq("id", entry_id).execute()
 
-def _remaining_wait(entry: dict) -> int:
+def _remaining_wait(entry: dict, waits: Optional[dict] = None) -> int:
     """
     Return quoted_wait minus elapsed time since it was set, clamped to 0.
     Falls back to position-based estimate if no quoted_wait has been set.
 
     The set-time is read from:
       1. entry["quoted_wait_set_at"]  — DB column (survives server restarts)
-      2. _wait_set_at[entry_id]        — in-memory fallback (lost on restart)
+      2. the restaurant's wait_set_at   — in-memory fallback (lost on restart)
     If neither is available the raw quoted_wait is returned unchanged (safe default).
+    Loops over a whole queue pass waits=_rstate(rid).wait_snapshot() so the fallback
+    is one read per request instead of one per party.
     """
     qw = entry.get("quoted_wait")
     if qw is None:
         return entry.get("wait_estimate") or 0
 
     # Prefer DB-persisted timestamp so accuracy survives server restarts
-    set_at_str = entry.get("quoted_wait_set_at") or _wait_set_at.get(entry.get("id"))
+    set_at_str = entry.get("quoted_wait_set_at")
+    if not set_at_str:
+        set_at_str = (waits.get(entry.get("id")) if waits is not None
+                      else _rstate(entry.get("restaurant_id")).wait_get(entry.get("id")))
     if set_at_str:
         try:
             set_dt = datetime.fromisoformat(set_at_str.replace("Z", ""))
@@ -1048,34 +2541,276 @@ def _remaining_wait(entry: dict) -> int:
     # Fallback: no timestamp available — return raw quoted_wait
     return qw
 
-def _ai_insights(tables: list, queue: list) -> Optional[str]:
-    if not ANTHROPIC_KEY:
-        return None
-    try:
-        import anthropic
-        client    = anthropic.Anthropic(api_key=ANTHROPIC_KEY)
-        available = sum(1 for t in tables if t["status"] == "available")
-        occupied  = len(tables) - available
-        waiting   = len([q for q in queue if q["status"] == "waiting"])
-        avg_size  = round(sum(q["party_size"] for q in queue) / len(queue), 1) if queue else 0
-        msg = client.messages.create(
-            model="claude-haiku-4-5-20251001",
-            max_tokens=300,
-            messages=[{
-                "role": "user",
-                "content": (
-                    f"Restaurant host assistant. Snapshot:\n"
-                    f"- Tables: {available}/{len(tables)} available, {occupied} occupied\n"
-                    f"- Queue: {waiting} waiting, avg party {avg_size}\n"
-                    f"- Est. wait: {_wait_estimate(waiting)} min\n\n"
-                    "Give 2 short actionable insights for the host. "
-                    "Each on its own line, max 20 words each. No bullets or numbers."
-                )
-            }]
-        )
-        return msg.content[0].text.strip()
-    except Exception:
+# ── Rules insights engine ─────────────────────────────────────────────────────
+# Deterministic insights computed from live floor state plus today's quote
+# accuracy. Pure in-memory arithmetic, so /insights always has something useful
+# even with no Anthropic key, and the same features give the model far more to
+# work with than four headline numbers.
+INSIGHTS_AI_ENABLED = os.environ.get("INSIGHTS_AI_ENABLED", "1") != "0"
+
+# Named table-number ranges per restaurant for zone-level findings ("patio idle").
+_INSIGHT_ZONES: dict = {
+    _WALNUT_SOUTHSIDE_ID: (("Patio", 35, 55),),
+}
+
+_quote_stats: dict = {}   # { rid: {"day", "n", "sum_err", "seen": set(entry_id), "seeded": bool} }
+_quote_stats_lock  = threading.Lock()
+
+
+def _business_day_start(now: Optional[datetime] = None) -> datetime:
+    """Start of the current business day (3am UTC rollover)."""
+    from datetime import timedelta
+    now = now or datetime.now(timezone.utc)
+    start = now.replace(hour=3, minute=0, second=0, microsecond=0)
+    return start - timedelta(days=1) if now.hour < 3 else start
+
+
+def _quote_bucket(rid: str) -> dict:
+    """Caller holds _quote_stats_lock. Resets the bucket when the business day rolls over."""
+    day = _business_day_start().date().isoformat()
+    st  = _quote_stats.get(rid)
+    if st is None or st["day"] != day:
+        st = _quote_stats[rid] = {"day": day, "n": 0, "sum_err": 0.0, "seen": set(), "seeded": False}
+    return st
+
+
+def _quote_record(rid: str, entry_id: str, quoted: Any, actual_min: Optional[float]):
+    if quoted is None or actual_min is None:
+        return
+    with _quote_stats_lock:
+        st = _quote_bucket(rid)
+        if entry_id in st["seen"]:
+            return
+        st["seen"].add(entry_id)
+        st["n"]       += 1
+        st["sum_err"] += actual_min - float(quoted)
+
+
+def _insights_note_seated(rid: str, entry: dict):
+    """Called at seating time with the queue entry: folds actual vs quoted wait into today's stats."""
+    try:
+        arrived = datetime.fromisoformat(str(entry["arrival_time"]).replace("Z", "+00:00"))
+        if arrived.tzinfo is None:
+            arrived = arrived.replace(tzinfo=timezone.utc)
+        actual = (datetime.now(timezone.utc) - arrived).total_seconds() / 60
+        _quote_record(rid, entry.get("id"), entry.get("quoted_wait"), actual)
+    except Exception:
+        pass
+
+
+def _quote_seed(rid: str):
+    """Backfill today's quote stats from the guest log once per day (server restarts mid-service)."""
+    try:
+        for e in get_queue_history(rid):
+            if e.get("status") == "seated":
+                _quote_record(rid, e["id"], e.get("quoted_wait"), e.get("actual_wait_min"))
+    except Exception as ex:
+        _log("insights").warning(f"quote stats seed failed: {ex}")
+
+
+def _quote_summary(rid: str) -> Optional[dict]:
+    with _quote_stats_lock:
+        st = _quote_bucket(rid)
+        if not st["seeded"]:
+            st["seeded"] = True
+            threading.Thread(target=_quote_seed, args=(rid,), daemon=True).start()
+        if not st["n"]:
+            return None
+        return {"parties": st["n"], "avg_over_min": round(st["sum_err"] / st["n"], 1)}
+
+
+def _insight_features(rid: str, tables: list, queue: list, held: set, wait_estimate: int) -> dict:
+    """Everything the rules (and the model prompt) look at, computed in one pass over live state."""
+    waiting  = [q for q in queue if q["status"] == "waiting"]
+    waits    = _rstate(rid).wait_snapshot() if any(not q.get("quoted_wait_set_at") for q in waiting) else {}
+    by_cap: dict = {}
+    for t in tables:
+        c = by_cap.setdefault(int(t.get("capacity") or 0), {"total": 0, "open": 0, "demand": 0})
+        c["total"] += 1
+        if t["status"] == "available" and int(t.get("table_number") or 0) not in held:
+            c["open"] += 1
+    caps = sorted(by_cap)
+    unseatable = 0
+    for q in waiting:
+        size = int(q.get("party_size") or 2)
+        fit  = next((c for c in caps if c >= size), None)
+        if fit is None:
+            unseatable += 1
+        else:
+            by_cap[fit]["demand"] += 1
+
+    zones = []
+    for name, lo, hi in _INSIGHT_ZONES.get(rid, ()):
+        in_zone = [t for t in tables if lo <= int(t.get("table_number") or 0) <= hi]
+        if in_zone:
+            zones.append({"name": name, "total": len(in_zone),
+                          "occupied": sum(1 for t in in_zone if t["status"] != "available")})
+
+    available = sum(1 for t in tables if t["status"] == "available")
+    return {
+        "tables":       len(tables),
+        "available":    available,
+        "occupied":     len(tables) - available,
+        "held":         len(held),
+        "waiting":      len(waiting),
+        "ready":        len(queue) - len(waiting),
+        "avg_size":     round(sum(q["party_size"] for q in queue) / len(queue), 1) if queue else 0,
+        "wait":         wait_estimate,
+        "overdue":      sum(1 for q in waiting if q.get("quoted_wait") is not None and _remaining_wait(q, waits) == 0),
+        "by_capacity":  {c: by_cap[c] for c in caps},
+        "unseatable":   unseatable,
+        "zones":        zones,
+        "quotes":       _quote_summary(rid),
+        "walkaways":    _walkaway_check(rid, len(waiting)),
+    }
+
+
+def _rule_insights(f: dict) -> list:
+    """Ordered host-facing findings from _insight_features; most urgent first, at most three."""
+    out = []
+    by_cap = f["by_capacity"]
+
+    # Bottleneck: the size class with the most unmet demand while other classes sit open
+    short = [(v["demand"] - v["open"], c) for c, v in by_cap.items() if v["demand"] > v["open"]]
+    if short:
+        gap, cap = max(short)
+        spare = sum(v["open"] for c, v in by_cap.items() if c != cap)
+        msg = f"{cap}-tops are the bottleneck: {by_cap[cap]['demand']} waiting parties need one, {by_cap[cap]['open']} open."
+        if spare >= 2:
+            msg += f" {spare} other tables are free — consider combining."
+        out.append(msg)
+
+    w = f["walkaways"]
+    if w:
+        out.append(f"Lobby down {w['lobby_drop']:.0f} people in {w['window_min']} min but the list hasn't moved — "
+                   f"~{w['parties']} {'party' if w['parties'] == 1 else 'parties'} may have walked; call the next names.")
+
+    if f["overdue"]:
+        n = f["overdue"]
+        out.append(f"{n} {'party is' if n == 1 else 'parties are'} past their quoted time — check in before they walk.")
+
+    q = f["quotes"]
+    if q and q["parties"] >= 3 and abs(q["avg_over_min"]) >= 5:
+        if q["avg_over_min"] > 0:
+            out.append(f"Quotes running {q['avg_over_min']:.0f} min long today ({q['parties']} seated) — pad new quotes.")
+        else:
+            out.append(f"Quotes running {-q['avg_over_min']:.0f} min short today ({q['parties']} seated) — you can quote tighter.")
+
+    for z in f["zones"]:
+        rest_open = f["tables"] - z["total"] - f["occupied"]   # zone is empty, so every seated table is elsewhere
+        if z["occupied"] == 0 and (f["waiting"] or rest_open <= 2):
+            out.append(f"{z['name']} idle (0/{z['total']} seated)" + (f" while {f['waiting']} wait." if f["waiting"] else "."))
+
+    if f["unseatable"]:
+        out.append(f"{f['unseatable']} waiting {'party is' if f['unseatable'] == 1 else 'parties are'} larger than any single table — plan a push-together.")
+
+    if f["ready"] >= 2:
+        out.append(f"{f['ready']} notified parties not yet seated — clear their tables first.")
+
+    if not out and f["tables"]:
+        util = round(f["occupied"] / f["tables"] * 100)
+        if f["waiting"] == 0 and util < 50:
+            out.append(f"Floor {util}% full with no wait — good time to reset tables and sections.")
+        elif f["waiting"]:
+            out.append(f"{f['waiting']} waiting, floor {util}% full — quoting ~{f['wait']} min is on track.")
+    return out[:3]
+
+
+# ── AI insights service ───────────────────────────────────────────────────────
+# Dashboards poll /insights every few seconds, but the model only needs to run
+# when the floor has actually changed. Each restaurant keeps its last good
+# insight; a new one is generated in the background once the waiting count or
+# occupied tables move by INSIGHTS_MIN_DELTA, or the text is older than
+# INSIGHTS_TTL_SEC. Regeneration is debounced to one per INSIGHTS_DEBOUNCE_SEC
+# and never blocks the request — callers always get the cached text.
+INSIGHTS_TTL_SEC      = int(os.environ.get("INSIGHTS_TTL_SEC", "600"))
+INSIGHTS_DEBOUNCE_SEC = int(os.environ.get("INSIGHTS_DEBOUNCE_SEC", "60"))
+INSIGHTS_MIN_DELTA    = int(os.environ.get("INSIGHTS_MIN_DELTA", "2"))
+
+_insights_state: dict = {}   # { rid: {"text", "snapshot", "generated_at", "attempted_at", "pending"} }
+_insights_lock        = threading.Lock()
+_anthropic_client     = None
+
+
+def _anthropic():
+    """Shared sync Anthropic client — building one per call costs a TLS handshake."""
+    global _anthropic_client
+    if _anthropic_client is None:
+        import anthropic
+        _anthropic_client = anthropic.Anthropic(api_key=ANTHROPIC_KEY)
+    return _anthropic_client
+
+
+def _ai_insights(f: dict, findings: list) -> Optional[str]:
+    if not ANTHROPIC_KEY:
         return None
+    try:
+        caps  = ", ".join(f"{c}-tops {v['open']}/{v['total']} open, {v['demand']} waiting parties fit" for c, v in f["by_capacity"].items())
+        zones = ", ".join(f"{z['name']} {z['occupied']}/{z['total']} seated" for z in f["zones"]) or "n/a"
+        q     = f["quotes"]
+        with _ExternalCall("ai", "insights"):
+            msg = _anthropic().messages.create(
+                model="claude-haiku-4-5-20251001",
+                max_tokens=300,
+                messages=[{
+                    "role": "user",
+                    "content": (
+                        f"Restaurant host assistant. Snapshot:\n"
+                        f"- Tables: {f['available']}/{f['tables']} available, {f['occupied']} occupied, {f['held']} held for reservations\n"
+                        f"- By size: {caps}\n"
+                        f"- Zones: {zones}\n"
+                        f"- Queue: {f['waiting']} waiting, {f['ready']} notified, avg party {f['avg_size']}, "
+                        f"{f['overdue']} past quote, {f['unseatable']} too big for one table\n"
+                        f"- Est. wait: {f['wait']} min\n"
+                        f"- Quote accuracy today: "
+                        + (f"{q['avg_over_min']:+.1f} min vs quoted over {q['parties']} seated parties\n" if q else "no data yet\n")
+                        + "- Rule engine findings: " + (" | ".join(findings) or "none") + "\n\n"
+                        "Give 2 short actionable insights for the host. "
+                        "Each on its own line, max 20 words each. No bullets or numbers."
+                    )
+                }]
+            )
+        return msg.content[0].text.strip()
+    except Exception as e:
+        _log("insights").warning(f"generation failed: {e}")
+        return None
+
+
+def _insights_due(entry: dict, snap: dict, now: float) -> bool:
+    if entry["pending"] or now - entry["attempted_at"] < INSIGHTS_DEBOUNCE_SEC:
+        return False
+    last = entry["snapshot"]
+    if entry["text"] is None or last is None or now - entry["generated_at"] >= INSIGHTS_TTL_SEC:
+        return True
+    return (abs(snap["waiting"] - last["waiting"]) >= INSIGHTS_MIN_DELTA
+            or abs(snap["occupied"] - last["occupied"]) >= INSIGHTS_MIN_DELTA)
+
+
+def _insights_generate(rid: str, snap: dict, findings: list):
+    text = _ai_insights(snap, findings)
+    with _insights_lock:
+        entry = _insights_state[rid]
+        entry["pending"] = False
+        if text:   # keep the last good insight when the model call fails
+            entry.update(text=text, snapshot=snap, generated_at=time.time())
+
+
+def _insights_for(rid: str, snap: dict, findings: list) -> dict:
+    """Cached insight for rid; kicks off a background refresh when the floor has moved enough."""
+    now = time.time()
+    with _insights_lock:
+        entry = _insights_state.setdefault(rid, {
+            "text": None, "snapshot": None, "generated_at": 0.0, "attempted_at": 0.0, "pending": False,
+        })
+        if ANTHROPIC_KEY and INSIGHTS_AI_ENABLED and _insights_due(entry, snap, now):
+            entry["pending"]      = True
+            entry["attempted_at"] = now
+            threading.Thread(target=_insights_generate, args=(rid, snap, findings), daemon=True).start()
+        return {
+            "text":       entry["text"],
+            "updated_at": datetime.fromtimestamp(entry["generated_at"], timezone.utc).isoformat() if entry["text"] else None,
+            "refreshing": entry["pending"],
+        }
 
 # ── Routes ────────────────────────────────────────────────────────────────────
 
@@ -1185,6 +2920,32 @@ def get_restaurant(restaurant_id: Optional[str] = None):
     return {"id": rid, "name": "Restaurant"}
 
 # ── Tables ───────────────────────────────────────────────────────────────────
+# Migration 007 collapses duplicate (restaurant_id, table_number) rows, adds a unique
+# constraint and installs the claim_table / claim_next_table RPCs. Once
+# tables_claim_ready() says so, reads skip the dedup pass and seat/clear go through
+# single-round-trip claims; until then the duplicate-safe paths below stay in charge.
+# A missing migration is re-checked every 10 minutes so applying it needs no restart.
+_tables_claim: dict = {"ready": False, "checked_at": 0.0}
+
+def _tables_unique() -> bool:
+    if _tables_claim["ready"] or time.time() - _tables_claim["checked_at"] < 600:
+        return _tables_claim["ready"]
+    _tables_claim["checked_at"] = time.time()
+    try:
+        _tables_claim["ready"] = bool(supabase.rpc("tables_claim_ready").execute().data)
+    except Exception as e:
+        _log("tables").warning(f"tables_claim_ready unavailable, keeping duplicate-safe paths: {e}")
+    return _tables_claim["ready"]
+
+def _release_table(table_id: str, rid: Optional[str], tnum) -> None:
+    """Undo a claim. Without the unique constraint every sibling row was claimed, so
+    every sibling row is released."""
+    q = supabase.table("tables").update({"status": "available", "updated_at": _now()})
+    if tnum is not None and rid is not None and not _tables_unique():
+        q = q.eq("restaurant_id", rid).eq("table_number", tnum)
+    else:
+        q = q.eq("id", table_id)
+    q.execute()
 
 def _dedup_tables(rows: list) -> list:
     """Deduplicate table rows by table_number, keeping the MOST RECENTLY UPDATED row.
@@ -1194,7 +2955,15 @@ def _dedup_tables(rows: list) -> list:
     ordering — so the "first" row could flip between calls, causing a table to appear
     occupied on one refresh and available on the next. Always keeping the latest
     updated_at row makes this deterministic and ensures that a seat/clear action
-    (which updates exactly one row) is always the row that wins the dedup."""
+    (which updates exactly one row) is always the row that wins the dedup.
+
+    With the unique constraint from migration 007 this only sorts."""
+    if _tables_unique():
+        rows = [t for t in (rows or []) if t.get("table_number") is not None]
+        try:
+            return sorted(rows, key=lambda t: int(t.get("table_number") or 0))
+        except Exception:
+            return rows
     best: dict = {}  # table_number -> row
     for t in (rows or []):
         n = t.get("table_number")
@@ -1220,7 +2989,9 @@ def _cleanup_duplicate_tables():
     the most recently updated one. Runs on startup. Without this, duplicate rows keep
     accumulating and _dedup_tables has to paper over them on every request — and any
     endpoint that reads by row-id (seat-to-table, clear-table) can still hit the stale
-    row and silently mis-update."""
+    row and silently mis-update. Nothing to do once migration 007 is applied."""
+    if _tables_unique():
+        return
     try:
         all_rids = [r for r in [RESTAURANT_ID] + [r["id"] for r in WALNUT_RESTAURANTS] + [DEMO_RESTAURANT_ID] if r]
         for rid in all_rids:
@@ -1247,14 +3018,424 @@ def _cleanup_duplicate_tables():
                         try:
                             supabase.table("tables").delete().in_("id", batch).execute()
                         except Exception as e:
-                            print(f"[cleanup_duplicate_tables] batch delete failed rid={rid}: {e}")
-                    print(f"[startup] Deleted {len(stale_ids)} duplicate table row(s) for rid={rid}")
+                            _log("cleanup_duplicate_tables").warning(f"batch delete failed rid={rid}: {e}")
+                    _log("startup").info(f"Deleted {len(stale_ids)} duplicate table row(s) for rid={rid}")
             except Exception as e:
-                print(f"[cleanup_duplicate_tables] rid={rid} error: {e}")
+                _log("cleanup_duplicate_tables").error(f"rid={rid} error: {e}")
+    except Exception as e:
+        _log("cleanup_duplicate_tables").error(f"outer error: {e}")
+
+_background(_cleanup_duplicate_tables, leader=True)
+
+# ── Write-behind journal ─────────────────────────────────────────────────────
+# WRITE_BEHIND=1 keeps the host stand working when Supabase is slow or unreachable.
+# join_queue, seat_to_table and clear_table then apply to this process (occupants,
+# quote timers) and are acknowledged right away. The mutation itself is appended to a
+# durable journal: a SQLite file at WRITE_BEHIND_PATH, kept by the local engine. Every
+# process runs the replay loop, and whichever holds an flock on WRITE_BEHIND_PATH.lock
+# drains that file to Supabase in order — so each replica drains its own journal, and
+# workers sharing one file take turns.
+#
+# Replay is idempotent:
+#   - every row a mutation creates has an id derived from the journal key
+#   - a seat remembers which of its steps (seating event, entry, table) already landed
+#   - a clear is skipped when the table was re-seated after it
+# A journal entry that loses to another station's write is marked "conflict" and
+# listed on GET /write-behind instead of being forced through; a seat that conflicts
+# is backed out and its party goes back to waiting.
+#
+# Station reads (_active_queue, _floor_tables) fall back to the last copy they got
+# when Supabase can't be reached. Pending journal entries for that restaurant are
+# overlaid on the result, so a party joined or seated offline shows on every poll.
+# Point WRITE_BEHIND_PATH at a volume so the journal survives a redeploy.
+WRITE_BEHIND           = os.environ.get("WRITE_BEHIND", "0") == "1" and STORAGE_BACKEND == "supabase"
+WRITE_BEHIND_PATH      = os.environ.get("WRITE_BEHIND_PATH", os.path.join("/tmp", "restaurant-brain-journal.sqlite3"))
+WRITE_BEHIND_RETRY_SEC = float(os.environ.get("WRITE_BEHIND_RETRY_SEC", "2"))
+WRITE_BEHIND_KEEP_DAYS = int(os.environ.get("WRITE_BEHIND_KEEP_DAYS", "7"))
+
+_wb_journal: Optional[_LocalClient] = None
+_wb_init_lock = threading.Lock()
+_wb_wake      = threading.Event()
+_wb_snapshots: dict = {}   # (rid, "queue" | "tables") → rows from the last read that reached Supabase
+_wb_status:    dict = {"online": True, "last_error": "", "last_replay_at": None}
+_WB_TRANSIENT_CODES = {"PGRST000", "PGRST001", "PGRST002", "PGRST003", "57014", "53300", "57P01", "08000", "08006"}
+
+
+def _wb_db() -> _LocalClient:
+    global _wb_journal
+    with _wb_init_lock:
+        if _wb_journal is None:
+            _wb_journal = _LocalClient(WRITE_BEHIND_PATH)
+        return _wb_journal
+
+
+def _wb_transient(e: Exception) -> bool:
+    """Network errors, timeouts and gateway/overload answers are worth retrying. Any other
+    PostgREST error means the row itself was rejected, and anything else is a bug — neither
+    is retried or hidden behind a snapshot."""
+    import httpx
+    if isinstance(e, (httpx.TransportError, OSError)):   # OSError covers TimeoutError
+        return True
+    if not isinstance(e, APIError):
+        return False
+    code = str(e.code or "")
+    return code in _WB_TRANSIENT_CODES or code.startswith("5") and len(code) == 3
+
+
+def _wb_id(key: str, part: str) -> str:
+    return str(_uuid.uuid5(_uuid.NAMESPACE_URL, f"rb-wb:{key}:{part}"))
+
+
+def _wb_append(kind: str, rid: str, payload: dict) -> str:
+    key = _uuid.uuid4().hex
+    _wb_db().table("write_behind").insert({
+        "id": key, "seq": time.time_ns(), "kind": kind, "restaurant_id": rid, "payload": payload,
+        "status": "pending", "step": 0, "attempts": 0, "error": None, "created_at": _now(),
+    }).execute()
+    _wb_wake.set()
+    return key
+
+
+def _wb_pending(rid: Optional[str] = None) -> list:
+    q = _wb_db().table("write_behind").select("*").eq("status", "pending")
+    if rid is not None:
+        q = q.eq("restaurant_id", rid)
+    return q.order("seq").execute().data or []
+
+
+def _wb_read(rid: str, kind: str, fetch) -> list:
+    """fetch() from Supabase, or the last rows it returned when Supabase can't be reached,
+    with this restaurant's pending journal entries applied on top."""
+    try:
+        rows = fetch() or []
+        _wb_snapshots[(rid, kind)] = [dict(r) for r in rows]
+        _wb_status["online"] = True
+    except Exception as e:
+        if not _wb_transient(e) or (rid, kind) not in _wb_snapshots:
+            raise
+        _wb_status.update(online=False, last_error=str(e))
+        rows = [dict(r) for r in _wb_snapshots[(rid, kind)]]
+    return _wb_overlay(rows, kind, _wb_pending(rid))
+
+
+def _wb_overlay(rows: list, kind: str, pending: list) -> list:
+    for j in pending:
+        p = j["payload"]
+        if kind == "queue":
+            if j["kind"] == "join" and all(r.get("id") != p["entry"]["id"] for r in rows):
+                rows.append(dict(p["entry"]))
+            elif j["kind"] == "seat":
+                rows = [r for r in rows if r.get("id") != p["entry_id"]]
+        elif kind == "tables" and j["kind"] in ("seat", "clear"):
+            status = "occupied" if j["kind"] == "seat" else "available"
+            for r in rows:
+                if str(r.get("table_number")) == str(p["table_number"]):
+                    r["status"] = status
+    if kind == "queue":
+        rows.sort(key=lambda r: str(r.get("created_at") or ""))
+    return rows
+
+
+def _wb_find(kind: str, row_id: str) -> Optional[dict]:
+    """A queue entry or table row by id from the read snapshots, with pending entries applied."""
+    for (rid, k), rows in list(_wb_snapshots.items()):
+        if k == kind and any(r.get("id") == row_id for r in rows):
+            return next((r for r in _wb_overlay([dict(r) for r in rows], kind, _wb_pending(rid))
+                         if r.get("id") == row_id), None)
+    if kind == "queue":
+        for j in _wb_pending():
+            if j["kind"] == "join" and j["payload"]["entry"]["id"] == row_id:
+                return dict(j["payload"]["entry"])
+    return None
+
+
+def _wb_entry_rows(entry_id: str) -> list:
+    """get_entry's lookup: Supabase, else the last queue snapshot holding the entry, with a
+    pending join or seat for it applied."""
+    try:
+        rows = supabase.table("queue_entries").select("*").eq("id", entry_id).execute().data or []
+    except Exception as e:
+        if not _wb_transient(e):
+            raise
+        rows = [dict(r) for (_, kind), snap in list(_wb_snapshots.items()) if kind == "queue"
+                for r in snap if r.get("id") == entry_id][:1]
+    for j in _wb_pending():
+        p = j["payload"]
+        if j["kind"] == "join" and p["entry"]["id"] == entry_id and not rows:
+            rows = [dict(p["entry"])]
+        elif j["kind"] == "seat" and p["entry_id"] == entry_id:
+            for r in rows:
+                r["status"] = "seated"
+    return rows
+
+
+def _floor_tables(rid: str, cols: str = "table_number,status,capacity") -> list:
+    """The restaurant's table rows as the station sees them. With the write-behind journal
+    on, whole rows are read so the snapshot can resolve table ids while Supabase is down."""
+    if not WRITE_BEHIND:
+        return supabase.table("tables").select(cols).eq("restaurant_id", rid).execute().data
+    return _wb_read(rid, "tables", lambda: supabase.table("tables").select("*").eq("restaurant_id", rid).execute().data)
+
+
+# ── Write-behind: acknowledging mutations ──
+
+def _wb_join(rid: str, row: dict, wait_est: int) -> dict:
+    entry = dict(row, id=str(_uuid.uuid4()), created_at=_now())
+    _wb_append("join", rid, {"entry": entry, "quote": {
+        "restaurant_id": rid, "party_size": row["party_size"], "quoted_minutes": wait_est, "model_version": "v1-rule",
+    }})
+    return entry
+
+
+def _wb_seat_to_table(entry_id: str, table_id: str) -> Optional[dict]:
+    """Seat from the snapshots, or None when they don't know the entry or table yet (the
+    caller then goes to Supabase directly). The occupant slot is claimed set-if-absent
+    before anything is journaled, so of two stations seating the same table only one
+    gets a 200."""
+    entry, table = _wb_find("queue", entry_id), _wb_find("tables", table_id)
+    if entry is None or table is None:
+        return None
+    rid, tnum = table.get("restaurant_id") or RESTAURANT_ID, table.get("table_number")
+    occ = {"name": entry.get("name") or "Guest", "party_size": entry.get("party_size") or 2,
+           "entry_id": entry_id, "seated_at": _now()}
+    if table.get("status") != "available" or not _rstate(rid).claim_occupant(tnum, occ):
+        raise HTTPException(status_code=409, detail="Table already occupied")
+    try:
+        _wb_append("seat", rid, {"entry_id": entry_id, "table_id": table_id, "table_number": tnum,
+                                 "seated_at": occ["seated_at"]})
+    except Exception:
+        _wb_release_occupant(rid, tnum, entry_id)
+        raise
+    _insights_note_seated(rid, entry)
+    return {"status": "seated", "table_id": table_id}
+
+
+def _wb_release_occupant(rid: str, tnum, entry_id: str) -> None:
+    """Drop the occupant a seat put on the table, unless someone has replaced it since."""
+    st  = _rstate(rid)
+    occ = st.occupant(tnum)
+    if occ is not None and occ.get("entry_id") == entry_id:
+        st.pop_occupant(tnum)
+
+
+def _wb_clear_table(table_id: str) -> Optional[dict]:
+    table = _wb_find("tables", table_id)
+    if table is None:
+        return None
+    rid, tnum = table.get("restaurant_id") or RESTAURANT_ID, table.get("table_number")
+    _wb_append("clear", rid, {"table_id": table_id, "table_number": tnum, "cleared_at": _now()})
+    _rstate(rid).pop_occupant(tnum)
+    return {"status": "cleared"}
+
+
+# ── Write-behind: replay ──
+
+class _WbConflict(Exception):
+    pass
+
+
+# _wb_replay_seat steps past 0..3: a conflict found mid-seat is recorded first, then the
+# steps that already landed are undone, so a retry after a dropped connection finishes
+# the undo instead of carrying on with the seat.
+_WB_UNDO_EVENT = -1   # delete our seating event
+_WB_UNDO_ENTRY = -2   # also put the entry back to waiting
+
+
+def _wb_replay_join(j: dict) -> None:
+    entry = j["payload"]["entry"]
+    try:
+        supabase.table("queue_entries").upsert(entry, on_conflict="id", ignore_duplicates=True).execute()
+    except APIError as e:
+        if _wb_transient(e):
+            raise
+        # Same fallback as join_queue: a newer column may not exist yet
+        core = {k: v for k, v in entry.items() if k not in ("quoted_wait_set_at", "section_preference")}
+        supabase.table("queue_entries").upsert(core, on_conflict="id", ignore_duplicates=True).execute()
+    try:
+        quote = dict(j["payload"]["quote"], id=_wb_id(j["id"], "quote"))
+        supabase.table("wait_quotes").upsert(quote, on_conflict="id", ignore_duplicates=True).execute()
+    except APIError:
+        pass
+
+
+def _wb_replay_seat(j: dict) -> None:
+    p, event_id = j["payload"], _wb_id(j["id"], "seated")
+    if j["step"] < 0:
+        _wb_undo_seat(j, event_id)
+    if j["step"] < 1:
+        # The seating event goes first: it marks the entry as ours if a retry finds it seated
+        supabase.table("seating_events").upsert({
+            "id": event_id, "restaurant_id": j["restaurant_id"], "table_id": p["table_id"],
+            "queue_entry_id": p["entry_id"], "action": "seated", "created_at": p["seated_at"],
+        }, on_conflict="id", ignore_duplicates=True).execute()
+        _wb_step(j, 1)
+    if j["step"] < 2:
+        upd = (supabase.table("queue_entries").update({"status": "seated"})
+               .eq("id", p["entry_id"]).in_("status", ["waiting", "ready"]).execute())
+        if not upd.data:
+            cur    = supabase.table("queue_entries").select("status").eq("id", p["entry_id"]).execute().data
+            others = (supabase.table("seating_events").select("id").eq("queue_entry_id", p["entry_id"])
+                      .neq("id", event_id).limit(1).execute().data)
+            if not cur or cur[0].get("status") != "seated" or others:
+                # Removed or seated by another station: the entry isn't ours to touch
+                _wb_step(j, _WB_UNDO_EVENT, f"entry was {cur[0]['status'] if cur else 'missing'}")
+                _wb_undo_seat(j, event_id)
+        _wb_step(j, 2)
+    if j["step"] < 3:
+        if not _claim_table_for_occupying(p["table_id"]):
+            _wb_step(j, _WB_UNDO_ENTRY, f"table {p['table_number']} was already occupied")
+            _wb_undo_seat(j, event_id)
+        _wb_step(j, 3)
+
+
+def _wb_undo_seat(j: dict, event_id: str) -> None:
+    """Back out a seat that lost to another station's write, then raise the conflict. The
+    entry goes back to waiting so the host can seat it again."""
+    p = j["payload"]
+    if j["step"] == _WB_UNDO_ENTRY:
+        (supabase.table("queue_entries").update({"status": "waiting"})
+         .eq("id", p["entry_id"]).eq("status", "seated").execute())
+    _delete_ids("seating_events", [event_id])
+    _wb_release_occupant(j["restaurant_id"], p["table_number"], p["entry_id"])
+    raise _WbConflict(j.get("conflict") or "seat conflicted")
+
+
+def _wb_replay_clear(j: dict) -> None:
+    p   = j["payload"]
+    cur = supabase.table("tables").select("status").eq("id", p["table_id"]).execute().data
+    if not cur or cur[0].get("status") == "available":
+        return
+    # Seats replayed from this journal carry their original time, so only a seat made
+    # elsewhere after the clear shows up here
+    later = (supabase.table("seating_events").select("id").eq("table_id", p["table_id"])
+             .eq("action", "seated").gt("created_at", p["cleared_at"]).limit(1).execute().data)
+    if later:
+        raise _WbConflict(f"table {p['table_number']} was re-seated after it was cleared here")
+    q = supabase.table("tables").update({"status": "available", "updated_at": p["cleared_at"]})
+    if _tables_unique():
+        q = q.eq("id", p["table_id"])
+    else:
+        q = q.eq("restaurant_id", j["restaurant_id"]).eq("table_number", p["table_number"])
+    q.execute()
+
+
+_WB_REPLAY = {"join": _wb_replay_join, "seat": _wb_replay_seat, "clear": _wb_replay_clear}
+
+
+def _wb_step(j: dict, step: int, conflict: Optional[str] = None) -> None:
+    row = {"step": step} if conflict is None else {"step": step, "conflict": conflict}
+    j.update(row)
+    _wb_db().table("write_behind").update(row).eq("id", j["id"]).execute()
+
+
+def _wb_finish(j: dict, status: str, error: Optional[str] = None) -> None:
+    _wb_db().table("write_behind").update({
+        "status": status, "error": error, "attempts": j["attempts"] + 1, "replayed_at": _now(),
+    }).eq("id", j["id"]).execute()
+
+
+def _wb_replay_once() -> int:
+    """Replay pending entries in order. Stops at the first transient failure so nothing is
+    applied out of order; returns how many entries were settled."""
+    done = 0
+    for j in _wb_pending():
+        try:
+            _WB_REPLAY[j["kind"]](j)
+        except _WbConflict as e:
+            _log("write_behind").warning(f"{j['kind']} {j['id']} conflicted: {e}")
+            _wb_finish(j, "conflict", str(e))
+        except Exception as e:
+            if _wb_transient(e):
+                _wb_db().table("write_behind").update({"attempts": j["attempts"] + 1, "error": str(e)}).eq("id", j["id"]).execute()
+                _wb_status.update(online=False, last_error=str(e))
+                raise
+            _log("write_behind").error(f"{j['kind']} {j['id']} rejected: {e}")
+            _wb_finish(j, "failed", str(e))
+        else:
+            _wb_finish(j, "done")
+        done += 1
+    if done:
+        _wb_status.update(online=True, last_error="", last_replay_at=_now())
+    return done
+
+
+@contextlib.contextmanager
+def _wb_drain_lock():
+    """Yields True while this process holds the journal file's drain lock, False when
+    another process sharing WRITE_BEHIND_PATH is draining it."""
+    try:
+        import fcntl
+    except ImportError:
+        yield True   # no flock on this platform — single-process dev box
+        return
+    with open(WRITE_BEHIND_PATH + ".lock", "a+") as fh:
+        try:
+            fcntl.flock(fh, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(fh, fcntl.LOCK_UN)
+
+
+def _wb_replay_loop():
+    delay, next_trim = WRITE_BEHIND_RETRY_SEC, 0.0
+    while True:
+        _wb_wake.wait(delay)
+        _wb_wake.clear()
+        with _wb_drain_lock() as draining:
+            if draining:
+                delay, next_trim = _wb_drain(delay, next_trim)
+
+
+def _wb_drain(delay: float, next_trim: float) -> tuple:
+    """One replay pass plus the hourly trim; returns the next (delay, next_trim)."""
+    from datetime import timedelta
+    try:
+        n = _wb_replay_once()
+        delay = WRITE_BEHIND_RETRY_SEC
+        if n:
+            _log("write_behind").info(f"replayed {n} journal entr{'y' if n == 1 else 'ies'}")
     except Exception as e:
-        print(f"[cleanup_duplicate_tables] outer error: {e}")
+        delay = min(60.0, delay * 2)   # Supabase still unreachable — back off
+        _log("write_behind").warning(f"replay paused, retrying in {delay:.0f}s: {e}")
+    if time.time() >= next_trim:
+        next_trim = time.time() + 3600
+        cutoff = (datetime.utcnow() - timedelta(days=WRITE_BEHIND_KEEP_DAYS)).isoformat()
+        try:
+            _wb_db().table("write_behind").delete(returning="minimal").neq("status", "pending").lt("created_at", cutoff).execute()
+        except Exception as e:
+            _log("write_behind").warning(f"journal trim failed: {e}")
+    return delay, next_trim
+
+
+if WRITE_BEHIND:
+    _background(_wb_replay_loop)
 
-threading.Thread(target=_cleanup_duplicate_tables, daemon=True).start()
+
+@app.get("/write-behind")
+def write_behind_status(restaurant_id: Optional[str] = None):
+    """Journal health for the station: how much is waiting to reach Supabase, and which
+    offline writes lost to another station's."""
+    if not WRITE_BEHIND:
+        return {"enabled": False}
+    rid     = _rid(restaurant_id)
+    pending = _wb_pending(rid)
+    settled = (_wb_db().table("write_behind").select("*").eq("restaurant_id", rid)
+               .in_("status", ["conflict", "failed"]).order("seq", desc=True).limit(50).execute().data or [])
+    return {
+        "enabled":        True,
+        "online":         _wb_status["online"],
+        "last_error":     _wb_status["last_error"] or None,
+        "last_replay_at": _wb_status["last_replay_at"],
+        "pending":        len(pending),
+        "oldest_pending": pending[0]["created_at"] if pending else None,
+        "problems": [{"kind": j["kind"], "status": j["status"], "error": j["error"], "at": j["created_at"],
+                      **{k: v for k, v in j["payload"].items() if k in ("entry_id", "table_number")}}
+                     for j in settled],
+    }
 
 @app.get("/tables")
 def get_tables(restaurant_id: Optional[str] = None):
@@ -1275,20 +3456,20 @@ class OccupyRequest(BaseModel):
 
 @app.post("/tables/{table_id}/occupy")
 def occupy_table(table_id: str, body: Optional[OccupyRequest] = None):
-    supabase.table("tables").update({"status": "occupied", "updated_at": _now()}).eq("id", table_id).execute()
+    # The update echoes the row back, so its (restaurant_id, table_number) comes for free
+    tbl_res = supabase.table("tables").update({"status": "occupied", "updated_at": _now()}).eq("id", table_id).execute()
     # Update in-memory occupant tracking so cross-view sync reflects the new occupant
-    tbl_res = supabase.table("tables").select("table_number, restaurant_id").eq("id", table_id).execute()
     if tbl_res.data:
         t = tbl_res.data[0]
         rid = t.get("restaurant_id") or RESTAURANT_ID
         tnum = t.get("table_number")
         if tnum is not None:
-            with _occupants_lock:
-                _table_occupants[f"{rid}:{tnum}"] = {
-                    "name": (body.name if body and body.name else None) or "Guest",
-                    "party_size": (body.party_size if body and body.party_size else None) or 2,
-                    "entry_id": (body.entry_id if body else None),
-                }
+            _rstate(rid).set_occupant(tnum, {
+                "name": (body.name if body and body.name else None) or "Guest",
+                "party_size": (body.party_size if body and body.party_size else None) or 2,
+                "entry_id": (body.entry_id if body else None),
+                "seated_at": _now(),
+            })
         # Persist a seating_event so _seed_table_occupants correctly restores the moved
         # guest's location after a Railway restart, rather than seeding them at the original
         # table from the older seat-to-table event.
@@ -1301,17 +3482,31 @@ def occupy_table(table_id: str, body: Optional[OccupyRequest] = None):
                     "action":        "seated",
                 }).execute()
             except Exception as e:
-                print(f"[occupy] seating_event insert failed: {e}")
+                _log("occupy").warning(f"seating_event insert failed: {e}")
     return {"status": "occupied"}
 
 @app.post("/tables/{table_id}/clear")
 def clear_table(table_id: str):
+    if WRITE_BEHIND:
+        out = _wb_clear_table(table_id)
+        if out is not None:
+            return out
+    if _tables_unique():
+        # One row per physical table: clear by id and take rid/table_number from the echo.
+        try:
+            upd = supabase.table("tables").update({"status": "available", "updated_at": _now()}).eq("id", table_id).execute()
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"clear_table failed: {e}")
+        for t in upd.data or []:
+            if t.get("table_number") is not None:
+                _rstate(t.get("restaurant_id") or RESTAURANT_ID).pop_occupant(t["table_number"])
+        return {"status": "cleared"}
     # Look up the table's (restaurant_id, table_number) first so we can:
     #   1) Clear in-memory occupants keyed by table_number
     #   2) Mark EVERY row with the same (rid, table_number) as available — duplicate-row
     #      safe, mirrors _claim_table_for_occupying which claims all siblings together.
     tbl_res = supabase.table("tables").select("table_number, restaurant_id").eq("id", table_id).execute()
-    key: Optional[str] = None
+    st = None
     rid: Optional[str] = None
     tnum = None
     removed_entry: Optional[dict] = None
@@ -1320,9 +3515,8 @@ def clear_table(table_id: str):
         rid = t.get("restaurant_id") or RESTAURANT_ID
         tnum = t.get("table_number")
         if tnum is not None:
-            key = f"{rid}:{tnum}"
-            with _occupants_lock:
-                removed_entry = _table_occupants.pop(key, None)
+            st = _rstate(rid)
+            removed_entry = st.pop_occupant(tnum)
     try:
         if rid is not None and tnum is not None:
             # Clear ALL sibling rows so a stale duplicate can't be read back as "occupied".
@@ -1331,9 +3525,8 @@ def clear_table(table_id: str):
             supabase.table("tables").update({"status": "available", "updated_at": _now()}).eq("id", table_id).execute()
     except Exception as e:
         # DB write failed — restore in-memory so we don't silently leak state and tell client to retry
-        if key and removed_entry is not None:
-            with _occupants_lock:
-                _table_occupants[key] = removed_entry
+        if st is not None and removed_entry is not None:
+            st.set_occupant(tnum, removed_entry)
         raise HTTPException(status_code=500, detail=f"clear_table failed: {e}")
     return {"status": "cleared"}
 
@@ -1345,7 +3538,7 @@ def clear_table_legacy(table_id: str):
 def get_table_occupants(restaurant_id: Optional[str] = None):
     """Return table→guest mapping, self-healing across restarts.
 
-    Primary source: in-memory _table_occupants (fast, authoritative for live mutations).
+    Primary source: the restaurant's in-memory occupants (fast, authoritative for live mutations).
     Fallback: if memory is empty for this restaurant but DB has occupied tables, rebuild
     from seating_events inline before responding. This guarantees table occupancy
     survives every client refresh AND every server restart — there is no window where
@@ -1354,11 +3547,9 @@ def get_table_occupants(restaurant_id: Optional[str] = None):
     We DO NOT fall back to DB table.status for tables that have been explicitly cleared
     in memory — once a clear lands, the in-memory pop is authoritative."""
     rid = _rid(restaurant_id)
-    prefix = f"{rid}:"
 
     def _snapshot() -> dict:
-        with _occupants_lock:
-            return {k.split(":", 1)[1]: v for k, v in _table_occupants.items() if k.startswith(prefix)}
+        return _rstate(rid).occupants_snapshot()
 
     result = _snapshot()
 
@@ -1370,14 +3561,253 @@ def get_table_occupants(restaurant_id: Optional[str] = None):
         try:
             seeded = _rebuild_occupants_for_restaurant(rid)
             if seeded:
-                print(f"[tables/occupants] self-healed {seeded} occupant(s) for rid={rid}")
+                _log("tables.occupants").info(f"self-healed {seeded} occupant(s) for rid={rid}")
                 result = _snapshot()
         except Exception as e:
-            print(f"[tables/occupants] self-heal failed for rid={rid}: {e}")
+            _log("tables.occupants").warning(f"self-heal failed for rid={rid}: {e}")
 
     return result
 
 
+# ── Bulk delete jobs ─────────────────────────────────────────────────────────
+# Clearing a tenant used to be one unbounded DELETE per table, with PostgREST
+# echoing every deleted row back. A purge job instead walks each step in id
+# batches: select up to PURGE_BATCH ids matching the step's filters, then
+# delete (or update) exactly those ids with return=minimal. Rows leave the
+# filter as they're handled, so a step is naturally resumable — progress is
+# written to purge_jobs after every batch (migration 006) and unfinished
+# jobs are picked up again on boot. Callers wait up to PURGE_SYNC_SEC and get
+# the final counts if the job finished in time, otherwise a job_id to poll.
+#
+# Jobs for one restaurant run one at a time; different tenants purge in
+# parallel. Every job row names its owner process (migration 008). Progress
+# saves only land while the row still names this process. A queued or running
+# job is resumed only once its updated_at is PURGE_LEASE_SEC stale, and taken
+# over with a conditional update on the updated_at that was read, so two
+# replicas booting together can't both resume the same job.
+PURGE_BATCH       = int(os.environ.get("PURGE_BATCH", "1000"))
+PURGE_SYNC_SEC    = float(os.environ.get("PURGE_SYNC_SEC", "8"))
+PURGE_JOB_TTL_SEC = int(os.environ.get("PURGE_JOB_TTL_SEC", "86400"))
+PURGE_LEASE_SEC   = int(os.environ.get("PURGE_LEASE_SEC", "300"))
+
+_purge_jobs: dict = {}   # job_id → job record (+ "_done" Event while in memory)
+_purge_lock       = threading.Lock()
+_purge_run_locks: dict = {}   # rid → Lock; jobs for one tenant hit the same rows
+
+
+class _PurgeLost(Exception):
+    """Another process claimed the job; stop without writing to its row."""
+
+
+def _delete_ids(table: str, ids: list):
+    from postgrest.types import ReturnMethod
+    for i in range(0, len(ids), 200):
+        supabase.table(table).delete(returning=ReturnMethod.minimal).in_("id", ids[i:i + 200]).execute()
+
+
+def _update_ids(table: str, ids: list, values: dict):
+    from postgrest.types import ReturnMethod
+    for i in range(0, len(ids), 200):
+        supabase.table(table).update(values, returning=ReturnMethod.minimal).in_("id", ids[i:i + 200]).execute()
+
+
+def _purge_step(table: str, rid: str, op: str = "delete", values: Optional[dict] = None, **filters) -> dict:
+    """One table pass of a purge job. filters: gte=(col, val), in_=(col, [vals])."""
+    return {"table": table, "restaurant_id": rid, "op": op, "values": values,
+            "filters": {k: list(v) for k, v in filters.items()}, "rows": 0, "done": False}
+
+
+def _purge_view(job: dict) -> dict:
+    view = {k: v for k, v in job.items() if not k.startswith("_")}
+    view["rows"] = sum(s["rows"] for s in job["steps"])
+    view["steps_done"] = sum(1 for s in job["steps"] if s["done"])
+    return view
+
+
+_PURGE_COLS = ("id", "kind", "restaurant_ids", "steps", "status", "error", "owner", "created_at", "updated_at")
+
+
+def _purge_save(job: dict, create: bool = False):
+    """Persist progress. Past creation the write is conditional on the row still naming
+    this process as owner; raises _PurgeLost when it doesn't."""
+    job["updated_at"] = _now()
+    row = {k: job.get(k) for k in _PURGE_COLS}
+    try:
+        if create:
+            supabase.table("purge_jobs").upsert(row).execute()
+            return
+        res = (supabase.table("purge_jobs").update(row)
+               .eq("id", job["id"]).eq("owner", job["owner"]).execute())
+    except Exception as e:
+        _log("purge").warning(f"could not save job {job['id']}: {e}")
+        return
+    if not res.data:
+        raise _PurgeLost(job["id"])
+
+
+def _purge_claim(job: dict, statuses: list, seen_at: Optional[str] = None) -> bool:
+    """Take the job row for this process with one conditional update. Matches only while
+    the status is one of statuses and, with seen_at, nobody has saved since it was read."""
+    now = _now()
+    q = (supabase.table("purge_jobs")
+         .update({"status": "queued", "owner": _REPLICA_ID, "updated_at": now})
+         .eq("id", job["id"]).in_("status", statuses))
+    if seen_at is not None:
+        q = q.eq("updated_at", seen_at)
+    if not (q.execute().data or []):
+        return False
+    job.update(status="queued", owner=_REPLICA_ID, updated_at=now)
+    return True
+
+
+def _purge_rid_locks(rids: list) -> list:
+    with _purge_lock:
+        return [_purge_run_locks.setdefault(rid, threading.Lock()) for rid in sorted(set(rids))]
+
+
+def _purge_run_step(step: dict, save):
+    q_filters = step["filters"]
+    last: list = []
+    while True:
+        q = supabase.table(step["table"]).select("id").eq("restaurant_id", step["restaurant_id"])
+        if "gte" in q_filters:
+            q = q.gte(*q_filters["gte"])
+        if "in_" in q_filters:
+            q = q.in_(*q_filters["in_"])
+        ids = [r["id"] for r in (q.order("id").limit(PURGE_BATCH).execute().data or [])]
+        if not ids:
+            break
+        if ids == last:
+            raise RuntimeError(f"{step['table']}: batch was not removed (RLS or a missing grant?)")
+        if step["op"] == "update":
+            _update_ids(step["table"], ids, step["values"])
+        else:
+            _delete_ids(step["table"], ids)
+        step["rows"] += len(ids)
+        save()
+        if len(ids) < PURGE_BATCH:
+            break
+        last = ids
+    step["done"] = True
+
+
+def _purge_run(job: dict):
+    with contextlib.ExitStack() as stack:
+        for lock in _purge_rid_locks(job["restaurant_ids"]):
+            stack.enter_context(lock)
+        try:
+            job.update(status="running", error=None)
+            _purge_save(job)
+            try:
+                for step in job["steps"]:
+                    if not step["done"]:
+                        _purge_run_step(step, lambda: _purge_save(job))
+                job["status"] = "done"
+                _log("purge").info(f"{job['kind']} {job['id']} done: {_purge_view(job)['rows']} rows")
+            except _PurgeLost:
+                raise
+            except Exception as e:
+                job.update(status="failed", error=str(e))
+                _log("purge").warning(f"{job['kind']} {job['id']} failed: {e}")
+            _purge_save(job)
+        except _PurgeLost:
+            _log("purge").warning(f"{job['kind']} {job['id']} was claimed by another process; stopping")
+    done = job.get("_done")
+    if done:
+        done.set()
+
+
+def _purge_start(kind: str, rids: list, steps: list) -> dict:
+    now = time.time()
+    job = {"id": str(_uuid.uuid4()), "kind": kind, "restaurant_ids": rids, "steps": steps,
+           "status": "queued", "error": None, "owner": _REPLICA_ID, "created_at": _now(),
+           "updated_at": _now(), "_done": threading.Event(), "_at": now}
+    with _purge_lock:
+        for jid in [j for j, v in _purge_jobs.items()
+                    if v["status"] in ("done", "failed") and now - v["_at"] > PURGE_JOB_TTL_SEC]:
+            del _purge_jobs[jid]
+        _purge_jobs[job["id"]] = job
+    _purge_save(job, create=True)
+    threading.Thread(target=_purge_run, args=(job,), daemon=True).start()
+    return job
+
+
+def _purge_rows_by_table(job: dict) -> dict:
+    out: dict = {}
+    for s in job["steps"]:
+        key = f"{s['table']}_{'updated' if s['op'] == 'update' else 'deleted'}"
+        out[key] = out.get(key, 0) + s["rows"]
+    return out
+
+
+def _purge_resume_pending():
+    """Boot hook: pick up purge jobs a dead process left queued/running. A job is only
+    resumed once its owner has gone PURGE_LEASE_SEC without saving progress."""
+    from datetime import timedelta
+    stale_before = (datetime.utcnow() - timedelta(seconds=PURGE_LEASE_SEC)).isoformat()
+    try:
+        rows = (supabase.table("purge_jobs").select("*")
+                .in_("status", ["queued", "running"]).lt("updated_at", stale_before)
+                .order("created_at").execute().data or [])
+    except Exception as e:
+        _log("purge").warning(f"resume skipped: {e}")
+        return
+    for row in rows:
+        job = {**row, "_done": threading.Event(), "_at": time.time()}
+        with _purge_lock:
+            if job["id"] in _purge_jobs:
+                continue
+        try:
+            if not _purge_claim(job, ["queued", "running"], row["updated_at"]):
+                continue
+        except Exception as e:
+            _log("purge").warning(f"could not claim {job['id']}: {e}")
+            continue
+        with _purge_lock:
+            _purge_jobs[job["id"]] = job
+        _log("purge").info(f"resuming {job['kind']} {job['id']}")
+        threading.Thread(target=_purge_run, args=(job,), daemon=True).start()
+
+
+_background(_purge_resume_pending, leader=True)
+
+
+def _purge_get(job_id: str) -> dict:
+    with _purge_lock:
+        job = _purge_jobs.get(job_id)
+    if job is None:
+        try:
+            rows = supabase.table("purge_jobs").select("*").eq("id", job_id).limit(1).execute().data or []
+        except Exception:
+            rows = []
+        if not rows:
+            raise HTTPException(status_code=404, detail="Job not found")
+        job = rows[0]
+    return job
+
+
+@app.get("/purge/jobs/{job_id}")
+def purge_job_status(job_id: str):
+    """Progress for a bulk delete job started by /admin/clear-day or /owner/analytics/clear."""
+    return _purge_view(_purge_get(job_id))
+
+
+@app.post("/owner/purge/jobs/{job_id}/resume")
+def purge_job_resume(job_id: str, secret: Optional[str] = None):
+    """Re-run a failed purge job from where it stopped (finished steps are skipped)."""
+    _check_owner_secret(secret)
+    job = _purge_get(job_id)
+    if job["status"] not in ("failed",):
+        raise HTTPException(status_code=409, detail=f"Job is {job['status']}")
+    if not _purge_claim(job, ["failed"]):
+        raise HTTPException(status_code=409, detail="Job was resumed by another request")
+    job.update(_done=threading.Event(), _at=time.time())
+    with _purge_lock:
+        _purge_jobs[job_id] = job
+    threading.Thread(target=_purge_run, args=(job,), daemon=True).start()
+    return _purge_view(job)
+
+
 class ClearDayRequest(BaseModel):
     admin_pin: str = ""
 
@@ -1391,15 +3821,14 @@ def admin_clear_day(restaurant_id: Optional[str] = None, req: ClearDayRequest =
       - Marks all currently-seated entries as 'removed' (they've already been served;
         this just clears them from the history "still here" view).
       - Sets every table's DB status back to 'available'.
-      - Wipes _table_occupants for this restaurant → floor map goes green.
-      - Wipes _wait_set_at for entries in this restaurant → no stale timers.
+      - Wipes this restaurant's in-memory occupants → floor map goes green.
+      - Wipes this restaurant's wait timers → no stale timers.
 
     What it does NOT do:
       - Delete rows. History / analytics stay intact. If a manager taps "Clear" early,
         the history tab still shows who was seated today. Only the 3am rollover + the
         owner's /owner/analytics/clear hard-delete remove rows.
     """
-    from datetime import timedelta
     rid = _rid(restaurant_id)
 
     # ── PIN verification ──────────────────────────────────────────────────────
@@ -1419,7 +3848,7 @@ def admin_clear_day(restaurant_id: Optional[str] = None, req: ClearDayRequest =
     except HTTPException:
         raise
     except Exception as e:
-        print(f"[admin/clear-day] PIN check error: {e}")
+        _log("admin.clear-day").error(f"PIN check error: {e}")
         raise HTTPException(status_code=500, detail="PIN check failed")
 
     counts = {"queue_entries_updated": 0, "tables_reset": 0, "occupants_dropped": 0, "history_deleted": 0}
@@ -1427,40 +3856,19 @@ def admin_clear_day(restaurant_id: Optional[str] = None, req: ClearDayRequest =
     # Business-day window (3am cutoff) — we hard-delete today's guest log rows so the
     # "history" view in the station/admin UI reads empty after a clear. Older days stay
     # intact for analytics.
-    now = datetime.now(timezone.utc)
-    bd_start = now.replace(hour=3, minute=0, second=0, microsecond=0)
-    if now.hour < 3:
-        bd_start -= timedelta(days=1)
+    bd_start = _business_day_start()
 
-    # 1. Drop all active queue entries (waiting/ready/seated) to 'removed'. "Seated" entries
+    # 1. Hard-delete today's guest log entries so the history view empties out, then drop
+    # every remaining active entry (waiting/ready/seated) to 'removed'. "Seated" entries
     # are included because they represent guests currently at tables; after a clear those
     # tables should be free AND the entries shouldn't re-appear in anything that filters
-    # on seated status.
-    try:
-        upd = (
-            supabase.table("queue_entries")
-            .update({"status": "removed"})
-            .eq("restaurant_id", rid)
-            .in_("status", ["waiting", "ready", "seated"])
-            .execute()
-        )
-        counts["queue_entries_updated"] = len(upd.data or [])
-    except Exception as e:
-        print(f"[admin/clear-day] queue update failed for {rid}: {e}")
-
-    # 1b. Hard-delete today's guest log entries so the history view empties out. We keep
-    # older days untouched — analytics/owner exports still see them.
-    try:
-        dele = (
-            supabase.table("queue_entries")
-            .delete()
-            .eq("restaurant_id", rid)
-            .gte("arrival_time", bd_start.isoformat())
-            .execute()
-        )
-        counts["history_deleted"] = len(dele.data or [])
-    except Exception as e:
-        print(f"[admin/clear-day] history delete failed for {rid}: {e}")
+    # on seated status. Both run as a batched purge job — a busy night is still only a
+    # few hundred rows, but nothing here is unbounded any more.
+    job = _purge_start("clear_day", [rid], [
+        _purge_step("queue_entries", rid, gte=("arrival_time", bd_start.isoformat())),
+        _purge_step("queue_entries", rid, op="update", values={"status": "removed"},
+                    in_=("status", ["waiting", "ready", "seated"])),
+    ])
 
     # 2. Mark every table as available. Not conditional — we want every table free
     # regardless of its current state.
@@ -1473,22 +3881,23 @@ def admin_clear_day(restaurant_id: Optional[str] = None, req: ClearDayRequest =
         )
         counts["tables_reset"] = len(tbl_upd.data or [])
     except Exception as e:
-        print(f"[admin/clear-day] tables reset failed for {rid}: {e}")
+        _log("admin.clear-day").warning(f"tables reset failed for {rid}: {e}")
 
     # 3. Clear in-memory state for this restaurant.
-    prefix = f"{rid}:"
-    with _occupants_lock:
-        keys_to_drop = [k for k in list(_table_occupants.keys()) if k.startswith(prefix)]
-        for k in keys_to_drop:
-            del _table_occupants[k]
-        counts["occupants_dropped"] = len(keys_to_drop)
-
-    # _wait_set_at is keyed by entry_id (not rid), so we'd need an entry lookup to clear it
-    # precisely. But since every entry we just touched is now 'removed' and the queue
-    # endpoint filters to waiting/ready, those timer entries are dereferenced and harmless.
-
-    print(f"[admin/clear-day] restaurant={rid} counts={counts}")
-    return {"status": "cleared", "restaurant_id": rid, **counts}
+    st = _rstate(rid)
+    counts["occupants_dropped"] = st.clear_occupants()
+    st.clear_waits()
+
+    finished = job["_done"].wait(PURGE_SYNC_SEC)
+    done = _purge_rows_by_table(job)
+    counts["history_deleted"]       = done.get("queue_entries_deleted", 0)
+    counts["queue_entries_updated"] = done.get("queue_entries_updated", 0)
+    _log("admin.clear-day").info(f"restaurant={rid} counts={counts} job={job['status']}")
+    if not finished:
+        return {"status": "clearing", "restaurant_id": rid, "job_id": job["id"], **counts}
+    if job["status"] == "failed":
+        raise HTTPException(status_code=500, detail=f"Clear failed: {job['error']} (job {job['id']})")
+    return {"status": "cleared", "restaurant_id": rid, "job_id": job["id"], **counts}
 
 
 # ── Queue ────────────────────────────────────────────────────────────────────
@@ -1497,27 +3906,42 @@ def admin_clear_day(restaurant_id: Optional[str] = None, req: ClearDayRequest =
 def get_queue(restaurant_id: Optional[str] = None):
     rid     = _rid(restaurant_id)
     entries = _active_queue(rid)
-    tables  = supabase.table("tables").select("status,capacity").eq("restaurant_id", rid).execute().data
+    tables  = _floor_tables(rid)
+    plan    = _planner_plan_safe(rid, tables)
+    listed  = _live_signals(rid, listed=True)
+    waits   = _rstate(rid).wait_snapshot()
     for i, e in enumerate(entries):
         e["position"]       = i + 1
-        e["wait_estimate"]  = _wait_estimate_with(i, e.get("party_size", 2), tables)
-        e["remaining_wait"] = _remaining_wait(e)
-        e["wait_set_at"]    = _wait_set_at.get(e["id"])
+        e["wait_estimate"]  = _wait_estimate_with(i, e.get("party_size", 2), tables,
+                                                  _planner_held(plan, e.get("party_size", 2)), listed)
+        e["remaining_wait"] = _remaining_wait(e, waits)
+        e["wait_set_at"]    = waits.get(e["id"])
     return entries
 
 @app.get("/state")
 def get_state(restaurant_id: Optional[str] = None):
     rid     = _rid(restaurant_id)
-    tables  = _dedup_tables(supabase.table("tables").select("*").eq("restaurant_id", rid).execute().data)
+    tables  = _dedup_tables(_floor_tables(rid, "*"))
     entries = _active_queue(rid)
+    plan    = _planner_plan_safe(rid, tables)
+    signals = _live_signals(rid)
+    listed  = _live_signals(rid, listed=True)
+    waits   = _rstate(rid).wait_snapshot()
     for i, e in enumerate(entries):
         e["position"]       = i + 1
-        e["wait_estimate"]  = _wait_estimate_with(i, e.get("party_size", 2), tables)
-        e["remaining_wait"] = _remaining_wait(e)
-        e["wait_set_at"]    = _wait_set_at.get(e["id"])
+        e["wait_estimate"]  = _wait_estimate_with(i, e.get("party_size", 2), tables,
+                                                  _planner_held(plan, e.get("party_size", 2)), listed)
+        e["remaining_wait"] = _remaining_wait(e, waits)
+        e["wait_set_at"]    = waits.get(e["id"])
+    held      = _planner_held(plan)
     available = sum(1 for t in tables if t["status"] == "available")
-    avg_wait  = _wait_estimate_with(len(entries), 2, tables)
-    return {"queue": entries, "tables": tables, "avg_wait": avg_wait, "tables_available": available}
+    avg_wait  = _wait_estimate_with(len(entries), 2, tables, held, signals)
+    walkaways = _walkaway_check(rid, sum(1 for e in entries if e["status"] == "waiting"))
+    out = {"queue": entries, "tables": tables, "avg_wait": avg_wait, "tables_available": available,
+           "held_tables": sorted(held), "signals": signals, "walkaways": walkaways}
+    if WRITE_BEHIND:
+        out["sync"] = {"online": _wb_status["online"], "pending": len(_wb_pending(rid))}
+    return out
 
 @app.get("/waitlist")  # legacy
 def get_waitlist_legacy():
@@ -1525,23 +3949,25 @@ def get_waitlist_legacy():
 
 def _send_join_sms(phone: str, rest_name: str, entry_id: str) -> None:
     short_id = entry_id[:8]
-    print(f"[SMS] Sending join SMS to {phone!r} for entry {entry_id}")
+    _log("sms").debug("Sending join SMS to %s for entry %s", _mask_phone(phone), entry_id)
     ok, err = _send_sms(
         to_phone=phone,
         body=f"Welcome to {rest_name}! You've been added to the waitlist. Your wait code is {short_id}. We'll text you when your table is ready. Reply STOP to opt out.",
     )
-    print(f"[SMS] Join SMS result: ok={ok} err={err!r}")
+    _log("sms").debug("Join SMS result: ok=%s err=%r", ok, err)
     if not ok:
-        print(f"[SMS] Join SMS failed: {err}")
+        _log("sms").warning(f"Join SMS failed: {err}")
 
 @app.post("/queue/join")
 def join_queue(req: JoinQueueRequest, background_tasks: BackgroundTasks):
     try:
         rid      = _rid(req.restaurant_id)
-        tables   = supabase.table("tables").select("status,capacity").eq("restaurant_id", rid).execute().data
+        tables   = _floor_tables(rid)
         queue    = _active_queue(rid)
         ahead    = len(queue)
-        wait_est = _wait_estimate_with(ahead, req.party_size, tables)
+        wait_est = _wait_estimate_with(ahead, req.party_size, tables,
+                                       _planner_held(_planner_plan_safe(rid, tables), req.party_size),
+                                       _live_signals(rid))
         join_time = _now()
         base_insert = {
             "restaurant_id": rid,
@@ -1559,25 +3985,28 @@ def join_queue(req: JoinQueueRequest, background_tasks: BackgroundTasks):
             base_insert["quoted_wait_set_at"] = join_time
         if req.section_preference:
             base_insert["section_preference"] = req.section_preference
-        try:
-            entry = supabase.table("queue_entries").insert(base_insert).execute()
-        except Exception:
-            # A new column may not exist yet — retry with only the safe core fields
-            base_insert.pop("quoted_wait_set_at", None)
-            base_insert.pop("section_preference", None)
-            entry = supabase.table("queue_entries").insert(base_insert).execute()
-        try:
-            supabase.table("wait_quotes").insert({
-                "restaurant_id": rid,
-                "party_size":    req.party_size,
-                "quoted_minutes": wait_est,
-                "model_version": "v1-rule",
-            }).execute()
-        except Exception:
-            pass
-        new_entry = entry.data[0]
+        if WRITE_BEHIND:
+            new_entry = _wb_join(rid, base_insert, wait_est)
+        else:
+            try:
+                entry = supabase.table("queue_entries").insert(base_insert).execute()
+            except Exception:
+                # A new column may not exist yet — retry with only the safe core fields
+                base_insert.pop("quoted_wait_set_at", None)
+                base_insert.pop("section_preference", None)
+                entry = supabase.table("queue_entries").insert(base_insert).execute()
+            try:
+                supabase.table("wait_quotes").insert({
+                    "restaurant_id": rid,
+                    "party_size":    req.party_size,
+                    "quoted_minutes": wait_est,
+                    "model_version": "v1-rule",
+                }).execute()
+            except Exception:
+                pass
+            new_entry = entry.data[0]
         if req.quoted_wait is not None:
-            _wait_set_at[new_entry["id"]] = _now()
+            _rstate(rid).wait_set(new_entry["id"], _now())
         # No welcome SMS for host-added guests — they're standing right there.
         # Only the "come to host stand" notify_ready SMS fires later when they're called.
         sms_sent = False
@@ -1679,21 +4108,27 @@ def get_queue_history(restaurant_id: Optional[str] = None, date: Optional[str] =
 
 @app.get("/queue/{entry_id}")
 def get_entry(entry_id: str):
-    res = supabase.table("queue_entries").select("*").eq("id", entry_id).execute()
-    if not res.data:
+    if WRITE_BEHIND:
+        rows = _wb_entry_rows(entry_id)
+    else:
+        rows = supabase.table("queue_entries").select("*").eq("id", entry_id).execute().data
+    if not rows:
         raise HTTPException(status_code=404, detail="Entry not found")
-    entry = res.data[0]
+    entry = rows[0]
     if entry["status"] in ("waiting", "ready"):
         # Use the entry's own restaurant_id so demo and real restaurants have correct positions
         entry_rid = entry.get("restaurant_id")
         all_ids  = [e["id"] for e in _active_queue(entry_rid)]
         position = (all_ids.index(entry_id) + 1) if entry_id in all_ids else 1
-        tables = supabase.table("tables").select("status,capacity").eq("restaurant_id", entry_rid).execute().data
+        tables = _floor_tables(entry_rid)
         entry["position"]       = position
         entry["parties_ahead"]  = position - 1
-        entry["wait_estimate"]  = _wait_estimate_with(position - 1, entry.get("party_size", 2), tables)
-        entry["remaining_wait"] = _remaining_wait(entry)
-        entry["wait_set_at"]    = _wait_set_at.get(entry_id)
+        entry["wait_estimate"]  = _wait_estimate_with(position - 1, entry.get("party_size", 2), tables,
+                                                      _planner_held(_planner_plan_safe(entry_rid, tables),
+                                                                    entry.get("party_size", 2)),
+                                                      _live_signals(entry_rid, listed=True))
+        entry["wait_set_at"]    = _rstate(entry_rid).wait_get(entry_id)
+        entry["remaining_wait"] = _remaining_wait(entry, {entry_id: entry["wait_set_at"]})
     return entry
 
 def _claim_entry_for_seating(entry_id: str) -> dict:
@@ -1733,7 +4168,10 @@ def _claim_table_for_occupying(table_id: str) -> Optional[dict]:
     row and we'd silently double-book the physical table — which is exactly the "guest
     at two tables" bug the user hit. After the one-time _cleanup_duplicate_tables pass
     this is a no-op beyond the single-row claim, but the defense-in-depth makes the race
-    harmless even mid-cleanup."""
+    harmless even mid-cleanup. With migration 007 it is a single claim_table RPC."""
+    if _tables_unique():
+        rows = supabase.rpc("claim_table", {"p_table_id": table_id}).execute().data or []
+        return rows[0] if rows else None
     # Look up target row to get its (restaurant_id, table_number).
     target = supabase.table("tables").select("id, table_number, restaurant_id").eq("id", table_id).execute().data
     if not target:
@@ -1771,20 +4209,23 @@ def _claim_table_for_occupying(table_id: str) -> Optional[dict]:
 
 
 def _record_seating(rid: str, entry_id: str, table_id: str, tnum: int,
-                    name: str, party_size: int) -> None:
+                    name: str, party_size: int, entry: Optional[dict] = None) -> None:
     """Update in-memory occupants + persist a seating_events row.
-    Factored so both seat endpoints and the walkin-at-table endpoint do this identically."""
-    with _occupants_lock:
-        _table_occupants[f"{rid}:{tnum}"] = {
-            "name": name or "Guest", "party_size": party_size or 2, "entry_id": entry_id,
-        }
+    Factored so both seat endpoints and the walkin-at-table endpoint do this identically.
+    entry: the claimed queue row, when there is one — feeds today's quote-accuracy stats."""
+    if entry:
+        _insights_note_seated(rid, entry)
+    _rstate(rid).set_occupant(tnum, {
+        "name": name or "Guest", "party_size": party_size or 2, "entry_id": entry_id,
+        "seated_at": _now(),
+    })
     try:
         supabase.table("seating_events").insert({
             "restaurant_id": rid, "table_id": table_id,
             "queue_entry_id": entry_id, "action": "seated",
         }).execute()
     except Exception as e:
-        print(f"[seating_events] insert failed: {e}")
+        _log("seating_events").warning(f"insert failed: {e}")
 
 
 def _release_entry_claim(entry_id: str, back_to: str = "waiting") -> None:
@@ -1794,7 +4235,7 @@ def _release_entry_claim(entry_id: str, back_to: str = "waiting") -> None:
     try:
         supabase.table("queue_entries").update({"status": back_to}).eq("id", entry_id).execute()
     except Exception as e:
-        print(f"[release_entry_claim] failed: {e}")
+        _log("release_entry_claim").warning(f"failed: {e}")
 
 
 @app.post("/queue/{entry_id}/seat")
@@ -1807,26 +4248,43 @@ def seat_entry(entry_id: str):
 
     # Find candidate tables (smallest→largest), then race-safely try to occupy one.
     # If another request grabs our first pick, move to the next candidate.
-    candidates = (
-        supabase.table("tables")
-        .select("*")
-        .eq("restaurant_id", entry_rid)
-        .eq("status", "available")
-        .gte("capacity", party["party_size"])
-        .order("capacity")
-        .limit(6)
-        .execute()
-        .data or []
-    )
-
+    # Tables the planner is holding for an upcoming reservation are skipped, so the
+    # candidate window is widened by that many rows.
+    held: set = set()
+    if _planner_active(entry_rid):
+        all_tables = supabase.table("tables").select("table_number,status,capacity").eq("restaurant_id", entry_rid).execute().data or []
+        held = _planner_held(_planner_plan_safe(entry_rid, all_tables), party["party_size"])
     table = None
+    candidates: list = []
+    if _tables_unique():
+        # One RPC picks and occupies the smallest fitting free table (FOR UPDATE SKIP LOCKED),
+        # skipping planner holds and tables seated in memory but not yet written back.
+        busy = {int(n) for n in _rstate(entry_rid).occupants_snapshot() if str(n).isdigit()}
+        rows = supabase.rpc("claim_next_table", {
+            "p_restaurant_id": entry_rid, "p_party_size": party["party_size"],
+            "p_exclude": sorted(held | busy),
+        }).execute().data or []
+        table = rows[0] if rows else None
+    else:
+        candidates = (
+            supabase.table("tables")
+            .select("*")
+            .eq("restaurant_id", entry_rid)
+            .eq("status", "available")
+            .gte("capacity", party["party_size"])
+            .order("capacity")
+            .limit(6 + len(held))
+            .execute()
+            .data or []
+        )
+
     for cand in candidates:
         # Also skip candidates already held in-memory but not yet reflected in DB
         tnum = cand.get("table_number")
-        if tnum is not None:
-            with _occupants_lock:
-                if f"{entry_rid}:{tnum}" in _table_occupants:
-                    continue
+        if tnum is not None and int(tnum) in held:
+            continue
+        if tnum is not None and _rstate(entry_rid).occupant(tnum) is not None:
+            continue
         claimed = _claim_table_for_occupying(cand["id"])
         if claimed:
             table = claimed
@@ -1836,7 +4294,7 @@ def seat_entry(entry_id: str):
         tnum = table.get("table_number")
         if tnum is not None:
             _record_seating(entry_rid, entry_id, table["id"], tnum,
-                            party.get("name") or "Guest", party.get("party_size", 2))
+                            party.get("name") or "Guest", party.get("party_size", 2), party)
         return {"status": "seated", "table": table}
 
     # No table could be claimed — entry stays "seated" per the existing contract
@@ -1849,6 +4307,10 @@ def seat_to_table(entry_id: str, table_id: str):
     """Seat an entry at a specific table (floor-map drag-and-drop + walk-in modal).
     Atomically claims both the entry (status='seated') AND the target table (status='occupied').
     If the table is already occupied, the entry-claim is released so it can be re-seated."""
+    if WRITE_BEHIND:
+        out = _wb_seat_to_table(entry_id, table_id)
+        if out is not None:
+            return out
     party = _claim_entry_for_seating(entry_id)
     rid = party.get("restaurant_id") or RESTAURANT_ID
 
@@ -1863,7 +4325,7 @@ def seat_to_table(entry_id: str, table_id: str):
     tnum = claimed_table.get("table_number")
     if tnum is not None:
         _record_seating(rid, entry_id, table_id, tnum,
-                        party.get("name") or "Guest", party.get("party_size", 2))
+                        party.get("name") or "Guest", party.get("party_size", 2), party)
     return {"status": "seated", "table_id": table_id}
 
 
@@ -1918,25 +4380,16 @@ def walkin_at_table(table_id: str, body: WalkinAtTableRequest):
             try:
                 ins = supabase.table("queue_entries").insert(retry_walkin).execute()
             except Exception as e2:
-                # Roll back the table claim — release all sibling rows so duplicates don't stay locked.
-                if tnum is not None:
-                    supabase.table("tables").update({"status": "available", "updated_at": _now()}).eq("restaurant_id", rid).eq("table_number", tnum).execute()
-                else:
-                    supabase.table("tables").update({"status": "available", "updated_at": _now()}).eq("id", table_id).execute()
+                # Roll back the table claim so the table doesn't stay locked.
+                _release_table(table_id, rid, tnum)
                 raise HTTPException(status_code=500, detail=f"walkin insert failed (retry): {e2}")
         else:
             # Non-schema error — roll back and surface.
-            if tnum is not None:
-                supabase.table("tables").update({"status": "available", "updated_at": _now()}).eq("restaurant_id", rid).eq("table_number", tnum).execute()
-            else:
-                supabase.table("tables").update({"status": "available", "updated_at": _now()}).eq("id", table_id).execute()
+            _release_table(table_id, rid, tnum)
             raise HTTPException(status_code=500, detail=f"walkin insert failed: {e}")
 
     if not ins.data:
-        if tnum is not None:
-            supabase.table("tables").update({"status": "available", "updated_at": _now()}).eq("restaurant_id", rid).eq("table_number", tnum).execute()
-        else:
-            supabase.table("tables").update({"status": "available", "updated_at": _now()}).eq("id", table_id).execute()
+        _release_table(table_id, rid, tnum)
         raise HTTPException(status_code=500, detail="walkin insert returned no data")
 
     entry = ins.data[0]
@@ -1952,7 +4405,7 @@ def _send_notify_sms(phone: str, rest_name: str, entry_id: str) -> None:
         to_phone=phone,
         body=f"Your table at {rest_name} is ready! Please head to the host stand. Reply STOP to opt out.",
     )
-    print(f"[notify] sms_sent={ok} sms_error={err!r}")
+    _log("notify").debug("sms_sent=%s sms_error=%r", ok, err)
 
 
 def _send_quote_sms(phone: str, name: str, rest_name: str, entry_id: str, minutes: int) -> None:
@@ -1962,7 +4415,7 @@ def _send_quote_sms(phone: str, name: str, rest_name: str, entry_id: str, minute
         to_phone=phone,
         body=f"Hi {name}! You're on the waitlist at {rest_name} — about {minutes} min wait. Track your spot: {track_url}\nReply STOP to opt out.",
     )
-    print(f"[quote-sms] sms_sent={ok} sms_error={err!r}")
+    _log("sms.quote").debug("sms_sent=%s sms_error=%r", ok, err)
 
 
 @app.post("/queue/{entry_id}/notify")
@@ -1976,7 +4429,7 @@ def notify_ready(entry_id: str):
     try:
         entry_res = supabase.table("queue_entries").select("phone, name, restaurant_id").eq("id", entry_id).execute()
         phone = entry_res.data[0].get("phone") if entry_res.data else None
-        print(f"[notify] entry={entry_id} phone={phone!r}")
+        _log("notify").debug("entry=%s phone=%s", entry_id, _mask_phone(phone))
         if phone:
             rid_used  = entry_res.data[0].get("restaurant_id") or RESTAURANT_ID
             rest_res  = supabase.table("restaurants").select("name").eq("id", rid_used).execute()
@@ -1985,12 +4438,12 @@ def notify_ready(entry_id: str):
                 to_phone=phone,
                 body=f"Your table at {rest_name} is ready! Please head to the host stand. Reply STOP to opt out.",
             )
-            print(f"[notify] sms_sent={sms_sent} sms_error={sms_error!r}")
+            _log("notify").debug("sms_sent=%s sms_error=%r", sms_sent, sms_error)
         else:
-            print(f"[notify] no phone on entry {entry_id}")
+            _log("notify").debug("no phone on entry %s", entry_id)
     except Exception as e:
         sms_error = str(e)
-        print(f"[notify] exception: {e}")
+        _log("notify").error(f"exception: {e}")
 
     return {"status": "notified", "sms_sent": sms_sent, "sms_error": sms_error or None}
 
@@ -2012,7 +4465,7 @@ def restore_entry(entry_id: str):
         "quoted_wait_set_at": None,
     }).eq("id", entry_id).execute()
     # Also clear the in-memory timer so remaining_wait returns None until re-quoted
-    _wait_set_at.pop(entry_id, None)
+    _rstate(res.data[0].get("restaurant_id")).wait_pop(entry_id)
     updated = supabase.table("queue_entries").select("*").eq("id", entry_id).execute()
     entry = updated.data[0] if updated.data else res.data[0]
     return {"status": "restored", "entry": entry}
@@ -2028,17 +4481,18 @@ def update_wait(entry_id: str, minutes: int):
         raise HTTPException(status_code=404, detail="Entry not found")
     entry = res.data[0]
     was_unquoted = entry.get("quoted_wait") is None
+    waits = _rstate(entry.get("restaurant_id"))
     now = _now()
     if was_unquoted:
         # First time quoting — reset the timer origin to now
-        _wait_set_at[entry_id] = now
+        waits.wait_set(entry_id, now)
         _set_quoted_wait(entry_id, minutes, now)
     else:
         # Re-quoting an already-quoted guest — keep the original wait_set_at so the
         # guest-side progress bar continues moving forward rather than resetting to 0.
-        existing_set_at = _wait_set_at.get(entry_id) or entry.get("quoted_wait_set_at") or now
+        existing_set_at = waits.wait_get(entry_id) or entry.get("quoted_wait_set_at") or now
         _set_quoted_wait(entry_id, minutes, existing_set_at)
-        # Do NOT update _wait_set_at — the original start time is the anchor
+        # Do NOT update the wait timer — the original start time is the anchor
     # Send tracking link SMS on first quote only
     sms_sent = False
     sms_error = ""
@@ -2054,17 +4508,18 @@ def update_wait(entry_id: str, minutes: int):
                 sms_sent = True
             except Exception as e:
                 sms_error = str(e)
-                print(f"[quote-sms] exception: {e}")
+                _log("sms.quote").error(f"exception: {e}")
     actual_set_at = now if was_unquoted else existing_set_at
     return {"status": "updated", "quoted_wait": minutes, "wait_set_at": actual_set_at, "sms_sent": sms_sent, "sms_error": sms_error}
 
 @app.patch("/queue/{entry_id}")
 def update_entry(entry_id: str, req: QueueUpdateRequest):
     """Update editable fields on a queue entry (party size, phone, quoted wait)."""
-    res = supabase.table("queue_entries").select("id, quoted_wait, quoted_wait_set_at").eq("id", entry_id).execute()
+    res = supabase.table("queue_entries").select("id, quoted_wait, quoted_wait_set_at, restaurant_id").eq("id", entry_id).execute()
     if not res.data:
         raise HTTPException(status_code=404, detail="Entry not found")
     existing_entry = res.data[0]
+    waits = _rstate(existing_entry.get("restaurant_id"))
     update: dict = {}
     qw_now: Optional[str] = None
     if req.quoted_wait is not None:
@@ -2072,11 +4527,11 @@ def update_entry(entry_id: str, req: QueueUpdateRequest):
         if was_unquoted:
             # First quote — reset timer origin to now
             qw_now = _now()
-            _wait_set_at[entry_id] = qw_now
+            waits.wait_set(entry_id, qw_now)
         else:
             # Re-quote — keep original start time so progress bar keeps moving forward
-            qw_now = _wait_set_at.get(entry_id) or existing_entry.get("quoted_wait_set_at") or _now()
-            # Do NOT update _wait_set_at
+            qw_now = waits.wait_get(entry_id) or existing_entry.get("quoted_wait_set_at") or _now()
+            # Do NOT update the wait timer
         # quoted_wait + quoted_wait_set_at handled below via _set_quoted_wait
     if req.party_size is not None:
         update["party_size"] = req.party_size
@@ -2117,15 +4572,14 @@ def get_sections_config(restaurant_id: str):
                 except: raw = {}
             settings = raw if isinstance(raw, dict) else {}
             return settings.get("sections_config", {"enabled": False, "sections": []})
-        print(f"[sections GET] no restaurant_configs row for rid={restaurant_id!r}")
+        _log("sections.get").debug("no restaurant_configs row for rid=%r", restaurant_id)
     except Exception as e:
-        print(f"[sections GET] error rid={restaurant_id!r}: {e}")
+        _log("sections.get").warning(f"error rid={restaurant_id!r}: {e}")
     return {"enabled": False, "sections": []}
 
 @app.post("/sections")
 def set_sections_config(restaurant_id: str, req: SectionsConfigRequest):
     """Persist sections config for a restaurant (stored in restaurant_configs.settings JSON)."""
-    import sys as _sys2
     try:
         res = supabase.table("restaurant_configs").select("id, settings").eq("restaurant_id", restaurant_id).limit(1).execute()
         if res.data:
@@ -2137,15 +4591,17 @@ def set_sections_config(restaurant_id: str, req: SectionsConfigRequest):
             settings["sections_config"] = {"enabled": req.enabled, "sections": req.sections}
             new_settings_str = _json.dumps(settings)
             update_res = supabase.table("restaurant_configs").update({"settings": new_settings_str}).eq("restaurant_id", restaurant_id).execute()
-            print(f"[sections POST] UPDATE rid={restaurant_id!r} enabled={req.enabled} sections={req.sections} rows_affected={len(update_res.data or [])}", file=_sys2.stderr)
+            _log("sections.post").debug("UPDATE rid=%r enabled=%s sections=%s rows_affected=%d",
+                                        restaurant_id, req.enabled, req.sections, len(update_res.data or []))
         else:
             settings = {"sections_config": {"enabled": req.enabled, "sections": req.sections}}
             insert_res = supabase.table("restaurant_configs").insert({"restaurant_id": restaurant_id, "settings": _json.dumps(settings)}).execute()
-            print(f"[sections POST] INSERT rid={restaurant_id!r} enabled={req.enabled} sections={req.sections} rows={len(insert_res.data or [])}", file=_sys2.stderr)
+            _log("sections.post").debug("INSERT rid=%r enabled=%s sections=%s rows=%d",
+                                        restaurant_id, req.enabled, req.sections, len(insert_res.data or []))
         # Return the just-saved config so the client can verify it round-tripped correctly
         return {"ok": True, "saved": {"enabled": req.enabled, "sections": req.sections}}
     except Exception as e:
-        print(f"[sections POST] EXCEPTION rid={restaurant_id!r}: {e}", file=_sys2.stderr)
+        _log("sections.post").error(f"EXCEPTION rid={restaurant_id!r}: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 # ── Insights ─────────────────────────────────────────────────────────────────
@@ -2160,6 +4616,11 @@ def get_insights(restaurant_id: Optional[str] = None):
         available   = sum(1 for t in tables if t["status"] == "available")
         occupied    = len(tables) - available
         waiting     = len([q for q in queue if q["status"] == "waiting"])
+        held        = _planner_held(_planner_plan_safe(rid, tables), 2)
+        est         = _wait_estimate_with(waiting, 2, tables, held, _live_signals(rid))
+        features    = _insight_features(rid, tables, queue, held, est)
+        findings    = _rule_insights(features)
+        insight     = _insights_for(rid, features, findings)
 
         return {
             "tables_total":         len(tables),
@@ -2167,38 +4628,532 @@ def get_insights(restaurant_id: Optional[str] = None):
             "tables_occupied":      occupied,
             "parties_waiting":      waiting,
             "parties_ready":        len(queue) - waiting,
-            "avg_wait_estimate":    _wait_estimate(waiting, rid=rid),
+            "avg_wait_estimate":    est,
             "capacity_utilization": round(occupied / len(tables) * 100) if tables else 0,
-            "ai_insights":          _ai_insights(tables, queue),
+            "ai_insights":          insight["text"] or ("\n".join(findings) or None),
+            "ai_insights_at":       insight["updated_at"],
+            "ai_insights_pending":  insight["refreshing"],
+            "insights_source":      "ai" if insight["text"] else "rules",
+            "rule_insights":        findings,
         }
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 # ── Event ingestion ───────────────────────────────────────────────────────────
+# Sensors (door cameras, delivery tablets, POS) post often — a camera can send a
+# people count every second per zone — so events are never written one row per
+# request. Every endpoint appends to an in-memory buffer that a background
+# thread drains into bulk inserts once EVENT_FLUSH_ROWS rows are waiting or
+# EVENT_FLUSH_INTERVAL_SEC has passed. When the buffer is full (DB down or too
+# slow) new events get a 429 with Retry-After instead of piling up in memory.
+# Accepted events are also folded into the in-memory rollups (see Event rollups).
+EVENT_FLUSH_ROWS         = int(os.environ.get("EVENT_FLUSH_ROWS", "500"))
+EVENT_FLUSH_INTERVAL_SEC = float(os.environ.get("EVENT_FLUSH_INTERVAL_SEC", "2"))
+EVENT_BUFFER_MAX         = int(os.environ.get("EVENT_BUFFER_MAX", "20000"))
+EVENT_BATCH_MAX          = 1000   # events per request
+
+# stream → (table, key column, value column)
+_EVENT_STREAMS = {
+    "camera":     ("camera_events",     "zone",     "people_count"),
+    "delivery":   ("delivery_events",   "provider", "active_orders"),
+    "throughput": ("throughput_events", "metric",   "value"),
+}
+
+_event_buffer: dict = {s: [] for s in _EVENT_STREAMS}   # { stream: [row] }
+_event_buffered     = 0
+_event_cond         = threading.Condition()
+_event_stats: dict  = {"accepted": 0, "written": 0, "rejected": 0, "dropped": 0, "flushes": 0, "last_error": None}
+
+
+def _event_ts(ts: Optional[str]) -> datetime:
+    """Client timestamp (ISO, naive = UTC) or now. Future timestamps are clamped to now."""
+    now = datetime.now(timezone.utc)
+    if not ts:
+        return now
+    try:
+        dt = datetime.fromisoformat(ts.replace("Z", "+00:00"))
+    except ValueError:
+        return now
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return min(dt, now)
+
+
+def _event_enqueue(rid: str, events: list) -> int:
+    """events: [(stream, key, value, extra_cols, ts)]. All-or-nothing — raises 429 if the buffer is full."""
+    global _event_buffered
+    rows = []
+    for stream, key, value, extra, ts in events:
+        _table, key_col, val_col = _EVENT_STREAMS[stream]
+        at = _event_ts(ts)
+        rows.append((stream, key, value, at, {"restaurant_id": rid, key_col: key, val_col: value,
+                                              "created_at": at.isoformat(), **extra}))
+    with _event_cond:
+        if _event_buffered + len(rows) > EVENT_BUFFER_MAX:
+            _event_stats["rejected"] += len(rows)
+            raise HTTPException(status_code=429, detail="Event buffer full — retry shortly",
+                                headers={"Retry-After": str(max(1, int(EVENT_FLUSH_INTERVAL_SEC * 2)))})
+        for stream, _key, _value, _at, row in rows:
+            _event_buffer[stream].append(row)
+        _event_buffered += len(rows)
+        _event_stats["accepted"] += len(rows)
+        if _event_buffered >= EVENT_FLUSH_ROWS:
+            _event_cond.notify()
+    for stream, key, value, at, _row in rows:
+        _rollup_add(rid, f"{stream}.{key}", float(value), at.timestamp())
+    return len(rows)
+
+
+def _event_flush() -> bool:
+    """Drain the buffer into bulk inserts. Failed batches go back to the front if there's room.
+    Returns False if any insert failed."""
+    global _event_buffered
+    ok = True
+    with _event_cond:
+        pending = {s: rows for s, rows in _event_buffer.items() if rows}
+        for s in pending:
+            _event_buffer[s] = []
+        _event_buffered = 0
+    for stream, rows in pending.items():
+        table = _EVENT_STREAMS[stream][0]
+        for i in range(0, len(rows), EVENT_FLUSH_ROWS):
+            chunk = rows[i:i + EVENT_FLUSH_ROWS]
+            try:
+                supabase.table(table).insert(chunk).execute()
+                with _event_cond:
+                    _event_stats["written"] += len(chunk)
+                    _event_stats["flushes"] += 1
+            except Exception as e:
+                retry = rows[i:]
+                with _event_cond:
+                    _event_stats["last_error"] = f"{table}: {e}"
+                    room = max(0, EVENT_BUFFER_MAX - _event_buffered)
+                    _event_buffer[stream][:0] = retry[:room]
+                    _event_buffered += min(room, len(retry))
+                    _event_stats["dropped"] += max(0, len(retry) - room)
+                _log("events").warning(f"flush to {table} failed ({len(retry)} rows requeued/dropped): {e}")
+                ok = False
+                break
+    return ok
+
+
+def _event_flusher_loop():
+    backoff = 0.0
+    while True:
+        with _event_cond:
+            _event_cond.wait_for(lambda: _event_buffered >= EVENT_FLUSH_ROWS, timeout=EVENT_FLUSH_INTERVAL_SEC)
+            due = _event_buffered > 0
+        if due and not _event_flush():
+            # DB unavailable — back off (up to 30s) while the buffer fills and 429s shed load
+            backoff = min(30.0, backoff * 2 or EVENT_FLUSH_INTERVAL_SEC)
+            time.sleep(backoff)
+        elif due:
+            backoff = 0.0
+
+
+_background(_event_flusher_loop)
+
+atexit.register(_event_flush)   # best effort: don't lose the last couple of seconds on deploy
+
+
+class EventBatchRequest(BaseModel):
+    camera:        List[CameraEventRequest]     = []
+    delivery:      List[DeliveryEventRequest]   = []
+    throughput:    List[ThroughputEventRequest] = []
+    restaurant_id: Optional[str] = None  # override env RESTAURANT_ID (per-event restaurant_id wins)
+
 
 @app.post("/events/camera")
 def log_camera(req: CameraEventRequest):
-    try:
-        supabase.table("camera_events").insert({"restaurant_id": RESTAURANT_ID, "zone": req.zone, "people_count": req.people_count}).execute()
-        return {"status": "logged"}
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Failed to log camera event: {e}")
+    _event_enqueue(_rid(req.restaurant_id), [("camera", req.zone, req.people_count, {}, req.ts)])
+    return {"status": "logged"}
 
 @app.post("/events/delivery")
 def log_delivery(req: DeliveryEventRequest):
-    try:
-        supabase.table("delivery_events").insert({"restaurant_id": RESTAURANT_ID, "provider": req.provider, "active_orders": req.active_orders}).execute()
-        return {"status": "logged"}
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Failed to log delivery event: {e}")
+    _event_enqueue(_rid(req.restaurant_id), [("delivery", req.provider, req.active_orders, {}, req.ts)])
+    return {"status": "logged"}
 
 @app.post("/events/throughput")
 def log_throughput(req: ThroughputEventRequest):
-    try:
-        supabase.table("throughput_events").insert({"restaurant_id": RESTAURANT_ID, "metric": req.metric, "value": req.value, "metadata": req.metadata}).execute()
-        return {"status": "logged"}
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Failed to log throughput event: {e}")
+    _event_enqueue(_rid(req.restaurant_id), [("throughput", req.metric, req.value, {"metadata": req.metadata}, req.ts)])
+    return {"status": "logged"}
+
+@app.post("/events/batch")
+def log_events_batch(req: EventBatchRequest):
+    """Bulk ingest for sensors: {camera: [...], delivery: [...], throughput: [...]}.
+    Accepted events are buffered and bulk-inserted within EVENT_FLUSH_INTERVAL_SEC."""
+    total = len(req.camera) + len(req.delivery) + len(req.throughput)
+    if total > EVENT_BATCH_MAX:
+        raise HTTPException(status_code=413, detail=f"At most {EVENT_BATCH_MAX} events per batch")
+    by_rid: dict = {}
+    for e in req.camera:
+        by_rid.setdefault(_rid(e.restaurant_id or req.restaurant_id), []).append(("camera", e.zone, e.people_count, {}, e.ts))
+    for e in req.delivery:
+        by_rid.setdefault(_rid(e.restaurant_id or req.restaurant_id), []).append(("delivery", e.provider, e.active_orders, {}, e.ts))
+    for e in req.throughput:
+        by_rid.setdefault(_rid(e.restaurant_id or req.restaurant_id), []).append(("throughput", e.metric, e.value, {"metadata": e.metadata}, e.ts))
+    accepted = sum(_event_enqueue(rid, events) for rid, events in by_rid.items())
+    return {"status": "queued", "accepted": accepted}
+
+@app.get("/events/ingest-status")
+def events_ingest_status():
+    """Buffer depth and flush counters for the event ingestion pipeline."""
+    with _event_cond:
+        return {"buffered": _event_buffered, "buffer_max": EVENT_BUFFER_MAX, **_event_stats}
+
+# ── Event rollups ─────────────────────────────────────────────────────────────
+# Every ingested event is folded into per-restaurant, per-metric ring buffers at
+# three resolutions (1m × 6h, 15m × 24h, 1h × 7d). Each ring is a handful of flat
+# arrays indexed by bucket number mod size, so memory is fixed and reads never
+# touch the DB. What each ring added since the last save is merged into
+# event_rollups every ROLLUP_PERSIST_SEC (migration 009 adds the counts, so
+# workers sharing a bucket don't overwrite each other) and reloaded on boot.
+# Metrics are named "<stream>.<key>", e.g. camera.lobby, delivery.doordash,
+# throughput.covers.
+ROLLUP_PERSIST_SEC = int(os.environ.get("ROLLUP_PERSIST_SEC", "300"))
+_ROLLUP_RES = (("1m", 60, 360), ("15m", 900, 96), ("1h", 3600, 168))   # (name, seconds, slots)
+
+# Camera zones that count people waiting to be seated, and the delivery load
+# (open orders across providers) at which the kitchen is treated as slammed.
+_LOBBY_ZONES           = ("lobby", "door", "entrance", "entry", "waiting")
+SIGNAL_MAX_AGE_SEC     = int(os.environ.get("SIGNAL_MAX_AGE_SEC", "300"))
+DELIVERY_BUSY_ORDERS   = int(os.environ.get("DELIVERY_BUSY_ORDERS", "8"))
+
+
+class _Ring:
+    """Fixed-size bucketed aggregate: count/sum/min/max/last per bucket, array-backed."""
+    __slots__ = ("res", "size", "epoch", "count", "sum", "min", "max", "last", "pending")
+
+    def __init__(self, res: int, size: int):
+        from array import array
+        self.res   = res
+        self.size  = size
+        self.epoch = array("q", [-1]) * size   # bucket number held in each slot
+        self.count = array("l", [0]) * size
+        self.sum   = array("d", [0.0]) * size
+        self.min   = array("d", [0.0]) * size
+        self.max   = array("d", [0.0]) * size
+        self.last  = array("d", [0.0]) * size
+        self.pending = {}                      # bucket → [count, sum, min, max, last] added since the last persist
+
+    def add(self, ts: float, value: float):
+        b = int(ts) // self.res
+        i = b % self.size
+        if self.epoch[i] != b:
+            if self.epoch[i] > b:
+                return   # older than the ring holds
+            self.epoch[i], self.count[i], self.sum[i] = b, 0, 0.0
+            self.min[i] = self.max[i] = value
+        self.count[i] += 1
+        self.sum[i]   += value
+        if value < self.min[i]:
+            self.min[i] = value
+        if value > self.max[i]:
+            self.max[i] = value
+        self.last[i] = value
+        d = self.pending.get(b)
+        if d is None:
+            self.pending[b] = [1, value, value, value, value]
+        else:
+            d[0] += 1
+            d[1] += value
+            d[2], d[3], d[4] = min(d[2], value), max(d[3], value), value
+
+    def requeue(self, b: int, delta: list):
+        """Put back a delta that failed to save, under anything added since."""
+        d = self.pending.get(b)
+        if d is None:
+            self.pending[b] = delta
+        else:
+            d[0] += delta[0]
+            d[1] += delta[1]
+            d[2], d[3] = min(d[2], delta[2]), max(d[3], delta[3])
+
+    def load(self, b: int, count: int, total: float, lo: float, hi: float, last: float):
+        i = b % self.size
+        if self.epoch[i] > b:
+            return
+        if self.epoch[i] == b:   # live events already landed in this bucket since boot
+            self.count[i] += count
+            self.sum[i]   += total
+            self.min[i]    = min(self.min[i], lo)
+            self.max[i]    = max(self.max[i], hi)
+            return
+        self.epoch[i], self.count[i], self.sum[i] = b, count, total
+        self.min[i], self.max[i], self.last[i] = lo, hi, last
+
+    def bucket(self, b: int) -> Optional[tuple]:
+        i = b % self.size
+        if self.epoch[i] != b or not self.count[i]:
+            return None
+        return (self.count[i], self.sum[i], self.min[i], self.max[i], self.last[i])
+
+    def points(self, until: float, n: int) -> list:
+        end = int(until) // self.res
+        out = []
+        for b in range(end - min(n, self.size) + 1, end + 1):
+            v = self.bucket(b)
+            if v:
+                c, s, lo, hi, last = v
+                out.append({"at": datetime.fromtimestamp(b * self.res, timezone.utc).isoformat(),
+                            "count": c, "avg": round(s / c, 2), "min": lo, "max": hi, "last": last})
+        return out
+
+
+_rollups: dict = {}   # { (rid, metric): {"1m": _Ring, "15m": _Ring, "1h": _Ring, "last": float, "last_at": float} }
+_rollups_lock  = threading.Lock()
+
+
+def _rollup_entry(rid: str, metric: str) -> dict:
+    """Caller holds _rollups_lock."""
+    e = _rollups.get((rid, metric))
+    if e is None:
+        e = _rollups[(rid, metric)] = {name: _Ring(sec, slots) for name, sec, slots in _ROLLUP_RES}
+        e["last"], e["last_at"] = 0.0, 0.0
+    return e
+
+
+def _rollup_add(rid: str, metric: str, value: float, ts: float):
+    with _rollups_lock:
+        e = _rollup_entry(rid, metric)
+        for name, _sec, _slots in _ROLLUP_RES:
+            e[name].add(ts, value)
+        if ts >= e["last_at"]:
+            e["last"], e["last_at"] = value, ts
+
+
+def _rollup_latest(rid: str, prefix: str, max_age: float) -> dict:
+    """{metric: last value} for metrics under prefix (e.g. "camera.") reported within max_age seconds."""
+    cutoff = time.time() - max_age
+    with _rollups_lock:
+        return {m: e["last"] for (r, m), e in _rollups.items()
+                if r == rid and m.startswith(prefix) and e["last_at"] >= cutoff}
+
+
+_rollup_merge = {"ready": True}   # False once merge_event_rollups turns out to be missing
+
+
+def _rollup_persist():
+    """Merge what each ring added since the last run into event_rollups. Deltas that fail
+    to save are queued again, so the next run retries them."""
+    rows, keys = [], []   # keys[i] = (ring, bucket, delta) behind rows[i]
+    with _rollups_lock:
+        for (rid, metric), e in _rollups.items():
+            for name, sec, _slots in _ROLLUP_RES:
+                ring = e[name]
+                for b, (c, s, lo, hi, last) in ring.pending.items():
+                    rows.append({
+                        "restaurant_id": rid, "metric": metric, "resolution": name,
+                        "bucket_start":  datetime.fromtimestamp(b * sec, timezone.utc).isoformat(),
+                        "count": c, "sum": s, "min": lo, "max": hi, "last": last,
+                    })
+                    keys.append((ring, b, [c, s, lo, hi, last]))
+                ring.pending = {}
+    for i in range(0, len(rows), 500):
+        try:
+            _rollup_write(rows[i:i + 500], keys[i:i + 500])
+        except Exception as e:
+            _log("rollups").warning(f"persist failed ({len(rows) - i} buckets not saved, will retry): {e}")
+            with _rollups_lock:
+                for ring, b, delta in keys[i:]:
+                    ring.requeue(b, delta)
+            return
+
+
+def _rollup_write(rows: list, keys: list):
+    if _rollup_merge["ready"]:
+        try:
+            supabase.rpc("merge_event_rollups", {"p_rows": rows}).execute()
+            return
+        except APIError as e:
+            if e.code != "PGRST202":
+                raise
+            _rollup_merge["ready"] = False
+            _log("rollups").warning("merge_event_rollups missing (migration 009) — saving whole buckets, "
+                                    "which undercounts with more than one worker")
+    # Pre-009 fallback: this worker's whole bucket, as loaded on boot plus what it saw since
+    with _rollups_lock:
+        for row, (ring, b, _delta) in zip(rows, keys):
+            v = ring.bucket(b)
+            if v:
+                row.update(count=v[0], sum=v[1], min=v[2], max=v[3], last=v[4])
+    supabase.table("event_rollups").upsert(
+        rows, on_conflict="restaurant_id,metric,resolution,bucket_start"
+    ).execute()
+
+
+def _rollup_restore():
+    """Warm the rings from event_rollups so a restart keeps the last hours/days of series."""
+    now = time.time()
+    loaded = 0
+    for name, sec, slots in _ROLLUP_RES:
+        since = datetime.fromtimestamp(now - sec * slots, timezone.utc).isoformat()
+        offset = 0
+        while True:
+            try:
+                res = (supabase.table("event_rollups")
+                       .select("restaurant_id,metric,bucket_start,count,sum,min,max,last")
+                       .eq("resolution", name).gte("bucket_start", since)
+                       .order("bucket_start").range(offset, offset + 999).execute())
+            except Exception as e:
+                _log("rollups").warning(f"restore {name} failed: {e}")
+                return
+            batch = res.data or []
+            with _rollups_lock:
+                for r in batch:
+                    b = int(datetime.fromisoformat(r["bucket_start"].replace("Z", "+00:00")).timestamp()) // sec
+                    _rollup_entry(r["restaurant_id"], r["metric"])[name].load(
+                        b, int(r["count"]), float(r["sum"]), float(r["min"]), float(r["max"]), float(r["last"]))
+            loaded += len(batch)
+            if len(batch) < 1000:
+                break
+            offset += 1000
+    _log("rollups").info(f"restored {loaded} buckets")
+
+
+def _rollup_loop():
+    _rollup_restore()
+    while True:
+        time.sleep(ROLLUP_PERSIST_SEC)
+        _rollup_persist()
+
+
+_background(_rollup_loop)
+atexit.register(_rollup_persist)
+
+
+# ── Camera crowd fusion ───────────────────────────────────────────────────────
+# Turns the camera rollups into the signals the wait estimator uses. Readings
+# are smoothed with an EWMA over the last few 1-minute buckets, so one noisy
+# frame can't swing a quote. Two derived signals come out of this:
+#   lobby_people   people at the door. For a newcomer's quote, anyone beyond the
+#                  listed parties is a walk-in who will be ahead of them.
+#   dining_people  people on the floor. Compared against tables.status, this
+#                  catches tables seated but not marked, or already emptied.
+# Walk-aways: when the lobby shrinks by at least a party's worth over
+# WALKAWAY_WINDOW_MIN while the waiting count hasn't fallen, the difference is
+# reported as parties that probably left. All of this reads memory only.
+_DINING_ZONES       = ("dining", "floor", "room", "patio", "bar", "seating")
+_PEOPLE_PER_PARTY   = 2.5
+_SEAT_FILL          = 0.75   # typical share of a table's seats in use (2 at a 4-top, …)
+WALKAWAY_WINDOW_MIN = int(os.environ.get("WALKAWAY_WINDOW_MIN", "10"))
+
+_queue_hist: dict = {}   # { rid: {minute_epoch: waiting_count} } — last WALKAWAY_WINDOW_MIN+1 minutes
+_queue_hist_lock  = threading.Lock()
+
+
+_ZONE_TOKEN_RE = re.compile(r"[_\-\s]+")
+
+
+def _zone_matches(name: str, zones: tuple) -> bool:
+    """Whole-token match, so "front_door" is a lobby zone but "outdoor" and "restroom" are not."""
+    return any(t in zones for t in _ZONE_TOKEN_RE.split(name.lower()))
+
+
+def _zone_minutes(rid: str, zones: tuple, minutes: int) -> list:
+    """Per-minute people count summed across matching camera zones, oldest first; None where no reading."""
+    now_b = int(time.time()) // 60
+    out: list = [None] * minutes
+    with _rollups_lock:
+        for (r, m), e in _rollups.items():
+            if r != rid or not m.startswith("camera.") or not _zone_matches(m[7:], zones):
+                continue
+            ring = e["1m"]
+            for k in range(minutes):
+                v = ring.bucket(now_b - minutes + 1 + k)
+                if v:
+                    out[k] = (out[k] or 0.0) + v[1] / v[0]
+    return out
+
+
+def _ewma(series: list, alpha: float = 0.5) -> Optional[float]:
+    s = None
+    for v in series:
+        if v is not None:
+            s = v if s is None else alpha * v + (1 - alpha) * s
+    return s
+
+
+def _zone_smoothed(rid: str, zones: tuple) -> Optional[float]:
+    window = max(1, SIGNAL_MAX_AGE_SEC // 60)
+    return _ewma(_zone_minutes(rid, zones, window))
+
+
+def _live_signals(rid: str, listed: bool = False) -> dict:
+    """Current crowd and delivery-load readings from the rollups — no DB access.
+    listed=True is for parties already on the list: walk-ins at the door will join
+    behind them, so the lobby count is left out."""
+    lobby  = None if listed else _zone_smoothed(rid, _LOBBY_ZONES)
+    dining = _zone_smoothed(rid, _DINING_ZONES)
+    deliv  = _rollup_latest(rid, "delivery.", SIGNAL_MAX_AGE_SEC * 2)
+    return {
+        "lobby_people":    round(lobby) if lobby is not None else None,
+        "dining_people":   round(dining) if dining is not None else None,
+        "delivery_orders": int(sum(deliv.values())) if deliv else None,
+    }
+
+
+def _dining_adjust(tables: list, available: list, dining_people: Optional[float]) -> tuple:
+    """Reconcile the dining camera with tables.status.
+
+    Returns (open tables to ignore, wait multiplier). More people on the floor
+    than the occupied tables explain means some "available" tables are actually
+    sat; far fewer means parties have left and tables are about to turn.
+    """
+    if dining_people is None or not tables:
+        return 0, 1.0
+    occupied_seats = sum(t["capacity"] for t in tables if t["status"] != "available")
+    expected       = occupied_seats * _SEAT_FILL
+    surplus        = dining_people - expected
+    if surplus >= 4 and available:
+        avg_cap = sum(t["capacity"] for t in available) / len(available)
+        return min(len(available), round(surplus / max(1.0, avg_cap * _SEAT_FILL))), 1.0
+    if expected >= 8 and dining_people < expected * 0.6:
+        return 0, 0.8
+    return 0, 1.0
+
+
+def _walkaway_check(rid: str, waiting: int) -> Optional[dict]:
+    """Record the waiting count for this minute and compare the lobby trend against it."""
+    now_b = int(time.time()) // 60
+    with _queue_hist_lock:
+        hist = _queue_hist.setdefault(rid, {})
+        hist[now_b] = waiting
+        for m in [m for m in hist if m < now_b - WALKAWAY_WINDOW_MIN]:
+            del hist[m]
+        then_waiting = hist.get(now_b - WALKAWAY_WINDOW_MIN)
+    if then_waiting is None:
+        return None
+    series = _zone_minutes(rid, _LOBBY_ZONES, WALKAWAY_WINDOW_MIN + 1)
+    before, after = _ewma(series[:3]), _ewma(series[-3:])
+    if before is None or after is None:
+        return None
+    lobby_drop   = before - after
+    queue_drop   = max(0, then_waiting - waiting)
+    unexplained  = lobby_drop / _PEOPLE_PER_PARTY - queue_drop
+    if unexplained < 1:
+        return None
+    return {"parties": int(unexplained), "lobby_drop": round(lobby_drop, 1),
+            "window_min": WALKAWAY_WINDOW_MIN}
+
+
+@app.get("/events/series")
+def events_series(metric: Optional[str] = None, bucket: str = "1m", points: int = 60,
+                  restaurant_id: Optional[str] = None):
+    """Aggregated series for one metric ("<stream>.<key>", e.g. camera.lobby) at 1m, 15m or 1h
+    resolution; each point has count/avg/min/max/last. Omit metric to list what's tracked."""
+    rid = _rid(restaurant_id)
+    if metric is None:
+        with _rollups_lock:
+            metrics = sorted(m for (r, m) in _rollups if r == rid)
+        return {"restaurant_id": rid, "metrics": metrics, "signals": _live_signals(rid)}
+    if bucket not in {name for name, _sec, _slots in _ROLLUP_RES}:
+        raise HTTPException(status_code=400, detail="bucket must be 1m, 15m or 1h")
+    with _rollups_lock:
+        e = _rollups.get((rid, metric))
+        pts = e[bucket].points(time.time(), max(1, points)) if e else []
+    return {"restaurant_id": rid, "metric": metric, "bucket": bucket, "points": pts}
+
 
 # ── Required DB migration (run once in Supabase SQL editor) ──────────────────
 #
@@ -2265,6 +5220,7 @@ def create_reservation(req: ReservationRequest):
             "status":        "confirmed",
             "created_at":    _now(),
         }).execute()
+        _on_reservations_written(_rid(req.restaurant_id), data.data)
         return {"status": "created", "reservation": data.data[0]}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -2282,6 +5238,7 @@ def update_reservation(res_id: str, req: ReservationRequest):
             "notes":      req.notes,
             "source":     req.source or "host",
         }).eq("id", res_id).execute()
+        _on_reservations_written(None, data.data)
         return {"status": "updated", "reservation": data.data[0] if data.data else {}}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -2306,6 +5263,7 @@ def patch_reservation(res_id: str, body: PatchReservationRequest):
         return {"status": "no-op"}
     try:
         data = supabase.table("reservations").update(payload).eq("id", res_id).execute()
+        _on_reservations_written(None, data.data)
         return {"status": "updated", "reservation": data.data[0] if data.data else {}}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -2313,7 +5271,8 @@ def patch_reservation(res_id: str, body: PatchReservationRequest):
 @app.patch("/reservations/{res_id}/status")
 def update_reservation_status(res_id: str, status: str):
     try:
-        supabase.table("reservations").update({"status": status}).eq("id", res_id).execute()
+        data = supabase.table("reservations").update({"status": status}).eq("id", res_id).execute()
+        _on_reservations_written(None, data.data)
         return {"status": "updated"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -2321,60 +5280,534 @@ def update_reservation_status(res_id: str, status: str):
 @app.delete("/reservations/{res_id}")
 def delete_reservation(res_id: str):
     try:
-        supabase.table("reservations").delete().eq("id", res_id).execute()
+        data = supabase.table("reservations").delete().eq("id", res_id).execute()
+        _on_reservations_written(None, data.data, deleted=True)
         return {"status": "deleted"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.get("/reservations.ics")
-def export_ical():
-    """Export all reservations as an iCal feed (subscribe from Apple/Google Calendar)."""
+# ── Reservation time index ───────────────────────────────────────────────────
+#
+# Per-restaurant, per-day list of live reservations sorted by (minute-of-day, id),
+# so the station's "upcoming / late / arriving" views are a bisect instead of a
+# full-day fetch + client-side filter. A day is loaded from the DB on first use;
+# after that every reservation write route patches it in place through
+# _on_reservations_written, bumping the day's version. Responses carry that
+# version as an ETag so unchanged polls get a 304. Days are reloaded after
+# RES_INDEX_MAX_AGE_SEC to pick up edits made straight in Supabase.
+#
+# Versions come from one counter per restaurant, so a day that is evicted and
+# loaded again never reuses an ETag. A load reads the DB without the lock; if a
+# write for the restaurant lands meanwhile, the result may predate it and the
+# day is read again rather than installed over the patched bucket.
+
+RES_INDEX_MAX_AGE_SEC = int(os.environ.get("RES_INDEX_MAX_AGE_SEC", "600"))
+
+_res_index: dict = {}     # { rid: { day: {"keys": [(min, id)], "rows": [row], "version": int, "loaded_at": float} } }
+_res_index_lock  = threading.Lock()
+_res_index_seq:    dict = {}   # rid → last version handed out for any of its days
+_res_index_writes: dict = {}   # rid (or "*" for every restaurant) → writes seen so far
+
+def _res_minute(t) -> int:
     try:
-        from icalendar import Calendar, Event as ICalEvent
-        import uuid as uuid_lib
+        hh, mm = str(t)[:5].split(":")
+        return int(hh) * 60 + int(mm)
+    except Exception:
+        return 0
 
+def _res_index_next_version(rid: str) -> int:
+    """Caller holds _res_index_lock."""
+    _res_index_seq[rid] = _res_index_seq.get(rid, 0) + 1
+    return _res_index_seq[rid]
+
+def _res_index_day(rid: str, day: str) -> dict:
+    """Return the index bucket for (rid, day), loading it from the DB if needed."""
+    for attempt in range(3):
+        with _res_index_lock:
+            bucket = _res_index.get(rid, {}).get(day)
+            if bucket and time.time() - bucket["loaded_at"] < RES_INDEX_MAX_AGE_SEC:
+                return bucket
+            writes = (_res_index_writes.get(rid, 0), _res_index_writes.get("*", 0))
         rows = (
             supabase.table("reservations")
             .select("*")
-            .eq("restaurant_id", RESTAURANT_ID)
+            .eq("restaurant_id", rid)
+            .eq("date", day)
             .neq("status", "cancelled")
-            .order("date").order("time")
             .execute()
-            .data
+            .data or []
         )
+        with _res_index_lock:
+            raced = writes != (_res_index_writes.get(rid, 0), _res_index_writes.get("*", 0))
+        if not raced or attempt == 2:
+            break
+    pairs = sorted(((_res_minute(r.get("time")), str(r.get("id"))), r) for r in rows)
+    fresh = {
+        "keys":      [k for k, _ in pairs],
+        "rows":      [r for _, r in pairs],
+        "version":   0,
+        # Still racing after three reads (a sync storm): serve it, but reload next time
+        "loaded_at": 0.0 if raced else time.time(),
+    }
+    with _res_index_lock:
+        fresh["version"] = _res_index_next_version(rid)
+        _res_index.setdefault(rid, {})[day] = fresh
+        # Keep only a few days per restaurant — the station only asks about today
+        days = _res_index[rid]
+        for old in sorted(days)[:-3]:
+            del days[old]
+    return fresh
+
+def _res_index_apply(rid: str, row: dict, deleted: bool) -> None:
+    """Patch one written row into every loaded day bucket for rid."""
+    import bisect
+    rid_days = _res_index.get(rid)
+    if not rid_days:
+        return
+    row_id = str(row.get("id"))
+    for day, bucket in rid_days.items():
+        # Drop the old copy wherever it was (the date or time may have moved)
+        for i, r in enumerate(bucket["rows"]):
+            if str(r.get("id")) == row_id:
+                del bucket["rows"][i]
+                del bucket["keys"][i]
+                bucket["version"] = _res_index_next_version(rid)
+                break
+        if deleted or row.get("status") == "cancelled" or row.get("date") != day:
+            continue
+        key = (_res_minute(row.get("time")), row_id)
+        at  = bisect.bisect_left(bucket["keys"], key)
+        bucket["keys"].insert(at, key)
+        bucket["rows"].insert(at, row)
+        bucket["version"] = _res_index_next_version(rid)
+
+def _on_reservations_written(rid: Optional[str], rows: Optional[list], deleted: bool = False) -> None:
+    """Hook called by every reservation write path (CRUD routes + iCal sync).
+    rid may be None when the route only knew the row id — it's then taken from the
+    returned rows; with nothing to go on, every restaurant's derived state is dropped."""
+    rids = {r.get("restaurant_id") for r in (rows or []) if r.get("restaurant_id")}
+    if rid:
+        rids.add(rid)
+    with _ical_export_lock:
+        _ical_note_writes(rids)
+        if not rids:
+            _ical_export_cache.clear()
+        for r in rids:
+            _ical_export_cache.pop(r, None)
+    with _res_index_lock:
+        _res_index_note_writes(rids)
+        if not rids:
+            _res_index.clear()
+        for r in rows or []:
+            if r.get("id") is not None:
+                _res_index_apply(r.get("restaurant_id") or rid, r, deleted)
+    _state_publish("reservations", data=sorted(rids))
+
+@_on_invalidate("reservations")
+def _res_index_invalidate(rid: Optional[str], rids: Optional[list]) -> None:
+    """Another replica wrote reservations: age out our copies so the next read reloads."""
+    with _ical_export_lock:
+        _ical_note_writes(set(rids or ()))
+        for r in rids or list(_ical_export_cache):
+            _ical_export_cache.pop(r, None)
+    with _res_index_lock:
+        _res_index_note_writes(set(rids or ()))
+        for r in rids or list(_res_index):
+            for bucket in _res_index.get(r, {}).values():
+                bucket["loaded_at"] = 0.0
+
+def _ical_note_writes(rids: set) -> None:
+    """Caller holds _ical_export_lock. Bumps the generation a feed rebuild checks before caching."""
+    for r in rids or ("*",):
+        _ical_export_gen[r] = _ical_export_gen.get(r, 0) + 1
+
+def _res_index_note_writes(rids: set) -> None:
+    """Caller holds _res_index_lock. No rids = a write we couldn't attribute."""
+    for r in rids or ("*",):
+        _res_index_writes[r] = _res_index_writes.get(r, 0) + 1
+
+def _res_window(bucket: dict, lo_min: int, hi_min: int) -> list:
+    """Rows with lo_min <= minute-of-day <= hi_min (inclusive), in time order."""
+    import bisect
+    lo = bisect.bisect_left(bucket["keys"], (lo_min, ""))
+    hi = bisect.bisect_right(bucket["keys"], (hi_min, "\uffff"))
+    return bucket["rows"][lo:hi]
+
+def _res_index_response(request: Request, rid: str, day: str, bucket: dict, now_min: int, payload: dict):
+    """Wrap a lookup result with version/ETag and answer If-None-Match with 304.
+    The ETag includes the minute so time-relative views still roll forward."""
+    etag = f'W/"{bucket["version"]}.{day}.{now_min}"'
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers={"ETag": etag})
+    body = {"restaurant_id": rid, "date": day, "version": bucket["version"], **payload}
+    return Response(content=_json.dumps(body, default=str), media_type="application/json",
+                    headers={"ETag": etag, "Cache-Control": "no-cache"})
+
+_RES_NOT_EXPECTED = {"cancelled", "seated", "completed", "no_show", "no-show"}
+
+@app.get("/reservations/upcoming")
+def get_upcoming_reservations(request: Request, restaurant_id: Optional[str] = None, minutes: int = 60):
+    """Today's reservations due in the next `minutes` minutes (not yet seated)."""
+    rid, now = _rid(restaurant_id), _local_now()
+    day, now_min = now.date().isoformat(), now.hour * 60 + now.minute
+    bucket = _res_index_day(rid, day)
+    with _res_index_lock:
+        rows = [r for r in _res_window(bucket, now_min, now_min + max(0, minutes))
+                if (r.get("status") or "confirmed") not in _RES_NOT_EXPECTED]
+    return _res_index_response(request, rid, day, bucket, now_min, {"minutes": minutes, "reservations": rows})
+
+@app.get("/reservations/arriving")
+def get_arriving_reservations(request: Request, restaurant_id: Optional[str] = None, window: int = 10):
+    """Reservations due within ±`window` minutes of now — the host should be greeting them."""
+    rid, now = _rid(restaurant_id), _local_now()
+    day, now_min = now.date().isoformat(), now.hour * 60 + now.minute
+    bucket = _res_index_day(rid, day)
+    with _res_index_lock:
+        rows = [r for r in _res_window(bucket, now_min - window, now_min + window)
+                if (r.get("status") or "confirmed") not in _RES_NOT_EXPECTED]
+    return _res_index_response(request, rid, day, bucket, now_min, {"window": window, "reservations": rows})
+
+@app.get("/reservations/late")
+def get_late_reservations(request: Request, restaurant_id: Optional[str] = None, grace: int = 10):
+    """Reservations past their time + `grace` min and still not seated. Those later than
+    PLANNER_NO_SHOW_GRACE_MIN are reported as likely no-shows."""
+    rid, now = _rid(restaurant_id), _local_now()
+    day, now_min = now.date().isoformat(), now.hour * 60 + now.minute
+    bucket = _res_index_day(rid, day)
+    late: list = []
+    no_show: list = []
+    with _res_index_lock:
+        for r in _res_window(bucket, 0, now_min - max(0, grace)):
+            if (r.get("status") or "confirmed") in _RES_NOT_EXPECTED:
+                continue
+            minutes_late = now_min - _res_minute(r.get("time"))
+            item = {**r, "minutes_late": minutes_late}
+            (no_show if minutes_late > PLANNER_NO_SHOW_GRACE_MIN else late).append(item)
+    return _res_index_response(request, rid, day, bucket, now_min,
+                               {"grace": grace, "late": late, "no_show": no_show})
 
-        cal = Calendar()
-        cal.add("prodid", "-//HOST Restaurant//host.app//EN")
-        cal.add("version", "2.0")
-        cal.add("x-wr-calname", "HOST Reservations")
-        cal.add("x-wr-timezone", "America/Denver")
-        cal.add("calscale", "GREGORIAN")
-
-        for r in rows:
-            ev = ICalEvent()
-            ev.add("uid", r.get("id", str(uuid_lib.uuid4())))
-            ev.add("summary", f"{r['guest_name']} — {r['party_size']}p")
-            try:
-                from datetime import datetime as dt, timedelta
-                start = dt.strptime(f"{r['date']} {r['time'][:5]}", "%Y-%m-%d %H:%M")
-                end   = start + timedelta(hours=1, minutes=30)
-                ev.add("dtstart", start)
-                ev.add("dtend",   end)
-            except Exception:
+# ── Reservation-aware capacity planner ───────────────────────────────────────
+#
+# Merges today's reservations with live table state into a per-table timeline:
+#   seated      — current party, predicted to leave at seated_at + turn time
+#   reservation — booked party, held from PLANNER_RESET_BUFFER_MIN before its time
+# Each upcoming reservation is placed on the smallest fitting table that is free
+# for its whole window. A walk-in of size p must not take a table whose next
+# reservation starts within p's predicted turn — those tables are "held" and are
+# skipped by seat_entry and left out of wait quotes.
+#
+# Reservations come from the reservation time index (kept current by the write
+# routes), so there's no extra DB read per poll. The plan itself is pure
+# in-memory work, cached until the index version / tables / occupants / minute
+# change, so /state pays nothing extra on a typical poll.
+
+RESTAURANT_TZ              = os.environ.get("RESTAURANT_TZ", "America/Denver")  # reservation date/time are local
+PLANNER_RESET_BUFFER_MIN   = int(os.environ.get("PLANNER_RESET_BUFFER_MIN", "10"))
+PLANNER_NO_SHOW_GRACE_MIN  = int(os.environ.get("PLANNER_NO_SHOW_GRACE_MIN", "20"))
+_TURN_MINUTES_BY_SIZE      = ((2, 60), (4, 75), (6, 90))   # (max party size, minutes)
+_TURN_MINUTES_LARGE        = 105
+_PLANNER_SKIP_STATUSES     = {"cancelled", "seated", "completed", "no_show", "no-show"}
+
+_planner_state: dict = {}   # { rid: {"plan", "plan_key"} }
+_planner_lock        = threading.Lock()
+
+def _predicted_turn_minutes(party_size: int) -> int:
+    for max_size, minutes in _TURN_MINUTES_BY_SIZE:
+        if (party_size or 2) <= max_size:
+            return minutes
+    return _TURN_MINUTES_LARGE
+
+def _local_now() -> datetime:
+    """Naive wall-clock time in the restaurant's timezone (what reservations use)."""
+    from zoneinfo import ZoneInfo
+    return datetime.now(ZoneInfo(RESTAURANT_TZ)).replace(tzinfo=None)
+
+def _utc_iso_to_local(ts: str) -> Optional[datetime]:
+    from zoneinfo import ZoneInfo
+    try:
+        dt = datetime.fromisoformat(ts.replace("Z", "+00:00"))
+    except Exception:
+        return None
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)   # _now() writes naive UTC
+    return dt.astimezone(ZoneInfo(RESTAURANT_TZ)).replace(tzinfo=None)
+
+def _planner_reservations(rid: str, day: str) -> tuple:
+    """(index version, reservations still to plan for) from the reservation time index."""
+    bucket = _res_index_day(rid, day)
+    with _res_index_lock:
+        rows = [r for r in bucket["rows"] if (r.get("status") or "confirmed") not in _PLANNER_SKIP_STATUSES]
+        return bucket["version"], rows
+
+def _planner_active(rid: str) -> bool:
+    """True if rid has any reservation left to plan for today (cached read)."""
+    try:
+        return bool(_planner_reservations(rid, _local_now().date().isoformat())[1])
+    except Exception:
+        return False
+
+def _build_plan(tables: list, reservations: list, occupants: dict, now: datetime, day: str) -> dict:
+    from datetime import timedelta
+    by_num: dict = {}
+    for t in tables or []:
+        n = t.get("table_number")
+        if n is not None:
+            by_num[int(n)] = t
+
+    timeline: dict = {n: [] for n in by_num}
+    for n, t in by_num.items():
+        if t.get("status") != "occupied":
+            continue
+        occ   = occupants.get(str(n)) or {}
+        size  = occ.get("party_size") or 2
+        turn  = _predicted_turn_minutes(size)
+        start = _utc_iso_to_local(occ["seated_at"]) if occ.get("seated_at") else None
+        start = start or now - timedelta(minutes=turn // 2)   # unknown seat time → assume mid-meal
+        end   = max(start + timedelta(minutes=turn), now + timedelta(minutes=5))  # running long
+        timeline[n].append({"kind": "seated", "start": start, "end": end,
+                            "party_size": size, "name": occ.get("name") or "Guest"})
+
+    unassigned: list = []
+    by_size = sorted(by_num, key=lambda n: (int(by_num[n].get("capacity") or 0), n))
+    for r in reservations:
+        try:
+            at = datetime.fromisoformat(f"{day}T{str(r['time'])[:5]}")
+        except Exception:
+            continue
+        if at + timedelta(minutes=PLANNER_NO_SHOW_GRACE_MIN) < now:
+            continue   # past the no-show grace — stop holding a table for them
+        size  = r.get("party_size") or 2
+        start = at - timedelta(minutes=PLANNER_RESET_BUFFER_MIN)
+        end   = at + timedelta(minutes=_predicted_turn_minutes(size))
+        seg   = {"kind": "reservation", "start": start, "end": end, "at": at, "party_size": size,
+                 "reservation_id": r.get("id"), "name": r.get("guest_name") or "Guest"}
+        for n in by_size:
+            if int(by_num[n].get("capacity") or 0) < size:
                 continue
-            desc_parts = [f"Party size: {r['party_size']}"]
-            if r.get("phone"): desc_parts.append(f"Phone: {r['phone']}")
-            if r.get("email"): desc_parts.append(f"Email: {r['email']}")
-            if r.get("notes"): desc_parts.append(f"Notes: {r['notes']}")
-            ev.add("description", "\n".join(desc_parts))
-            ev.add("status", "CONFIRMED" if r.get("status") == "confirmed" else "TENTATIVE")
-            cal.add_component(ev)
+            if all(s["end"] <= start or s["start"] >= end for s in timeline[n]):
+                timeline[n].append(seg)
+                break
+        else:
+            unassigned.append(seg)
+    for segs in timeline.values():
+        segs.sort(key=lambda s: s["start"])
+    return {"timeline": timeline, "unassigned": unassigned, "built_at": now}
+
+def _planner_plan(rid: str, tables: list) -> dict:
+    """Cached plan for rid given the caller's freshly-read table rows."""
+    now = _local_now()
+    day = now.date().isoformat()
+    version, reservations = _planner_reservations(rid, day)
+    occupants = _rstate(rid).occupants_snapshot()
+    key = (
+        day, now.strftime("%H:%M"), version,
+        tuple(sorted((str(t.get("table_number")), t.get("status"), t.get("capacity")) for t in tables or [])),
+        tuple(sorted((k, v.get("seated_at"), v.get("party_size")) for k, v in occupants.items())),
+    )
+    with _planner_lock:
+        st = _planner_state.setdefault(rid, {"plan": None, "plan_key": None})
+        if st["plan_key"] == key and st["plan"] is not None:
+            return st["plan"]
+    plan = _build_plan(tables, reservations, occupants, now, day)
+    with _planner_lock:
+        st["plan"], st["plan_key"] = plan, key
+    return plan
+
+def _planner_held(plan: Optional[dict], party_size: int = 2) -> set:
+    """Table numbers a walk-in of party_size seated now would still occupy when
+    that table's next reservation is due."""
+    from datetime import timedelta
+    if not plan:
+        return set()
+    horizon = plan["built_at"] + timedelta(minutes=_predicted_turn_minutes(party_size))
+    return {
+        n for n, segs in plan["timeline"].items()
+        if any(s["kind"] == "reservation" and s["start"] < horizon for s in segs)
+    }
 
+def _planner_plan_safe(rid: str, tables: list) -> Optional[dict]:
+    """_planner_plan for hot paths — the planner must never break seating or quotes."""
+    try:
+        return _planner_plan(rid, tables)
+    except Exception as e:
+        _log("planner").error(f"rid={rid} error: {e}")
+        return None
+
+@app.get("/planner/timeline")
+def get_planner_timeline(restaurant_id: Optional[str] = None):
+    """Per-table timeline of seated parties and held reservations for today."""
+    rid    = _rid(restaurant_id)
+    tables = _dedup_tables(supabase.table("tables").select("*").eq("restaurant_id", rid).execute().data)
+    plan   = _planner_plan(rid, tables)
+
+    def _seg(s: dict) -> dict:
+        return {k: (v.strftime("%H:%M") if isinstance(v, datetime) else v) for k, v in s.items()}
+
+    return {
+        "restaurant_id": rid,
+        "as_of":         plan["built_at"].isoformat(timespec="minutes"),
+        "timezone":      RESTAURANT_TZ,
+        "tables":        {str(n): [_seg(s) for s in segs] for n, segs in sorted(plan["timeline"].items())},
+        "unassigned":    [_seg(s) for s in plan["unassigned"]],
+        "held_for_walkins": sorted(_planner_held(plan)),
+    }
+
+# ── iCal export ──────────────────────────────────────────────────────────────
+#
+# Calendar clients (Google polls every few minutes) get a cached, pre-serialized
+# feed per restaurant with an ETag, so a poll is a dict lookup or a bare 304. The
+# feed only covers ICAL_EXPORT_PAST_DAYS back / ICAL_EXPORT_FUTURE_DAYS ahead.
+# Every reservation write marks the restaurant's feed stale and bumps its
+# generation; a rebuild that saw the generation move underneath it is served but
+# not cached. The rebuild re-reads the window once and re-serializes only the
+# events whose row changed — the rest come from a per-event fragment cache.
+#
+# Subscribe URLs: /reservations.ics?token=<signed>, handed out to the owner by
+# /reservations/ical-link. Tokens are signed with ICAL_FEED_SECRET; with it unset no
+# tokens are issued. Without a token only the env RESTAURANT_ID feed is served, as
+# before multi-tenant export — the feed carries guest phone numbers and emails.
+
+ICAL_EXPORT_PAST_DAYS    = int(os.environ.get("ICAL_EXPORT_PAST_DAYS", "7"))
+ICAL_EXPORT_FUTURE_DAYS  = int(os.environ.get("ICAL_EXPORT_FUTURE_DAYS", "90"))
+ICAL_EXPORT_MAX_AGE_SEC  = int(os.environ.get("ICAL_EXPORT_MAX_AGE_SEC", "600"))  # catches direct DB edits
+ICAL_FEED_SECRET         = os.environ.get("ICAL_FEED_SECRET", "")
+
+_ical_export_cache: dict = {}   # { rid: {"body": bytes, "etag": str, "built_at": float, "window": (start, end)} }
+_ical_event_cache:  dict = {}   # { rid: { res_id: (row_signature, vevent_bytes) } }
+_ical_export_gen:   dict = {}   # { rid (or "*" for every restaurant): writes seen so far }
+_ical_export_lock        = threading.Lock()
+
+_ICAL_EXPORT_FIELDS = ("guest_name", "party_size", "date", "time", "phone", "email", "notes", "status")
+
+def _ical_feed_token(rid: str) -> str:
+    import hmac
+    sig = hmac.new(ICAL_FEED_SECRET.encode(), rid.encode(), hashlib.sha256).hexdigest()[:24]
+    return f"{rid}.{sig}"
+
+def _ical_token_rid(token: str) -> str:
+    import hmac
+    rid, _, _sig = token.rpartition(".")
+    if not rid or not ICAL_FEED_SECRET or not hmac.compare_digest(_ical_feed_token(rid), token):
+        raise HTTPException(status_code=403, detail="Invalid calendar token")
+    return rid
+
+def _ical_export_window() -> tuple:
+    from datetime import timedelta
+    today = datetime.now(timezone.utc).date()
+    return ((today - timedelta(days=ICAL_EXPORT_PAST_DAYS)).isoformat(),
+            (today + timedelta(days=ICAL_EXPORT_FUTURE_DAYS)).isoformat())
+
+def _ical_vevent_bytes(r: dict) -> Optional[bytes]:
+    from icalendar import Event as ICalEvent
+    from datetime import timedelta
+    try:
+        start = datetime.fromisoformat(f"{r['date']}T{str(r['time'])[:5]}")
+    except Exception:
+        return None
+    ev = ICalEvent()
+    ev.add("uid", r["id"])
+    ev.add("summary", f"{r['guest_name']} — {r['party_size']}p")
+    ev.add("dtstart", start)
+    ev.add("dtend",   start + timedelta(hours=1, minutes=30))
+    desc_parts = [f"Party size: {r['party_size']}"]
+    if r.get("phone"): desc_parts.append(f"Phone: {r['phone']}")
+    if r.get("email"): desc_parts.append(f"Email: {r['email']}")
+    if r.get("notes"): desc_parts.append(f"Notes: {r['notes']}")
+    ev.add("description", "\n".join(desc_parts))
+    ev.add("status", "CONFIRMED" if r.get("status") == "confirmed" else "TENTATIVE")
+    return ev.to_ical()
+
+def _build_ical_feed(rid: str, window: tuple) -> bytes:
+    from icalendar import Calendar
+
+    rows = (
+        supabase.table("reservations")
+        .select("id, " + ", ".join(_ICAL_EXPORT_FIELDS))
+        .eq("restaurant_id", rid)
+        .neq("status", "cancelled")
+        .gte("date", window[0])
+        .lte("date", window[1])
+        .order("date").order("time")
+        .execute()
+        .data or []
+    )
+
+    cal = Calendar()
+    cal.add("prodid", "-//HOST Restaurant//host.app//EN")
+    cal.add("version", "2.0")
+    cal.add("x-wr-calname", "HOST Reservations")
+    cal.add("x-wr-timezone", "America/Denver")
+    cal.add("calscale", "GREGORIAN")
+    head = cal.to_ical()
+    head = head[:head.rindex(b"END:VCALENDAR")]
+
+    with _ical_export_lock:
+        prev = _ical_event_cache.get(rid, {})
+    fragments: dict = {}
+    parts = [head]
+    for r in rows:
+        sig = tuple(r.get(f) for f in _ICAL_EXPORT_FIELDS)
+        cached = prev.get(r["id"])
+        if cached and cached[0] == sig:
+            frag = cached[1]
+        else:
+            frag = _ical_vevent_bytes(r)
+            if frag is None:
+                continue
+        fragments[r["id"]] = (sig, frag)
+        parts.append(frag)
+    parts.append(b"END:VCALENDAR\r\n")
+    with _ical_export_lock:
+        _ical_event_cache[rid] = fragments   # rows that left the window/got cancelled drop out
+    return b"".join(parts)
+
+@app.get("/reservations/ical-link")
+def get_ical_link(restaurant_id: Optional[str] = None, secret: Optional[str] = None):
+    """Signed subscribe URL for a restaurant's reservations calendar (owner only)."""
+    _check_owner_secret(secret)
+    rid = _rid(restaurant_id)
+    if not ICAL_FEED_SECRET:
+        if rid == RESTAURANT_ID:
+            return {"restaurant_id": rid, "path": "/reservations.ics"}
+        raise HTTPException(status_code=503, detail="ICAL_FEED_SECRET is not set")
+    return {"restaurant_id": rid, "path": f"/reservations.ics?token={_ical_feed_token(rid)}"}
+
+@app.get("/reservations.ics")
+def export_ical(request: Request, restaurant_id: Optional[str] = None, token: Optional[str] = None):
+    """Export a restaurant's reservations as an iCal feed (subscribe from Apple/Google Calendar).
+    Any restaurant but the env RESTAURANT_ID needs a signed token."""
+    try:
+        rid = _ical_token_rid(token) if token else _rid(restaurant_id)
+        if not token and rid != RESTAURANT_ID:
+            raise HTTPException(status_code=403, detail="Calendar token required")
+        window = _ical_export_window()
+        with _ical_export_lock:
+            entry = _ical_export_cache.get(rid)
+            gen   = (_ical_export_gen.get(rid, 0), _ical_export_gen.get("*", 0))
+        if (entry is None or entry["window"] != window
+                or time.time() - entry["built_at"] > ICAL_EXPORT_MAX_AGE_SEC):
+            body  = _build_ical_feed(rid, window)
+            entry = {
+                "body":     body,
+                "etag":     '"' + hashlib.sha256(body).hexdigest()[:32] + '"',
+                "built_at": time.time(),
+                "window":   window,
+            }
+            with _ical_export_lock:
+                # A write during the build may not be in this body; serve it once, don't keep it
+                if gen == (_ical_export_gen.get(rid, 0), _ical_export_gen.get("*", 0)):
+                    _ical_export_cache[rid] = entry
+
+        headers = {"ETag": entry["etag"], "Cache-Control": "private, max-age=60"}
+        if request.headers.get("if-none-match") == entry["etag"]:
+            return Response(status_code=304, headers=headers)
         return Response(
-            content=cal.to_ical(),
+            content=entry["body"],
             media_type="text/calendar; charset=utf-8",
-            headers={"Content-Disposition": "inline; filename=reservations.ics"},
+            headers={"Content-Disposition": "inline; filename=reservations.ics", **headers},
         )
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -2406,96 +5839,309 @@ def update_settings(req: SettingsRequest):
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.post("/settings/sync-ical")
-def sync_ical(req: SyncIcalRequest):
-    """Fetch an iCal URL (e.g., from OpenTable) and upsert reservations into HOST."""
-    try:
-        import requests as http
-        from icalendar import Calendar
+# ── OpenTable iCal sync pipeline ────────────────────────────────────────────
+#
+# parse every VEVENT → fetch the existing rows for those UIDs in bulk → diff →
+# one bulk upsert on (restaurant_id, external_uid). A 300-event feed used to cost
+# ~600 sequential round-trips (SELECT + UPDATE/INSERT per event); it now costs
+# ceil(N/200) lookups + ceil(changed/500) upserts. Requires the unique index from
+# supabase/migrations/003_reservations_external_uid_unique.sql.
+
+_ICAL_SYNC_FIELDS   = ("guest_name", "party_size", "date", "time", "notes", "status")
+_ICAL_LOOKUP_CHUNK  = 200   # stay under Supabase IN-clause / URL length limits
+_ICAL_UPSERT_CHUNK  = 500
+
+def _parse_ical_events(content: bytes) -> list:
+    """Parse an iCal feed into reservation payloads, one per VEVENT with a UID.
+    Pure CPU — no DB access — so it can be benchmarked and reused by the poller.
+    Later duplicates of the same UID win (matches the old sequential upsert)."""
+    from icalendar import Calendar
+
+    cal = Calendar.from_ical(content)
+    by_uid: dict = {}
+    for component in cal.walk("VEVENT"):
+        summary = str(component.get("summary", "Guest"))
+        dtstart = component.get("dtstart")
+        if not dtstart:
+            continue
 
-        resp = http.get(req.url, timeout=15, headers={"User-Agent": "HOST-Restaurant/1.0"})
-        if not resp.ok:
-            raise HTTPException(status_code=400, detail=f"Could not fetch iCal URL (HTTP {resp.status_code})")
+        start_dt = dtstart.dt
+        date_str = start_dt.strftime("%Y-%m-%d")
+        time_str = start_dt.strftime("%H:%M") if hasattr(start_dt, "hour") else "19:00"  # all-day default
 
-        cal      = Calendar.from_ical(resp.content)
-        imported = 0
+        uid         = str(component.get("uid", ""))
+        description = str(component.get("description", ""))
 
-        for component in cal.walk():
-            if component.name != "VEVENT":
-                continue
+        # ── Party size: try SUMMARY "(4)" first (OpenTable standard format),
+        #    then fall back to DESCRIPTION text patterns.
+        party_size = 2
+        # 1) OpenTable SUMMARY format: "Smith, John (4)" or "John Smith (4 guests)"
+        summary_size = re.search(r"\((\d+)(?:\s*(?:guest|cover|person|pax|p))?\)", summary, re.IGNORECASE)
+        if summary_size:
+            party_size = int(summary_size.group(1))
+        else:
+            # 2) DESCRIPTION patterns: "4 guests", "party of 4", "covers: 4", "party size: 4"
+            desc_size = re.search(
+                r"(?:party(?:\s+of|\s+size[:\s]+)?|covers?[:\s]+|guests?[:\s]+|pax[:\s]+)(\d+)"
+                r"|(\d+)\s*(?:guest|cover|person|party|pax)",
+                description.lower()
+            )
+            if desc_size:
+                party_size = int(desc_size.group(1) or desc_size.group(2))
+
+        # Clean guest name: strip trailing "(4)" or "(4 guests)" appended by OpenTable
+        guest_name = re.sub(r"\s*\(\d+(?:\s*(?:guest|cover|person|pax|p))?\)\s*$", "", summary, flags=re.IGNORECASE).strip()
+        if not guest_name:
+            guest_name = summary  # fallback if regex ate the whole string
+
+        by_uid[uid] = {
+            "external_uid": uid,
+            "guest_name":   guest_name,
+            "party_size":   party_size,
+            "date":         date_str,
+            "time":         time_str,
+            "notes":        description[:500] if description else None,
+            "cancelled":    str(component.get("status", "")).upper() == "CANCELLED",
+        }
+    return list(by_uid.values())
 
-            summary = str(component.get("summary", "Guest"))
-            dtstart = component.get("dtstart")
-            if not dtstart:
+def _fetch_existing_by_uid(rid: str, uids: list) -> dict:
+    """external_uid → existing reservation row, in chunked IN queries."""
+    existing: dict = {}
+    for i in range(0, len(uids), _ICAL_LOOKUP_CHUNK):
+        chunk = uids[i:i + _ICAL_LOOKUP_CHUNK]
+        rows = (
+            supabase.table("reservations")
+            .select("id, external_uid, source, " + ", ".join(_ICAL_SYNC_FIELDS))
+            .eq("restaurant_id", rid)
+            .in_("external_uid", chunk)
+            .execute()
+            .data or []
+        )
+        for row in rows:
+            existing[row["external_uid"]] = row
+    return existing
+
+def _diff_ical_events(rid: str, events: list, existing: dict) -> dict:
+    """Split parsed events into upsert rows + counters. Host-side status changes
+    (seated, no-show, …) are preserved on update; only CANCELLED in the feed
+    overrides them. Every upsert row carries the same keys so PostgREST accepts
+    the batch as a single statement."""
+    upserts: list = []
+    counts = {"inserted": 0, "updated": 0, "unchanged": 0, "cancelled": 0}
+    cancelled_uids: list = []
+    for ev in events:
+        prev = existing.get(ev["external_uid"])
+        if ev["cancelled"]:
+            status = "cancelled"
+        else:
+            status = (prev or {}).get("status") or "confirmed"
+            # An event re-appearing un-cancelled after a cancellation is live again
+            if status == "cancelled":
+                status = "confirmed"
+        row = {
+            "restaurant_id": rid,
+            "external_uid":  ev["external_uid"],
+            "source":        (prev or {}).get("source") or "opentable",
+            "guest_name":    ev["guest_name"],
+            "party_size":    ev["party_size"],
+            "date":          ev["date"],
+            "time":          ev["time"],
+            "notes":         ev["notes"],
+            "status":        status,
+        }
+        if prev is None:
+            if ev["cancelled"]:
+                # Never seen and already cancelled — nothing to store
+                counts["cancelled"] += 1
+                cancelled_uids.append(ev["external_uid"])
                 continue
+            counts["inserted"] += 1
+            upserts.append(row)
+            continue
+        # Supabase returns `time` as HH:MM:SS — compare on HH:MM
+        same = all(
+            (str(prev.get(f) or "")[:5] if f == "time" else prev.get(f)) == row[f]
+            for f in _ICAL_SYNC_FIELDS
+        )
+        if same:
+            counts["unchanged"] += 1
+            continue
+        if status == "cancelled":
+            counts["cancelled"] += 1
+            cancelled_uids.append(ev["external_uid"])
+        else:
+            counts["updated"] += 1
+        upserts.append(row)
+    return {"upserts": upserts, "counts": counts, "cancelled_uids": cancelled_uids}
+
+def _sync_ical_content(rid: str, content: bytes) -> dict:
+    """Run the parse → lookup → diff → bulk-upsert pipeline for one feed body."""
+    events   = _parse_ical_events(content)
+    existing = _fetch_existing_by_uid(rid, [ev["external_uid"] for ev in events])
+    diff     = _diff_ical_events(rid, events, existing)
+    rows     = diff["upserts"]
+    written: list = []
+    for i in range(0, len(rows), _ICAL_UPSERT_CHUNK):
+        res = supabase.table("reservations").upsert(
+            rows[i:i + _ICAL_UPSERT_CHUNK],
+            on_conflict="restaurant_id,external_uid",
+        ).execute()
+        written.extend(res.data or [])
+    if rows:
+        _on_reservations_written(rid, written)
+    return {"imported": len(events), **diff["counts"], "cancelled_uids": diff["cancelled_uids"]}
 
-            start_dt = dtstart.dt
-            if hasattr(start_dt, "hour"):
-                date_str = start_dt.strftime("%Y-%m-%d")
-                time_str = start_dt.strftime("%H:%M")
-            else:
-                date_str = start_dt.strftime("%Y-%m-%d")
-                time_str = "19:00"  # default for all-day events
-
-            uid         = str(component.get("uid", ""))
-            description = str(component.get("description", ""))
-
-            # ── Party size: try SUMMARY "(4)" first (OpenTable standard format),
-            #    then fall back to DESCRIPTION text patterns.
-            party_size = 2
-            # 1) OpenTable SUMMARY format: "Smith, John (4)" or "John Smith (4 guests)"
-            summary_size = re.search(r"\((\d+)(?:\s*(?:guest|cover|person|pax|p))?\)", summary, re.IGNORECASE)
-            if summary_size:
-                party_size = int(summary_size.group(1))
-            else:
-                # 2) DESCRIPTION patterns: "4 guests", "party of 4", "covers: 4", "party size: 4"
-                desc_size = re.search(
-                    r"(?:party(?:\s+of|\s+size[:\s]+)?|covers?[:\s]+|guests?[:\s]+|pax[:\s]+)(\d+)"
-                    r"|(\d+)\s*(?:guest|cover|person|party|pax)",
-                    description.lower()
-                )
-                if desc_size:
-                    party_size = int(desc_size.group(1) or desc_size.group(2))
-
-            # Clean guest name: strip trailing "(4)" or "(4 guests)" appended by OpenTable
-            guest_name = re.sub(r"\s*\(\d+(?:\s*(?:guest|cover|person|pax|p))?\)\s*$", "", summary, flags=re.IGNORECASE).strip()
-            if not guest_name:
-                guest_name = summary  # fallback if regex ate the whole string
-
-            # Upsert by external_uid so re-syncing is idempotent
-            existing = (
-                supabase.table("reservations")
-                .select("id")
-                .eq("restaurant_id", RESTAURANT_ID)
-                .eq("external_uid", uid)
-                .execute()
-            )
-            payload = {
-                "guest_name": guest_name,
-                "party_size": party_size,
-                "date":       date_str,
-                "time":       time_str,
-                "notes":      description[:500] if description else None,
-            }
-            if existing.data:
-                supabase.table("reservations").update(payload).eq("id", existing.data[0]["id"]).execute()
-            else:
-                supabase.table("reservations").insert({
-                    **payload,
-                    "restaurant_id": RESTAURANT_ID,
-                    "source":        "opentable",
-                    "status":        "confirmed",
-                    "external_uid":  uid,
-                    "created_at":    _now(),
-                }).execute()
-            imported += 1
-
-        return {"status": "synced", "imported": imported}
+@app.post("/settings/sync-ical")
+def sync_ical(req: SyncIcalRequest):
+    """Fetch an iCal URL (e.g., from OpenTable) and upsert reservations into HOST.
+    Always a full fetch + sync; also primes the background poller's validators."""
+    try:
+        return _ical_fetch_and_sync(_rid(req.restaurant_id), req.url, force=True)
     except HTTPException:
         raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+# ── Background iCal polling ───────────────────────────────────────────────────
+#
+# Every restaurant with restaurant_settings.opentable_ical_url set is re-synced on
+# its own jittered schedule so reservations stay fresh without a host pressing
+# "Sync". Each poll is a conditional GET (If-None-Match / If-Modified-Since); a
+# 304 or a body whose SHA-256 matches the last synced feed is skipped before any
+# parsing. State is in-memory — after a restart the first poll re-syncs once.
+
+ICAL_POLL_ENABLED      = os.environ.get("ICAL_POLL_ENABLED", "1") != "0"
+ICAL_POLL_INTERVAL_SEC = int(os.environ.get("ICAL_POLL_INTERVAL_SEC", "900"))   # 15 min
+_ICAL_POLL_JITTER      = 0.2     # ±20% of the interval, so restaurants don't poll in lockstep
+_ICAL_POLL_TICK_SEC    = 30
+_ICAL_URLS_REFRESH_SEC = 300     # how often the restaurant_settings list is re-read
+
+_ical_sync_state: dict = {}      # { rid: {url, etag, last_modified, feed_hash, next_run, last_*} }
+_ical_sync_lock        = threading.Lock()
+
+def _ical_next_run(now: float) -> float:
+    spread = ICAL_POLL_INTERVAL_SEC * _ICAL_POLL_JITTER
+    return now + ICAL_POLL_INTERVAL_SEC + random.uniform(-spread, spread)
+
+def _ical_state_for(rid: str, url: str) -> dict:
+    """Return (creating if needed) the poll state for rid. A changed URL resets the
+    validators so the new feed is always fetched and parsed in full."""
+    with _ical_sync_lock:
+        st = _ical_sync_state.get(rid)
+        if st is None or st.get("url") != url:
+            st = {
+                "url": url, "etag": None, "last_modified": None, "feed_hash": None,
+                # First run lands anywhere in the first interval → spreads startup load
+                "next_run": time.time() + random.uniform(0, ICAL_POLL_INTERVAL_SEC),
+                "last_sync_at": None, "last_status": None, "last_error": None, "last_result": None,
+            }
+            _ical_sync_state[rid] = st
+        return st
+
+def _ical_fetch_and_sync(rid: str, url: str, force: bool = False) -> dict:
+    """Fetch one feed and sync it if it changed. force=True skips the conditional
+    headers and the hash check (manual "Sync now"). Returns the sync result dict
+    with a "status" of synced | not_modified | unchanged. Raises on fetch errors."""
+    import requests as http
+
+    st = _ical_state_for(rid, url)
+    headers = {"User-Agent": "HOST-Restaurant/1.0"}
+    if not force:
+        if st.get("etag"):
+            headers["If-None-Match"] = st["etag"]
+        if st.get("last_modified"):
+            headers["If-Modified-Since"] = st["last_modified"]
+
+    resp = http.get(url, timeout=15, headers=headers)
+    if resp.status_code == 304:
+        result = {"status": "not_modified"}
+    elif not resp.ok:
+        raise HTTPException(status_code=400, detail=f"Could not fetch iCal URL (HTTP {resp.status_code})")
+    else:
+        feed_hash = hashlib.sha256(resp.content).hexdigest()
+        if not force and feed_hash == st.get("feed_hash"):
+            result = {"status": "unchanged"}
+        else:
+            result = {"status": "synced", **_sync_ical_content(rid, resp.content)}
+        with _ical_sync_lock:
+            st["feed_hash"]     = feed_hash
+            st["etag"]          = resp.headers.get("ETag")
+            st["last_modified"] = resp.headers.get("Last-Modified")
+
+    with _ical_sync_lock:
+        st["last_sync_at"] = _now()
+        st["last_status"]  = result["status"]
+        st["last_error"]   = None
+        if result["status"] == "synced":
+            st["last_result"] = {k: v for k, v in result.items() if k not in ("status", "cancelled_uids")}
+    return result
+
+def _ical_poll_targets() -> dict:
+    """rid → opentable_ical_url for every restaurant that has one configured."""
+    rows = (
+        supabase.table("restaurant_settings")
+        .select("restaurant_id, opentable_ical_url")
+        .not_.is_("opentable_ical_url", "null")
+        .execute()
+        .data or []
+    )
+    return {r["restaurant_id"]: r["opentable_ical_url"] for r in rows if r.get("opentable_ical_url")}
+
+def _ical_poller_loop():
+    targets: dict = {}
+    targets_at = 0.0
+    while True:
+        now = time.time()
+        if now - targets_at >= _ICAL_URLS_REFRESH_SEC:
+            try:
+                targets = _ical_poll_targets()
+                with _ical_sync_lock:
+                    for rid in [r for r in _ical_sync_state if r not in targets]:
+                        del _ical_sync_state[rid]   # URL removed in settings
+            except Exception as e:
+                _log("ical-poll").warning(f"could not load restaurant_settings: {e}")
+            targets_at = now
+        for rid, url in (targets.items() if _is_leader() else ()):
+            st = _ical_state_for(rid, url)
+            if st["next_run"] > now:
+                continue
+            try:
+                result = _ical_fetch_and_sync(rid, url)
+                if result["status"] == "synced":
+                    _log("ical-poll").info(f"rid={rid} {st['last_result']}")
+            except Exception as e:
+                detail = e.detail if isinstance(e, HTTPException) else str(e)
+                with _ical_sync_lock:
+                    st["last_sync_at"] = _now()
+                    st["last_status"]  = "error"
+                    st["last_error"]   = detail
+                _log("ical-poll").warning(f"rid={rid} failed: {detail}")
+            st["next_run"] = _ical_next_run(time.time())
+        time.sleep(_ICAL_POLL_TICK_SEC)
+
+if ICAL_POLL_ENABLED:
+    _background(_ical_poller_loop, leader=True)
+
+@app.get("/settings/ical-status")
+def get_ical_status(restaurant_id: Optional[str] = None):
+    """Last background/manual iCal sync for a restaurant (for the settings page)."""
+    rid = _rid(restaurant_id)
+    with _ical_sync_lock:
+        st = dict(_ical_sync_state.get(rid) or {})
+    if not st:
+        return {"restaurant_id": rid, "polling": ICAL_POLL_ENABLED, "last_status": None}
+    next_run = st.pop("next_run", None)
+    for k in ("etag", "last_modified", "feed_hash"):
+        st.pop(k, None)
+    return {
+        "restaurant_id":    rid,
+        "polling":          ICAL_POLL_ENABLED,
+        "interval_seconds": ICAL_POLL_INTERVAL_SEC,
+        "next_sync_at":     datetime.fromtimestamp(next_run, timezone.utc).isoformat() if next_run else None,
+        **st,
+    }
+
 # ── One-time setup ────────────────────────────────────────────────────────────
 
 @app.post("/setup")
@@ -2572,15 +6218,19 @@ async def create_demo_submission(request: Request):
         "submittedAt": str(body.get("submittedAt") or _now()),
         "receivedAt":  _now(),
     }
-    _demo_submissions.insert(0, sub)
-    print(f"[DEMO REQUEST] {_json.dumps(sub)}")
+    with _submissions_lock:
+        _demo_submissions.insert(0, sub)
+    _state_publish("demo_submission", data=sub)
+    _log("demo.request").info("demo request received", extra={"fields": {
+        "submission_id": sub["id"], "restaurant": sub["restaurant"], "city": sub["city"]}})
     # Save to Supabase synchronously so the submission survives restarts
     try:
         supabase.table("demo_submissions").insert(sub).execute()
-        print(f"[DEMO REQUEST] Saved to Supabase: {sub['id']}")
+        _log("demo.request").debug("Saved to Supabase: %s", sub["id"])
     except Exception as e:
-        # Table may not exist yet — log full payload so it can be recovered from Railway logs
-        print(f"[DEMO REQUEST] Supabase save FAILED ({e}) — payload: {_json.dumps(sub)}")
+        # Table may not exist yet — the payload (contact details included) is logged only on
+        # this path, so the lead can still be recovered from Railway logs
+        _log("demo.request").error(f"Supabase save FAILED ({e})", extra={"fields": {"payload": sub}})
     return {"ok": True}
 
 @app.get("/demo-submissions")
@@ -2595,7 +6245,7 @@ def get_demo_submissions(secret: Optional[str] = None):
         # Table exists but is empty — check in-memory list as fallback
         return _demo_submissions
     except Exception as e:
-        print(f"[DEMO SUBS] GET failed: {e}")
+        _log("demo.subs").warning(f"GET failed: {e}")
         # Supabase unavailable — return in-memory list
         return _demo_submissions
 
@@ -2618,9 +6268,11 @@ def _owner_rids(restaurant_ids: Optional[str]) -> list:
     return all_rids
 
 @app.get("/owner/analytics")
-def owner_analytics(restaurant_ids: Optional[str] = None, secret: Optional[str] = None):
+def owner_analytics(restaurant_ids: Optional[str] = None, secret: Optional[str] = None,
+                    include_archive: bool = False):
     """Deep guest analytics — all queue_entries joined with first seating event per entry.
-    Returns up to 5 000 rows ordered by arrival_time desc."""
+    Returns up to 5 000 rows ordered by arrival_time desc; include_archive=true appends
+    every archived entry (see Cold-storage archive) after them."""
     _check_owner_secret(secret)
     rids = _owner_rids(restaurant_ids)
     try:
@@ -2654,6 +6306,19 @@ def owner_analytics(restaurant_ids: Optional[str] = None, secret: Optional[str]
                 if eid and eid not in seated_at_map:
                     seated_at_map[eid] = ev["created_at"]
 
+        if include_archive:
+            for rid in rids:
+                for day in _archive_days(rid, "seating_events"):
+                    evs = sorted((ev for ev in _archive_read(rid, "seating_events", day)
+                                  if ev.get("action") == "seated"), key=lambda ev: ev.get("created_at") or "")
+                    for ev in evs:
+                        eid = ev.get("queue_entry_id")
+                        if eid and eid not in seated_at_map:
+                            seated_at_map[eid] = ev["created_at"]
+                for day in reversed(_archive_days(rid, "queue_entries")):
+                    archived = _archive_read(rid, "queue_entries", day)
+                    entries += sorted(archived, key=lambda e: e.get("arrival_time") or "", reverse=True)
+
         result = []
         for e in entries:
             seated_at = seated_at_map.get(e["id"])
@@ -2688,46 +6353,495 @@ def owner_analytics(restaurant_ids: Optional[str] = None, secret: Optional[str]
 @app.delete("/owner/analytics/clear")
 def owner_analytics_clear(restaurant_ids: Optional[str] = None, secret: Optional[str] = None):
     """Hard-DELETE queue_entries and seating_events for specified restaurants.
-    This permanently frees Supabase row storage. Export CSV before calling this."""
+    This permanently frees Supabase row storage. Export CSV before calling this.
+
+    Runs as a batched purge job. Small tenants finish inside the request and get
+    the freed counts back; larger ones get status "clearing" and a job_id to poll
+    at GET /purge/jobs/{job_id}."""
     _check_owner_secret(secret)
     rids = _owner_rids(restaurant_ids)
-    freed = {"queue_entries": 0, "seating_events": 0}
+    steps = []
     for rid in rids:
         # Delete seating_events first (may reference queue_entries)
+        steps += [_purge_step("seating_events", rid), _purge_step("queue_entries", rid)]
+        # Clear in-memory occupants and wait timers so the floor map reflects the empty state
+        st = _rstate(rid)
+        st.clear_occupants()
+        st.clear_waits()
+    job = _purge_start("analytics_clear", rids, steps)
+    finished = job["_done"].wait(PURGE_SYNC_SEC)
+    done  = _purge_rows_by_table(job)
+    freed = {"queue_entries": done.get("queue_entries_deleted", 0),
+             "seating_events": done.get("seating_events_deleted", 0)}
+    _log("owner.clear").info(f"freed {freed} rows across {len(rids)} restaurants (job {job['status']})")
+    if not finished:
+        return {"status": "clearing", "job_id": job["id"], "freed": freed, "restaurants": rids}
+    if job["status"] == "failed":
+        raise HTTPException(status_code=500, detail=f"Clear failed: {job['error']} (job {job['id']})")
+    return {"status": "cleared", "job_id": job["id"], "freed": freed, "restaurants": rids}
+
+
+# ── Capacity monitor ──────────────────────────────────────────────────────────
+# Row counts and storage without downloading ids. Table totals come from the
+# capacity_stats() RPC (pg_class statistics + relation sizes, migration 005) or,
+# if that isn't installed, PostgREST HEAD requests with count=estimated; the
+# per-restaurant breakdown uses count=exact on the indexed restaurant_id
+# filter. A snapshot is cached for CAPACITY_CACHE_SEC and sampled hourly into
+# capacity_samples, and the samples give a rows/day and bytes/day growth rate
+# and a projected date for hitting the plan's database size limit.
+CAPACITY_CACHE_SEC      = int(os.environ.get("CAPACITY_CACHE_SEC", "300"))
+CAPACITY_SAMPLE_SEC     = int(os.environ.get("CAPACITY_SAMPLE_SEC", "3600"))
+CAPACITY_GROWTH_DAYS    = int(os.environ.get("CAPACITY_GROWTH_DAYS", "14"))
+SUPABASE_PLAN_DB_MB     = float(os.environ.get("SUPABASE_PLAN_DB_MB", "500"))   # free tier
+CAPACITY_AVG_ROW_BYTES  = int(os.environ.get("CAPACITY_AVG_ROW_BYTES", "400"))  # used when sizes are unavailable
+
+_CAPACITY_TABLES     = ("queue_entries", "seating_events", "reservations", "tables", "restaurants",
+                        "camera_events", "delivery_events", "throughput_events", "event_rollups")
+_CAPACITY_RID_TABLES = ("queue_entries", "seating_events", "reservations", "camera_events")
+
+_capacity_cache: dict = {"at": 0.0, "snapshot": None}
+_capacity_hist: list  = []   # [(epoch, {table: (rows, bytes)})], oldest first, CAPACITY_GROWTH_DAYS deep
+_capacity_lock        = threading.Lock()
+_capacity_seeded      = False
+
+
+def _head_count(table: str, method: str, rid: Optional[str] = None) -> int:
+    q = supabase.table(table).select("*", count=method, head=True)
+    if rid:
+        q = q.eq("restaurant_id", rid)
+    return int(q.execute().count or 0)
+
+
+def _capacity_collect() -> dict:
+    stats: dict = {}
+    db_bytes = None
+    source   = "pg_class"
+    try:
+        for r in supabase.rpc("capacity_stats").execute().data or []:
+            stats[r["table_name"]] = (int(r["est_rows"]), int(r["total_bytes"]))
+            db_bytes = int(r["db_bytes"])
+    except Exception as e:
+        source = "estimated"
+        _log("capacity").warning(f"capacity_stats RPC unavailable, using estimated counts: {e}")
+
+    tables: dict = {}
+    for t in _CAPACITY_TABLES:
+        rows, size = stats.get(t, (-1, None))
+        if rows < 0:   # not analyzed yet, or no RPC
+            try:
+                rows = _head_count(t, "estimated")
+            except Exception as ex:
+                _log("capacity").warning(f"count failed for {t}: {ex}")
+                rows = -1
+        tables[t] = {"rows": rows, "bytes": size}
+
+    restaurants: dict = {}
+    for rid in _owner_rids(None):
+        per = restaurants[rid] = {}
+        for t in _CAPACITY_RID_TABLES:
+            try:
+                per[t] = _head_count(t, "exact", rid)
+            except Exception as ex:
+                per[t] = -1
+                _log("capacity").warning(f"count failed for {t}/{rid}: {ex}")
+
+    if db_bytes is None:
+        db_bytes = sum(max(0, v["rows"]) for v in tables.values()) * CAPACITY_AVG_ROW_BYTES
+    return {"taken_at": _now(), "source": source, "db_bytes": db_bytes,
+            "tables": tables, "restaurants": restaurants}
+
+
+def _capacity_seed():
+    """Load recent samples once so growth rates survive a restart."""
+    global _capacity_seeded
+    if _capacity_seeded:
+        return
+    _capacity_seeded = True
+    from datetime import timedelta
+    since = (datetime.now(timezone.utc) - timedelta(days=CAPACITY_GROWTH_DAYS)).isoformat()
+    # Newest first, in max_rows-sized pages: PostgREST caps a response at 1000 rows, and if
+    # the history outgrows the cap it's the oldest samples that should be dropped
+    rows: list = []
+    while len(rows) < 50000:
         try:
-            ev_res = supabase.table("seating_events").delete().eq("restaurant_id", rid).execute()
-            freed["seating_events"] += len(ev_res.data or [])
-        except Exception as ex:
-            print(f"[owner/clear] seating_events delete failed for {rid}: {ex}")
+            batch = (supabase.table("capacity_samples")
+                     .select("taken_at,table_name,restaurant_id,row_count,total_bytes")
+                     .gte("taken_at", since)
+                     .order("taken_at", desc=True).order("table_name").order("restaurant_id")
+                     .range(len(rows), len(rows) + 999).execute().data or [])
+        except Exception as e:
+            _log("capacity").warning(f"sample history unavailable: {e}")
+            return
+        rows += batch
+        if len(batch) < 1000:
+            break
+    else:
+        # Capped: the oldest sample time may be only partly loaded
+        oldest = rows[-1]["taken_at"]
+        rows = [r for r in rows if r["taken_at"] != oldest]
+    by_time: dict = {}
+    for r in rows:
+        ts   = datetime.fromisoformat(r["taken_at"].replace("Z", "+00:00")).timestamp()
+        flat = by_time.setdefault(ts, {})
+        if r.get("restaurant_id"):
+            key = f"rid:{r['restaurant_id']}"
+            flat[key] = (flat.get(key, (0, None))[0] + int(r["row_count"]), None)
+        elif not r["table_name"].startswith("rid:"):
+            # Older builds also saved the rid:<id> totals; they're rebuilt from the rows above
+            flat[r["table_name"]] = (int(r["row_count"]), r.get("total_bytes"))
+    with _capacity_lock:
+        _capacity_hist[:0] = sorted(by_time.items())
+
+
+def _capacity_record(snap: dict):
+    ts   = datetime.fromisoformat(snap["taken_at"]).replace(tzinfo=timezone.utc).timestamp()
+    flat = {t: (v["rows"], v["bytes"]) for t, v in snap["tables"].items()}
+    flat["_database"] = (0, snap["db_bytes"])
+    for rid, per in snap["restaurants"].items():
+        flat[f"rid:{rid}"] = (sum(n for n in per.values() if n >= 0), None)
+    with _capacity_lock:
+        _capacity_hist.append((ts, flat))
+        cutoff = ts - CAPACITY_GROWTH_DAYS * 86400
+        while _capacity_hist and _capacity_hist[0][0] < cutoff:
+            _capacity_hist.pop(0)
+    # rid:<id> totals aren't stored — _capacity_seed sums them from the per-restaurant rows
+    rows = [{"taken_at": snap["taken_at"], "table_name": t, "restaurant_id": "",
+             "row_count": r, "total_bytes": b} for t, (r, b) in flat.items() if not t.startswith("rid:")]
+    rows += [{"taken_at": snap["taken_at"], "table_name": t, "restaurant_id": rid, "row_count": n}
+             for rid, per in snap["restaurants"].items() for t, n in per.items() if n >= 0]
+    try:
+        supabase.table("capacity_samples").insert(rows).execute()
+    except Exception as e:
+        _log("capacity").warning(f"sample insert failed: {e}")
+
+
+def _slope_per_day(points: list) -> Optional[float]:
+    """Least-squares slope of [(epoch, value)] in units per day; None with < 2 points or < 1h span."""
+    if len(points) < 2 or points[-1][0] - points[0][0] < 3600:
+        return None
+    n  = len(points)
+    mx = sum(p[0] for p in points) / n
+    my = sum(p[1] for p in points) / n
+    den = sum((p[0] - mx) ** 2 for p in points)
+    return sum((p[0] - mx) * (p[1] - my) for p in points) / den * 86400 if den else None
+
+
+def _capacity_growth(snap: dict) -> dict:
+    with _capacity_lock:
+        hist = list(_capacity_hist)
+
+    def _rate(key: str) -> dict:
+        rows  = [(ts, v[key][0]) for ts, v in hist if key in v and v[key][0] >= 0]
+        sizes = [(ts, v[key][1]) for ts, v in hist if key in v and v[key][1] is not None]
+        return {"rows_per_day": _round_or_none(_slope_per_day(rows)),
+                "bytes_per_day": _round_or_none(_slope_per_day(sizes))}
+
+    growth = {
+        "tables":      {t: _rate(t) for t in snap["tables"]},
+        "restaurants": {rid: _rate(f"rid:{rid}")["rows_per_day"] for rid in snap["restaurants"]},
+        "database":    _rate("_database")["bytes_per_day"],
+    }
+    limit   = SUPABASE_PLAN_DB_MB * 1024 * 1024
+    per_day = growth["database"]
+    if per_day is None:   # no size history — fall back to row growth × average row size
+        rpd = [g["rows_per_day"] for g in growth["tables"].values() if g["rows_per_day"]]
+        per_day = sum(rpd) * CAPACITY_AVG_ROW_BYTES if rpd else None
+    days = (limit - snap["db_bytes"]) / per_day if per_day and per_day > 0 else None
+    from datetime import timedelta
+    projection = {
+        "limit_mb":       SUPABASE_PLAN_DB_MB,
+        "used_mb":        round(snap["db_bytes"] / 1048576, 1),
+        "used_pct":       round(snap["db_bytes"] / limit * 100, 1) if limit else None,
+        "mb_per_day":     round(per_day / 1048576, 3) if per_day else None,
+        "days_to_limit":  round(max(0.0, days), 1) if days is not None else None,
+        "limit_date":     (datetime.now(timezone.utc) + timedelta(days=max(0.0, days))).date().isoformat()
+                          if days is not None else None,
+    }
+    return {"growth": growth, "projection": projection, "samples": len(hist)}
+
+
+def _round_or_none(v: Optional[float]) -> Optional[float]:
+    return round(v, 1) if v is not None else None
+
+
+def _capacity_snapshot(refresh: bool = False) -> dict:
+    with _capacity_lock:
+        cached, at = _capacity_cache["snapshot"], _capacity_cache["at"]
+    if cached and not refresh and time.time() - at < CAPACITY_CACHE_SEC:
+        return cached
+    snap = _capacity_collect()
+    with _capacity_lock:
+        _capacity_cache.update(snapshot=snap, at=time.time())
+    return snap
+
+
+def _capacity_sampler_loop():
+    time.sleep(60)   # let startup seeding settle
+    while True:
         try:
-            q_res = supabase.table("queue_entries").delete().eq("restaurant_id", rid).execute()
-            freed["queue_entries"] += len(q_res.data or [])
-        except Exception as ex:
-            print(f"[owner/clear] queue_entries delete failed for {rid}: {ex}")
-        # Clear in-memory occupant cache so the floor map reflects the empty state
-        prefix = f"{rid}:"
-        with _occupants_lock:
-            for k in [k for k in list(_table_occupants.keys()) if k.startswith(prefix)]:
-                del _table_occupants[k]
-    # All entries gone — clear wait-timer cache too
-    _wait_set_at.clear()
-    print(f"[owner/clear] freed {freed} rows across {len(rids)} restaurants")
-    return {"status": "cleared", "freed": freed, "restaurants": rids}
+            if _is_leader():
+                _capacity_seed()
+                _capacity_record(_capacity_snapshot(refresh=True))
+        except Exception as e:
+            _log("capacity").warning(f"sample failed: {e}")
+        time.sleep(CAPACITY_SAMPLE_SEC)
+
+
+_background(_capacity_sampler_loop, leader=True)
 
 
 @app.get("/owner/capacity")
-def owner_capacity(secret: Optional[str] = None):
-    """Return Supabase row counts for storage capacity monitoring."""
+def owner_capacity(secret: Optional[str] = None, refresh: bool = False):
+    """Row counts, storage, growth rate and plan-limit projection for capacity monitoring.
+    Cached for CAPACITY_CACHE_SEC; pass refresh=true to recount."""
     _check_owner_secret(secret)
-    row_counts: dict = {}
-    for tbl in ["queue_entries", "seating_events", "tables", "restaurants"]:
+    snap = _capacity_snapshot(refresh)
+    return {
+        "supabase_rows": {t: v["rows"] for t, v in snap["tables"].items()},
+        "server_time":   _now(),
+        **snap,
+        **_capacity_growth(snap),
+    }
+
+
+# ── Cold-storage archive ──────────────────────────────────────────────────────
+# Moves queue_entries and seating_events older than ARCHIVE_AFTER_DAYS out of
+# the hot tables into gzipped NDJSON, one file per restaurant, table and
+# business day:  <ARCHIVE_DIR>/<restaurant_id>/<table>/<YYYY-MM-DD>.ndjson.gz
+# Rows are appended (gzip members concatenate) and fsynced before the matching
+# ids are deleted in ARCHIVE_BATCH-sized chunks, so a crash can only duplicate
+# a row in the archive, never lose it — readers dedupe by id. With
+# ARCHIVE_BUCKET set, each batch's day files are uploaded to that Supabase
+# Storage bucket before its rows are deleted. A day file missing locally
+# (Railway disks don't survive redeploys) is first fetched back from the
+# bucket, so the upload extends it instead of replacing it. Without a bucket
+# ARCHIVE_DIR holds the only copy; point it at a volume. Off unless
+# ARCHIVE_AFTER_DAYS is set.
+ARCHIVE_AFTER_DAYS   = int(os.environ.get("ARCHIVE_AFTER_DAYS", "0"))   # 0 = disabled
+ARCHIVE_DIR          = os.environ.get("ARCHIVE_DIR", os.path.join("/tmp", "restaurant-brain-archive"))
+ARCHIVE_BUCKET       = os.environ.get("ARCHIVE_BUCKET", "")
+ARCHIVE_BATCH        = int(os.environ.get("ARCHIVE_BATCH", "500"))
+ARCHIVE_MAX_BATCHES  = int(os.environ.get("ARCHIVE_MAX_BATCHES", "200"))   # per table per restaurant per run
+ARCHIVE_INTERVAL_SEC = int(os.environ.get("ARCHIVE_INTERVAL_SEC", "21600"))
+_ARCHIVE_TABLES      = ("seating_events", "queue_entries")   # events first — they point at entries
+
+_archive_status: dict = {"running": False, "last_run": None, "last_result": None, "last_error": None}
+_archive_lock         = threading.Lock()
+
+
+def _business_date(ts: str) -> str:
+    """Business day (3am UTC rollover) a row's timestamp belongs to."""
+    from datetime import timedelta
+    dt = datetime.fromisoformat(str(ts).replace("Z", "+00:00"))
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return (dt.astimezone(timezone.utc) - timedelta(hours=3)).date().isoformat()
+
+
+def _archive_relpath(rid: str, table: str, day: str) -> str:
+    return f"{rid}/{table}/{day}.ndjson.gz"
+
+
+def _archive_bucket_days(rid: str, table: str, listed: dict) -> set:
+    """Day files already in the bucket for (rid, table), listed once per run. Raises when the
+    bucket can't be listed — without it a local append could shadow an existing object."""
+    if (rid, table) not in listed:
+        objs = supabase.storage.from_(ARCHIVE_BUCKET).list(f"{rid}/{table}", {"limit": 10000}) or []
+        listed[(rid, table)] = {o["name"] for o in objs if o.get("name", "").endswith(".ndjson.gz")}
+    return listed[(rid, table)]
+
+
+def _archive_append(rid: str, table: str, rows: list, listed: dict) -> set:
+    """Append rows to their business-day files and, with ARCHIVE_BUCKET, upload each file.
+    Returns the relative paths touched. Raises if any file isn't durable yet; the caller
+    deletes the hot rows only after this returns."""
+    import gzip
+    by_day: dict = {}
+    for r in rows:
+        by_day.setdefault(_business_date(r.get("created_at") or r.get("arrival_time")), []).append(r)
+    touched = set()
+    for day, day_rows in by_day.items():
+        rel  = _archive_relpath(rid, table, day)
+        path = os.path.join(ARCHIVE_DIR, rel)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if ARCHIVE_BUCKET and not os.path.exists(path) and f"{day}.ndjson.gz" in _archive_bucket_days(rid, table, listed):
+            data = supabase.storage.from_(ARCHIVE_BUCKET).download(rel)
+            with open(path + ".part", "wb") as fh:
+                fh.write(data)
+                fh.flush()
+                os.fsync(fh.fileno())
+            os.replace(path + ".part", path)
+        body = "".join(_json.dumps(r, separators=(",", ":"), default=str) + "\n" for r in day_rows)
+        with open(path, "ab") as fh:
+            fh.write(gzip.compress(body.encode()))
+            fh.flush()
+            os.fsync(fh.fileno())
+        if ARCHIVE_BUCKET:
+            with open(path, "rb") as fh:
+                supabase.storage.from_(ARCHIVE_BUCKET).upload(
+                    rel, fh.read(), {"content-type": "application/gzip", "upsert": "true"})
+            listed.setdefault((rid, table), set()).add(f"{day}.ndjson.gz")
+        touched.add(rel)
+    return touched
+
+
+def _archive_restaurant(rid: str, cutoff: str) -> dict:
+    moved   = {t: 0 for t in _ARCHIVE_TABLES}
+    touched = set()
+    listed: dict = {}
+    for table in _ARCHIVE_TABLES:
+        for _ in range(ARCHIVE_MAX_BATCHES):
+            rows = (supabase.table(table).select("*")
+                    .eq("restaurant_id", rid).lt("created_at", cutoff)
+                    .order("created_at").limit(ARCHIVE_BATCH).execute().data or [])
+            if not rows:
+                break
+            if table == "queue_entries":
+                # Stragglers: seating events logged just after the cutoff for entries before it
+                ids = [r["id"] for r in rows]
+                evs = []
+                for i in range(0, len(ids), 200):
+                    evs += (supabase.table("seating_events").select("*")
+                            .in_("queue_entry_id", ids[i:i + 200]).execute().data or [])
+                if evs:
+                    touched |= _archive_append(rid, "seating_events", evs, listed)
+                    _delete_ids("seating_events", [e["id"] for e in evs])
+                    moved["seating_events"] += len(evs)
+            touched |= _archive_append(rid, table, rows, listed)
+            _delete_ids(table, [r["id"] for r in rows])
+            moved[table] += len(rows)
+            if len(rows) < ARCHIVE_BATCH:
+                break
+    return {"moved": moved, "files": len(touched)}
+
+
+def _archive_run(days: int) -> dict:
+    """Archive every known restaurant. Serialised — a second caller gets the running status."""
+    from datetime import timedelta
+    with _archive_lock:
+        if _archive_status["running"]:
+            return {"status": "already_running"}
+        _archive_status["running"] = True
+    cutoff = (_business_day_start() - timedelta(days=days)).isoformat()
+    result: dict = {"cutoff": cutoff, "restaurants": {}}
+    try:
+        try:
+            rids = [r["id"] for r in supabase.table("restaurants").select("id").execute().data or []]
+        except Exception:
+            rids = _owner_rids(None)
+        for rid in rids:
+            try:
+                result["restaurants"][rid] = _archive_restaurant(rid, cutoff)
+            except Exception as e:
+                result["restaurants"][rid] = {"error": str(e)}
+                _log("archive").warning(f"{rid} failed: {e}")
+        total = sum(sum(r.get("moved", {}).values()) for r in result["restaurants"].values())
+        _log("archive").info(f"moved {total} rows older than {cutoff}")
+        with _archive_lock:
+            _archive_status.update(last_result=result, last_error=None)
+        return result
+    except Exception as e:
+        with _archive_lock:
+            _archive_status["last_error"] = str(e)
+        raise
+    finally:
+        with _archive_lock:
+            _archive_status.update(running=False, last_run=_now())
+
+
+def _archive_loop():
+    time.sleep(300)
+    while True:
+        try:
+            if _is_leader():
+                _archive_run(ARCHIVE_AFTER_DAYS)
+        except Exception as e:
+            _log("archive").warning(f"run failed: {e}")
+        time.sleep(ARCHIVE_INTERVAL_SEC)
+
+
+if ARCHIVE_AFTER_DAYS > 0:
+    _background(_archive_loop, leader=True)
+
+
+def _archive_days(rid: str, table: str) -> list:
+    """Business days with an archive file, from local disk plus the bucket listing."""
+    days = set()
+    local = os.path.join(ARCHIVE_DIR, rid, table)
+    if os.path.isdir(local):
+        days |= {n[:-len(".ndjson.gz")] for n in os.listdir(local) if n.endswith(".ndjson.gz")}
+    if ARCHIVE_BUCKET:
         try:
-            res = supabase.table(tbl).select("id").limit(10000).execute()
-            row_counts[tbl] = len(res.data or [])
-        except Exception as ex:
-            row_counts[tbl] = -1
-            print(f"[owner/capacity] row count failed for {tbl}: {ex}")
-    return {"supabase_rows": row_counts, "server_time": _now()}
+            for obj in supabase.storage.from_(ARCHIVE_BUCKET).list(f"{rid}/{table}", {"limit": 10000}) or []:
+                if obj.get("name", "").endswith(".ndjson.gz"):
+                    days.add(obj["name"][:-len(".ndjson.gz")])
+        except Exception as e:
+            _log("archive").warning(f"bucket list failed: {e}")
+    return sorted(days)
+
+
+def _archive_read(rid: str, table: str, day: str) -> list:
+    """Rows archived for one business day, deduplicated by id (last copy wins)."""
+    import gzip
+    path = os.path.join(ARCHIVE_DIR, _archive_relpath(rid, table, day))
+    if not os.path.exists(path) and ARCHIVE_BUCKET:
+        try:
+            data = supabase.storage.from_(ARCHIVE_BUCKET).download(_archive_relpath(rid, table, day))
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "wb") as fh:
+                fh.write(data)
+        except Exception as e:
+            _log("archive").warning(f"download failed for {rid}/{table}/{day}: {e}")
+    if not os.path.exists(path):
+        return []
+    rows: dict = {}
+    with gzip.open(path, "rt", encoding="utf-8") as fh:
+        for line in fh:
+            if line.strip():
+                r = _json.loads(line)
+                rows[r.get("id")] = r
+    return list(rows.values())
+
+
+@app.get("/owner/archive")
+def owner_archive(restaurant_ids: Optional[str] = None, secret: Optional[str] = None):
+    """Archive status plus the business days archived per restaurant and table."""
+    _check_owner_secret(secret)
+    with _archive_lock:
+        status = dict(_archive_status)
+    return {
+        **status,
+        "after_days": ARCHIVE_AFTER_DAYS,
+        "bucket":     ARCHIVE_BUCKET or None,
+        "days":       {rid: {t: _archive_days(rid, t) for t in _ARCHIVE_TABLES} for rid in _owner_rids(restaurant_ids)},
+    }
+
+
+@app.post("/owner/archive/run")
+def owner_archive_run(background_tasks: BackgroundTasks, days: Optional[int] = None, secret: Optional[str] = None):
+    """Archive rows older than `days` (default ARCHIVE_AFTER_DAYS) now, in the background."""
+    _check_owner_secret(secret)
+    days = days if days is not None else ARCHIVE_AFTER_DAYS
+    if days < 1:
+        raise HTTPException(status_code=400, detail="days must be at least 1 (or set ARCHIVE_AFTER_DAYS)")
+    background_tasks.add_task(_archive_run, days)
+    return {"status": "started", "days": days}
+
+
+@app.get("/owner/archive/rows")
+def owner_archive_rows(restaurant_id: str, table: str, start: str, end: Optional[str] = None,
+                       secret: Optional[str] = None):
+    """Archived rows for business days start..end (YYYY-MM-DD, inclusive)."""
+    _check_owner_secret(secret)
+    if table not in _ARCHIVE_TABLES:
+        raise HTTPException(status_code=400, detail=f"table must be one of {list(_ARCHIVE_TABLES)}")
+    end  = end or start
+    rows = []
+    for day in _archive_days(restaurant_id, table):
+        if start <= day <= end:
+            rows += _archive_read(restaurant_id, table, day)
+    return {"restaurant_id": restaurant_id, "table": table, "start": start, "end": end,
+            "rows": rows, "total": len(rows)}
 
 
 # ── Client management (owner-only) ─────────────────────────────────────────────
@@ -2887,7 +7001,7 @@ def owner_clients_list(secret: Optional[str] = None):
             })
         return {"clients": clients}
     except Exception as e:
-        print(f"[owner/clients GET] {e}")
+        _log("owner.clients.get").warning(f"{e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 
@@ -2950,7 +7064,7 @@ def owner_create_client(req: CreateClientRequest, secret: Optional[str] = None):
             "menu_config":   _json.dumps({"sections": []}),
             "floor_plan":    _json.dumps([]),
         }).execute()
-        print(f"[owner/clients POST] Created restaurant '{req.name}' slug='{slug}' id={rid}")
+        _log("owner.clients.post").info(f"Created restaurant '{req.name}' slug='{slug}' id={rid}")
         return {
             "ok":            True,
             "restaurant_id": rid,
@@ -2961,7 +7075,7 @@ def owner_create_client(req: CreateClientRequest, secret: Optional[str] = None):
     except HTTPException:
         raise
     except Exception as e:
-        print(f"[owner/clients POST] {e}")
+        _log("owner.clients.post").warning(f"{e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 
@@ -3010,7 +7124,7 @@ def patch_client(restaurant_id: str, req: ClientUpdateRequest, secret: Optional[
 
         return {"ok": True}
     except Exception as e:
-        print(f"[owner/clients PATCH] {e}")
+        _log("owner.clients.patch").warning(f"{e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 
@@ -3149,9 +7263,9 @@ def save_client_config(restaurant_id: str, req: ClientConfigRequest, secret: Opt
                     supabase.table("restaurant_configs").update({"menu_config": menu_json, "updated_at": datetime.now(timezone.utc).isoformat()}).eq("restaurant_id", _WALNUT_SOUTHSIDE_ID).execute()
                 else:
                     supabase.table("restaurant_configs").insert({"restaurant_id": _WALNUT_SOUTHSIDE_ID, "menu_config": menu_json, "updated_at": datetime.now(timezone.utc).isoformat()}).execute()
-                print(f"[walnut-mirror] Copied menu from Original → Southside ({len(req.menu_config.get('sections', []))} sections)")
+                _log("walnut-mirror").info(f"Copied menu from Original → Southside ({len(req.menu_config.get('sections', []))} sections)")
             except Exception as mirror_err:
-                print(f"[walnut-mirror] WARNING: failed to copy menu to Southside: {mirror_err}")
+                _log("walnut-mirror").warning(f"failed to copy menu to Southside: {mirror_err}")
                 # Don't raise — the primary save succeeded
 
         return {"ok": True}
@@ -3179,7 +7293,7 @@ def batch_save_tables(restaurant_id: str, req: BatchTablesRequest, secret: Optio
             supabase.table("tables").insert(rows).execute()
         return {"ok": True, "count": len(rows)}
     except Exception as e:
-        print(f"[tables/batch] {e}")
+        _log("tables.batch").warning(f"{e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 
@@ -3424,7 +7538,7 @@ def _save_billing(restaurant_id: str, patch: dict):
                 "settings": _json.dumps({"billing": patch}),
             }).execute()
     except Exception as e:
-        print(f"[billing _save] {e}")
+        _log("billing.save").warning(f"{e}")
 
 
 def _get_restaurant_info(restaurant_id: str) -> dict:
@@ -3612,7 +7726,7 @@ def billing_owner_status(restaurant_id: str, secret: Optional[str] = None):
             ],
         }
     except Exception as e:
-        print(f"[billing owner status] {e}")
+        _log("billing.owner_status").warning(f"{e}")
         return {"billing_enabled": True, "stripe_configured": True, "error": str(e), **billing}
 
 
@@ -3810,7 +7924,7 @@ def client_billing_status(slug: str):
             "custom_charges":       billing.get("custom_charges", []),
         }
     except Exception as e:
-        print(f"[client billing status] {e}")
+        _log("billing.client_status").warning(f"{e}")
         return {"billing_enabled": False, "error": str(e)}
 
 
@@ -3865,7 +7979,7 @@ async def stripe_webhook(request: Request):
     event_type = event["type"]
     data_obj   = event["data"]["object"]
 
-    print(f"[stripe webhook] {event_type}")
+    _log("stripe.webhook").info(f"{event_type}")
 
     # Find restaurant_id from Stripe customer metadata
     def _rid_from_customer(customer_id: str) -> Optional[str]:
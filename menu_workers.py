@@ -0,0 +1,52 @@
+"""Process-pool workers for the menu parse pipeline in main.py.
+
+Kept out of main.py on purpose: the pool starts its children from a forkserver
+that preloads only this module, so a child never re-imports the app (its
+startup threads, clients and locks) nor inherits them through a fork.
+"""
+from typing import Optional
+
+
+def normalize_image(data: bytes) -> Optional[bytes]:
+    """Decode any Pillow-readable image, cap at 1024px, re-encode as JPEG."""
+    try:
+        from pillow_heif import register_heif_opener as _reg_heif
+        _reg_heif()
+    except ImportError:
+        pass
+    try:
+        from PIL import Image as _PIL
+        import io as _io
+        img = _PIL.open(_io.BytesIO(data))
+        if max(img.size) > 1024:
+            img.thumbnail((1024, 1024), _PIL.LANCZOS)
+        img = img.convert("RGB")
+        buf = _io.BytesIO()
+        img.save(buf, format="JPEG", quality=85)
+        return buf.getvalue()
+    except Exception:
+        # Pillow couldn't open this file — skip rather than sending binary garbage
+        return None
+
+
+def split_pdf(data: bytes) -> tuple:
+    """Split a PDF into single-page PDFs. Returns (pages, error); on failure, or without
+    pypdf, the document is one chunk. The caller logs error — children have no log setup."""
+    try:
+        from pypdf import PdfReader, PdfWriter
+        import io as _io
+        reader = PdfReader(_io.BytesIO(data))
+        if len(reader.pages) <= 1:
+            return [data], None
+        pages = []
+        for page in reader.pages:
+            writer = PdfWriter()
+            writer.add_page(page)
+            buf = _io.BytesIO()
+            writer.write(buf)
+            pages.append(buf.getvalue())
+        return pages, None
+    except ImportError:
+        return [data], None
+    except Exception as e:
+        return [data], str(e)
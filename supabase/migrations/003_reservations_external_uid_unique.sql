@@ -0,0 +1,17 @@
+-- Unique (restaurant_id, external_uid) for the bulk iCal upsert
+-- Run in Supabase dashboard → SQL Editor
+-- Safe to run multiple times
+
+-- Drop duplicate synced rows, keeping the most recently created one per UID
+DELETE FROM reservations r
+USING reservations newer
+WHERE r.external_uid IS NOT NULL
+  AND r.restaurant_id = newer.restaurant_id
+  AND r.external_uid  = newer.external_uid
+  AND (r.created_at, r.id) < (newer.created_at, newer.id);
+
+-- Replaces the non-unique idx_reservations_external_uid from 001
+DROP INDEX IF EXISTS idx_reservations_external_uid;
+
+CREATE UNIQUE INDEX IF NOT EXISTS uq_reservations_external_uid
+  ON reservations (restaurant_id, external_uid);
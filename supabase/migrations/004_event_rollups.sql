@@ -0,0 +1,23 @@
+-- Time-series rollups for camera / delivery / throughput events
+-- Run in Supabase dashboard → SQL Editor
+-- Safe to run multiple times (IF NOT EXISTS)
+--
+-- The API keeps 1-minute, 15-minute and 1-hour aggregates in memory and
+-- upserts the buckets that changed every ROLLUP_PERSIST_SEC; on boot it reloads
+-- recent buckets from here so a deploy doesn't blank the series.
+
+CREATE TABLE IF NOT EXISTS event_rollups (
+  restaurant_id TEXT        NOT NULL,
+  metric        TEXT        NOT NULL,   -- "<stream>.<key>", e.g. camera.lobby, delivery.doordash
+  resolution    TEXT        NOT NULL,   -- "1m" | "15m" | "1h"
+  bucket_start  TIMESTAMPTZ NOT NULL,
+  count         INTEGER     NOT NULL,
+  sum           DOUBLE PRECISION NOT NULL,
+  min           DOUBLE PRECISION NOT NULL,
+  max           DOUBLE PRECISION NOT NULL,
+  last          DOUBLE PRECISION NOT NULL,
+  PRIMARY KEY (restaurant_id, metric, resolution, bucket_start)
+);
+
+CREATE INDEX IF NOT EXISTS idx_event_rollups_recent
+  ON event_rollups (resolution, bucket_start);
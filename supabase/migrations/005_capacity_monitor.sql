@@ -0,0 +1,34 @@
+-- Capacity monitor: table-size stats RPC + growth samples
+-- Run in Supabase dashboard → SQL Editor
+-- Safe to run multiple times
+--
+-- capacity_stats() reads planner statistics from pg_class instead of counting
+-- rows, so /owner/capacity costs one cheap call no matter how big tables get.
+-- est_rows is -1 for tables Postgres hasn't analyzed yet; the API falls back to
+-- a PostgREST estimated count for those.
+
+CREATE OR REPLACE FUNCTION capacity_stats()
+RETURNS TABLE (table_name TEXT, est_rows BIGINT, total_bytes BIGINT, db_bytes BIGINT)
+LANGUAGE sql STABLE SECURITY DEFINER
+SET search_path = public, pg_catalog
+AS $$
+  SELECT c.relname::TEXT,
+         c.reltuples::BIGINT,
+         pg_total_relation_size(c.oid),
+         pg_database_size(current_database())
+    FROM pg_class c
+    JOIN pg_namespace n ON n.oid = c.relnamespace
+   WHERE n.nspname = 'public' AND c.relkind = 'r';
+$$;
+
+CREATE TABLE IF NOT EXISTS capacity_samples (
+  taken_at      TIMESTAMPTZ NOT NULL,
+  table_name    TEXT        NOT NULL,   -- "_database" for the whole-database size row
+  restaurant_id TEXT        NOT NULL DEFAULT '',   -- '' = whole table
+  row_count     BIGINT      NOT NULL,
+  total_bytes   BIGINT,
+  PRIMARY KEY (taken_at, table_name, restaurant_id)
+);
+
+CREATE INDEX IF NOT EXISTS idx_capacity_samples_table
+  ON capacity_samples (table_name, restaurant_id, taken_at);
@@ -0,0 +1,25 @@
+-- Progress records for batched bulk deletes (/owner/analytics/clear, /admin/clear-day)
+-- Run in Supabase dashboard → SQL Editor
+-- Safe to run multiple times (IF NOT EXISTS)
+--
+-- Each job is a list of steps (table + filters); the API deletes matching ids
+-- in PURGE_BATCH chunks and upserts the row after every batch, so a job that
+-- dies with the process is resumed on the next boot.
+
+CREATE TABLE IF NOT EXISTS purge_jobs (
+  id             TEXT        PRIMARY KEY,
+  kind           TEXT        NOT NULL,   -- "analytics_clear" | "clear_day"
+  restaurant_ids TEXT[]      NOT NULL,
+  steps          JSONB       NOT NULL,
+  status         TEXT        NOT NULL,   -- queued | running | done | failed
+  error          TEXT,
+  created_at     TIMESTAMPTZ NOT NULL DEFAULT now(),
+  updated_at     TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+
+CREATE INDEX IF NOT EXISTS idx_purge_jobs_pending
+  ON purge_jobs (status) WHERE status IN ('queued', 'running');
+
+-- Batches select ids by restaurant and then delete by primary key
+CREATE INDEX IF NOT EXISTS idx_seating_events_restaurant_id
+  ON seating_events (restaurant_id, id);
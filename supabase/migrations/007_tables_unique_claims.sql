@@ -0,0 +1,95 @@
+-- One row per physical table + atomic claim RPCs
+-- Run in Supabase dashboard → SQL Editor
+-- Safe to run multiple times
+--
+-- Duplicate (restaurant_id, table_number) rows piled up when startup seeding
+-- raced on early deploys, and the API has carried dedup/sibling-claim code ever
+-- since. This collapses each group onto its most recently updated row (the same
+-- row _dedup_tables would have shown), re-points seating_events at it, and adds
+-- the unique constraint so duplicates can't come back. Once tables_claim_ready()
+-- returns true the API drops its dedup pass and claims through the RPCs below.
+
+BEGIN;
+
+LOCK TABLE tables IN SHARE ROW EXCLUSIVE MODE;
+
+CREATE TEMP TABLE _table_dupes ON COMMIT DROP AS
+SELECT id, keeper_id
+  FROM (
+    SELECT id,
+           first_value(id) OVER w AS keeper_id,
+           row_number()    OVER w AS rn
+      FROM tables
+    WINDOW w AS (PARTITION BY restaurant_id, table_number
+                 ORDER BY updated_at DESC NULLS LAST, id)
+  ) ranked
+ WHERE rn > 1;
+
+UPDATE seating_events se
+   SET table_id = d.keeper_id
+  FROM _table_dupes d
+ WHERE se.table_id = d.id;
+
+DELETE FROM tables t
+ USING _table_dupes d
+ WHERE t.id = d.id;
+
+DO $$
+BEGIN
+  IF NOT EXISTS (SELECT 1 FROM pg_constraint WHERE conname = 'tables_restaurant_table_number_key') THEN
+    ALTER TABLE tables
+      ADD CONSTRAINT tables_restaurant_table_number_key UNIQUE (restaurant_id, table_number);
+  END IF;
+END $$;
+
+COMMIT;
+
+-- Backs claim_next_table's scan: free tables for a restaurant, smallest first
+CREATE INDEX IF NOT EXISTS idx_tables_free_by_capacity
+  ON tables (restaurant_id, capacity, table_number) WHERE status = 'available';
+
+CREATE OR REPLACE FUNCTION tables_claim_ready()
+RETURNS BOOLEAN
+LANGUAGE sql STABLE
+AS $$
+  SELECT EXISTS (SELECT 1 FROM pg_constraint WHERE conname = 'tables_restaurant_table_number_key');
+$$;
+
+-- Occupy one specific table if it is still available. Returns the row, or nothing
+-- if someone else got there first.
+CREATE OR REPLACE FUNCTION claim_table(p_table_id tables.id%TYPE)
+RETURNS SETOF tables
+LANGUAGE sql VOLATILE
+AS $$
+  UPDATE tables
+     SET status = 'occupied', updated_at = now()
+   WHERE id = p_table_id AND status = 'available'
+  RETURNING *;
+$$;
+
+-- Occupy the smallest free table that fits the party, skipping table numbers the
+-- caller is holding (reservations, seats not yet written back). SKIP LOCKED lets
+-- concurrent seat calls each take a different table instead of queueing on one.
+CREATE OR REPLACE FUNCTION claim_next_table(p_restaurant_id tables.restaurant_id%TYPE,
+                                            p_party_size    INTEGER,
+                                            p_exclude       INTEGER[] DEFAULT '{}')
+RETURNS SETOF tables
+LANGUAGE sql VOLATILE
+AS $$
+  WITH pick AS (
+    SELECT id
+      FROM tables
+     WHERE restaurant_id = p_restaurant_id
+       AND status = 'available'
+       AND capacity >= p_party_size
+       AND NOT (table_number::INTEGER = ANY (p_exclude))
+     ORDER BY capacity, table_number
+     LIMIT 1
+       FOR UPDATE SKIP LOCKED
+  )
+  UPDATE tables t
+     SET status = 'occupied', updated_at = now()
+    FROM pick
+   WHERE t.id = pick.id
+  RETURNING t.*;
+$$;
@@ -0,0 +1,10 @@
+-- Owner column for purge job claims
+-- Run in Supabase dashboard → SQL Editor
+-- Safe to run multiple times (IF NOT EXISTS)
+--
+-- Each API process stamps the jobs it runs with its replica id and only saves
+-- progress while the row still carries it. A job left queued/running is
+-- resumed by whichever process first flips it with a conditional update once
+-- updated_at has gone PURGE_LEASE_SEC without a save.
+
+ALTER TABLE purge_jobs ADD COLUMN IF NOT EXISTS owner TEXT;
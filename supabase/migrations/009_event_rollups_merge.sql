@@ -0,0 +1,28 @@
+-- Additive rollup writes, so several API workers can share a bucket
+-- Run in Supabase dashboard → SQL Editor
+-- Safe to run multiple times
+--
+-- Each worker keeps its own in-memory rings and persists only what it added
+-- since its last save. merge_event_rollups folds those deltas into the stored
+-- bucket instead of overwriting it: counts and sums add up, min/max widen, and
+-- last is the newest write's. Until this exists the API upserts whole buckets,
+-- which is only correct with a single worker.
+
+CREATE OR REPLACE FUNCTION merge_event_rollups(p_rows JSONB)
+RETURNS VOID
+LANGUAGE sql VOLATILE
+AS $$
+  INSERT INTO event_rollups AS e
+         (restaurant_id, metric, resolution, bucket_start, count, sum, min, max, last)
+  SELECT r.restaurant_id, r.metric, r.resolution, r.bucket_start, r.count, r.sum, r.min, r.max, r.last
+    FROM jsonb_to_recordset(p_rows) AS r(restaurant_id TEXT, metric TEXT, resolution TEXT,
+                                         bucket_start TIMESTAMPTZ, count INTEGER,
+                                         sum DOUBLE PRECISION, min DOUBLE PRECISION,
+                                         max DOUBLE PRECISION, last DOUBLE PRECISION)
+  ON CONFLICT (restaurant_id, metric, resolution, bucket_start) DO UPDATE
+     SET count = e.count + EXCLUDED.count,
+         sum   = e.sum + EXCLUDED.sum,
+         min   = LEAST(e.min, EXCLUDED.min),
+         max   = GREATEST(e.max, EXCLUDED.max),
+         last  = EXCLUDED.last;
+$$;